@@ -0,0 +1 @@
+"""Benchmarks for the scraping and standardization pipeline."""
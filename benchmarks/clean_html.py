@@ -0,0 +1,93 @@
+"""Golden check and benchmark of the bulk HTML cleaning.
+
+Checks that `clean_html` reproduces the `content` saved in the category files
+(and the BeautifulSoup implementation) byte for byte, then compares the time
+to clean every saved position statement.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from src.html_cleaning import clean_html, clean_html_bulk, clean_html_soup
+from src.scraper_anthem import OUTPUT_DIR
+
+
+def load_policies(data_dir):
+    """Load the saved policies of every category file."""
+    policies = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "*_policies.json"))):
+        with open(path, encoding="utf-8") as file:
+            policies.extend(json.load(file))
+    return policies
+
+
+def golden_check(policies):
+    """Count the policies whose cleaned content differs from the saved one."""
+    mismatches = 0
+    for policy in policies:
+        cleaned = clean_html(policy["html_content"])
+        if cleaned != policy["content"] or cleaned != clean_html_soup(
+            policy["html_content"]
+        ):
+            mismatches += 1
+            print(f"! Mismatch for {policy['url']}")
+    return mismatches
+
+
+def timed(label, clean, fragments):
+    """Clean the fragments, printing the elapsed time."""
+    start_time = time.perf_counter()
+    results = list(clean(fragments))
+    elapsed = time.perf_counter() - start_time
+    print(f"- {label:<28} {elapsed:8.3f} s ({len(fragments) / elapsed:8.0f} fragments/s)")
+    return results
+
+
+def main():
+    """Run the golden check and the benchmark."""
+    parser = argparse.ArgumentParser(
+        description="Check and benchmark the bulk HTML cleaning."
+    )
+    parser.add_argument(
+        "--data", type=str, default=OUTPUT_DIR, help="Folder of category JSON files."
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=20,
+        help="Number of copies of the saved fragments to clean in the benchmark.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Processes of the bulk cleaning."
+    )
+    args = parser.parse_args()
+
+    policies = load_policies(args.data)
+    mismatches = golden_check(policies)
+    print(f"Golden check: {len(policies) - mismatches}/{len(policies)} identical.")
+
+    fragments = [policy["html_content"] for policy in policies] * args.repeat
+    print(f"Cleaning {len(fragments)} fragments:")
+    reference = timed(
+        "BeautifulSoup, serial",
+        lambda fragments: map(clean_html_soup, fragments),
+        fragments,
+    )
+    timed("clean_html, serial", lambda fragments: map(clean_html, fragments), fragments)
+    bulk = timed(
+        "clean_html_bulk",
+        lambda fragments: clean_html_bulk(fragments, workers=args.workers),
+        fragments,
+    )
+    if bulk != reference:
+        mismatches += 1
+        print("! The bulk cleaning differs from BeautifulSoup.")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Encoder of the compact output format, writing saved criteria as the model would.
+
+The OpenAI stub answers the requests with the compact instructions by
+compacting the stored criteria of their position statements with it. The
+completion tokens it saves are those of this encoder, always quoting the
+statement exactly, not of a model following the instructions.
+"""
+
+from src.compact_schema import NECESSITY_CODES, CompactCodec, find_span
+from src.criteria_schema import CRITERIA_KEYS, LOGIC_OPERATORS
+
+NECESSITY_NAMES = {name: code for code, name in NECESSITY_CODES.items()}
+# Texts of more words than this are written as spans
+SPAN_MIN_WORDS = 10
+# Words at each end of a span, more when fewer do not resolve to the text
+SPAN_WORDS = [4, 6, 8]
+
+
+class CompactEncoder(CompactCodec):
+    """Compact the criteria of a position statement, in order, the inverse of the expansion."""
+
+    def compact_text(self, value):
+        """Compact a text into a span, if it is long and copied from the statement."""
+        words = value.split(" ") if isinstance(value, str) else []
+        if len(words) <= SPAN_MIN_WORDS:
+            return value
+        for size in SPAN_WORDS:
+            if 2 * size >= len(words):
+                break
+            prefix, suffix = " ".join(words[:size]), " ".join(words[-size:])
+            try:
+                start, end = find_span(self.text, prefix, suffix, self.cursor)
+            except ValueError:
+                break
+            if self.text[start:end] == value:
+                self.cursor = end
+                return [prefix, suffix]
+        return value
+
+    def compact_conditions(self, node):
+        """Compact a conditions tree, the other values being kept as they are."""
+        if isinstance(node, dict) and len(node) == 1 and next(iter(node)) in LOGIC_OPERATORS:
+            operator, items = next(iter(node.items()))
+            if isinstance(items, list):
+                return {operator: [self.compact_conditions(item) for item in items]}
+        if isinstance(node, dict) and set(node) == {"desc", "conditions"}:
+            compact = {"d": self.compact_text(node["desc"])}
+            if node["conditions"] is not None:
+                compact["c"] = self.compact_conditions(node["conditions"])
+            return compact
+        return node
+
+    def compact_criterion(self, criterion):
+        """Compact a criteria object, an object with other keys being kept as it is."""
+        if not isinstance(criterion, dict) or set(criterion) != set(CRITERIA_KEYS):
+            return criterion
+        compact = {}
+        if criterion["medical_act"] != self.medical_act or self.medical_act is None:
+            compact["a"] = self.medical_act = criterion["medical_act"]
+        if criterion["sub_medical_act"] is not None:
+            compact["s"] = criterion["sub_medical_act"]
+        compact["n"] = NECESSITY_NAMES.get(criterion["necessity_type"], criterion["necessity_type"])
+        compact["d"] = self.compact_text(criterion["description"])
+        if criterion["conditions"] is not None:
+            compact["c"] = self.compact_conditions(criterion["conditions"])
+        return compact
+
+
+def compact_criteria(criteria, position_statement: str):
+    """Compact the criteria of a position statement, as the model answers them in the compact format."""
+    encoder = CompactEncoder(position_statement)
+    if isinstance(criteria, list):
+        return [encoder.compact_criterion(criterion) for criterion in criteria]
+    return encoder.compact_criterion(criteria)
@@ -0,0 +1,186 @@
+"""Micro-benchmark of the per-page document extraction in the browser.
+
+Compares the WebDriver round-trips and time spent extracting an already loaded
+policy page with the element-by-element extraction the scraper used to do
+(`legacy_details` + `legacy_position_statement`), and with the single-script
+`extract_document`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+
+from src.scraper_anthem import (
+    ALLOWED_CATEGORIES,
+    DETAIL_CELLS,
+    DETAIL_LABELS,
+    OUTPUT_DIR,
+    AnthemScraper,
+)
+
+# Collect the elements after the heading until the next <table>
+POSITION_STATEMENT_SCRIPT = """
+var heading = arguments[0];
+var collect = false;
+var content = [];
+var elements = document.body.getElementsByTagName('*');
+for (var elem of elements) {
+    if (elem === heading) {
+        collect = true;
+        continue;
+    }
+    if (collect) {
+        if (elem.tagName === 'TABLE') break;
+        if (['P', 'UL', 'LI'].includes(elem.tagName)) {
+            content.push(elem.outerHTML);
+        }
+    }
+}
+return content;
+"""
+
+
+class CommandCounter:
+    """Count the commands sent by a WebDriver to its driver process."""
+
+    def __init__(self, driver):
+        self.count = 0
+        self._execute = driver.execute
+        driver.execute = self._counting_execute
+
+    def _counting_execute(self, driver_command, params=None):
+        """Forward the command to the driver, counting it."""
+        self.count += 1
+        return self._execute(driver_command, params)
+
+
+def legacy_details(scraper):
+    """Extract the details of the document, one WebDriver call per cell."""
+    try:
+        # Wait for the 'docDetails' table to load
+        doc_details_table = scraper.visits.readiness.wait(
+            scraper.driver, EC.visibility_of_element_located((By.ID, "docDetails"))
+        )
+        return {
+            key: doc_details_table.find_element(By.XPATH, DETAIL_CELLS[key])
+            .text.replace(label, "")
+            .strip()
+            for key, label in DETAIL_LABELS.items()
+        }
+    except TimeoutException:
+        print("Failed to find the document details table.")
+        return {}
+
+
+def legacy_position_statement(scraper):
+    """Extract the content under the 'Position Statement' heading, after waiting for it."""
+    try:
+        position_heading = scraper.visits.readiness.wait(
+            scraper.driver,
+            EC.visibility_of_element_located(
+                (By.XPATH, "//strong[contains(text(), 'Position Statement')]")
+            ),
+        )
+    except TimeoutException:
+        print("Position Statement not found or page format different.")
+        return ""
+    content_elements = scraper.driver.execute_script(
+        POSITION_STATEMENT_SCRIPT, position_heading
+    )
+    if not content_elements:
+        print("An error occurred: No content was extracted.")
+        return ""
+    return "\n".join(content_elements)
+
+
+def measure(counter, extract):
+    """Run an extraction, returning its result, round-trips and milliseconds."""
+    start_count = counter.count
+    start_time = time.perf_counter()
+    result = extract()
+    elapsed = (time.perf_counter() - start_time) * 1000
+    return result, counter.count - start_count, elapsed
+
+
+def run(category: str, pages: int, headful: bool = False):
+    """Benchmark the two extraction paths on the first pages of a category."""
+    with open(
+        os.path.join(OUTPUT_DIR, f"{category}_policies.json"), encoding="utf-8"
+    ) as file:
+        links = [policy["url"] for policy in json.load(file)][:pages]
+
+    scraper = AnthemScraper(headful=headful, category=category)
+    counter = CommandCounter(scraper.driver)
+    results = {"legacy": [], "single": []}
+    try:
+        for link in links:
+            scraper.driver.get(link)
+
+            legacy, legacy_calls, legacy_ms = measure(
+                counter,
+                lambda: (
+                    legacy_details(scraper),
+                    legacy_position_statement(scraper),
+                ),
+            )
+            single, single_calls, single_ms = measure(
+                counter, scraper.extract_document
+            )
+            if legacy != single:
+                print(f"! Extractions differ for {link}")
+            results["legacy"].append((legacy_calls, legacy_ms))
+            results["single"].append((single_calls, single_ms))
+    finally:
+        scraper.close()
+
+    print(f"Extraction over {len(links)} {category} pages:")
+    report(results)
+
+
+def report(results):
+    """Print the per-page round-trips and timings of both extraction paths."""
+    for name, samples in results.items():
+        calls = statistics.mean(sample[0] for sample in samples)
+        millis = statistics.median(sample[1] for sample in samples)
+        print(f"- {name:<7} {calls:5.1f} round-trips/page, {millis:8.1f} ms/page (median)")
+    saved_calls = statistics.mean(
+        legacy[0] - single[0]
+        for legacy, single in zip(results["legacy"], results["single"])
+    )
+    saved_ms = statistics.median(
+        legacy[1] - single[1]
+        for legacy, single in zip(results["legacy"], results["single"])
+    )
+    print(f"Saved {saved_calls:.1f} round-trips and {saved_ms:.1f} ms per page.")
+
+
+def main():
+    """Run the extraction micro-benchmark."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the per-page document extraction in the browser."
+    )
+    parser.add_argument(
+        "--cat",
+        type=str,
+        default="radiology",
+        choices=ALLOWED_CATEGORIES,
+        help="Category whose saved policy URLs are used as benchmark pages.",
+    )
+    parser.add_argument(
+        "--pages", type=int, default=10, help="Number of pages to benchmark."
+    )
+    parser.add_argument(
+        "--headful", action="store_true", help="Run browser in headful mode."
+    )
+    args = parser.parse_args()
+    run(args.cat, args.pages, args.headful)
+
+
+if __name__ == "__main__":
+    main()
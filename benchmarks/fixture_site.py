@@ -0,0 +1,352 @@
+"""Local replica of the Anthem medical policy site, served from the saved data.
+
+The listing page reproduces what the scraper relies on: the disclaimer modal,
+the two filter dropdowns, the pagination label and link and the item links, all
+rendered by JavaScript after a configurable latency. Each policy document is
+served from the archive when it was archived, otherwise it is rebuilt from its
+saved record, with ETag / Last-Modified validators so the incremental mode can
+be exercised.
+
+The saved position statement is the output of the extraction walk, which
+collects every paragraph, list and list item, the nested ones included: a list
+is saved whole, then each of its items again. The rebuilt document only keeps
+the outermost elements, so that walking it again gives the saved content.
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import os
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+import lxml.html
+
+from benchmarks.local_server import LocalServer
+from src.html_archive import HtmlArchive
+from src.scraper_anthem import ALLOWED_CATEGORIES, OUTPUT_DIR
+
+LISTING_PATH = "/member/policies/search"
+PAGE_SIZE = 10
+# Documents of another type, only listed until the document type filter is applied
+OTHER_DOCUMENTS = 3
+
+LISTING_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Medical Policies</title>
+<style>
+#modal { position: fixed; top: 0; left: 0; width: 100%; height: 100%; background: #fff; z-index: 10; }
+.dropdown ul { display: none; }
+.dropdown.open ul { display: block; }
+</style>
+</head>
+<body>
+<div id="modal"><p>Disclaimer</p><button class="btn btn-primary">Continue</button></div>
+<div class="dropdown" id="formsDocTypeFilter">
+  <button id="formsDocTypeFilter_button">Document type</button>
+  <ul><li data-value="medicalpolicy">Medical Policy</li><li data-value="clinicalguideline">Clinical Guideline</li></ul>
+</div>
+<div class="dropdown" id="categoryFilter">
+  <button id="categoryFilter_button">Category</button>
+  <ul>__CATEGORY_OPTIONS__</ul>
+</div>
+<div class="pretend-pagination"></div>
+<div id="results"></div>
+<div id="pager"></div>
+<script>
+var DOCUMENTS = __DOCUMENTS__;
+var LATENCY = __LATENCY__;
+var PAGE_SIZE = __PAGE_SIZE__;
+var filters = {};
+var page = 0;
+
+function matching() {
+  return DOCUMENTS.filter(function (doc) {
+    return (!filters.formsDocTypeFilter || doc.type === filters.formsDocTypeFilter) &&
+      (!filters.categoryFilter || doc.category === filters.categoryFilter);
+  });
+}
+
+function render() {
+  var documents = matching();
+  var start = page * PAGE_SIZE;
+  var end = Math.min(start + PAGE_SIZE, documents.length);
+  var label = document.querySelector(".pretend-pagination");
+  label.innerHTML = "<span>Showing " + (documents.length ? start + 1 : 0) + " - " + end + " of " + documents.length + "</span>";
+  var items = "";
+  documents.slice(start, end).forEach(function (doc) {
+    items += '<div class="news-item-wrapper"><div class="article-headline"><a href="' + doc.path + '">' + doc.title + "</a></div></div>";
+  });
+  document.getElementById("results").innerHTML = items;
+  var pager = document.getElementById("pager");
+  pager.innerHTML = end < documents.length ? '<a href="#" aria-label="Go to Next Page">Next</a>' : "";
+}
+
+function update() {
+  // The results are replaced after a server round-trip
+  document.getElementById("results").innerHTML = "";
+  setTimeout(render, LATENCY);
+}
+
+document.querySelector("#modal button").addEventListener("click", function () {
+  document.getElementById("modal").style.display = "none";
+});
+document.querySelectorAll(".dropdown").forEach(function (dropdown) {
+  dropdown.querySelector("button").addEventListener("click", function () {
+    dropdown.classList.toggle("open");
+  });
+  dropdown.querySelectorAll("li").forEach(function (option) {
+    option.addEventListener("click", function () {
+      dropdown.classList.remove("open");
+      filters[dropdown.id] = option.getAttribute("data-value");
+      page = 0;
+      update();
+    });
+  });
+});
+document.getElementById("pager").addEventListener("click", function (event) {
+  event.preventDefault();
+  if (event.target.getAttribute("aria-label") === "Go to Next Page") {
+    page += 1;
+    update();
+  }
+});
+setTimeout(render, LATENCY);
+</script>
+</body>
+</html>
+"""
+
+DOCUMENT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{subject}</title></head>
+<body>
+<table id="docDetails">
+<tr><td colspan="2"><strong>Subject: </strong>{subject}</td></tr>
+<tr><td><strong>Document #: </strong>{document_number}</td><td><strong>Publish Date: </strong>{publish_date}</td></tr>
+<tr><td><strong>Status: </strong>{status}</td><td><strong>Last Review Date: </strong>{last_review_date}</td></tr>
+</table>
+<h2>Description/Scope</h2>
+<p>This document addresses {subject}.</p>
+<p><strong>Position Statement</strong></p>
+{html_content}
+<table><tr><td>Rationale</td></tr></table>
+</body>
+</html>
+"""
+
+
+def outer_html(element):
+    """Serialize an element the way the extraction walk saves it."""
+    return lxml.html.tostring(element, encoding="unicode", with_tail=False).replace(
+        "\xa0", "&nbsp;"
+    )
+
+
+def unwalked_content(html_content):
+    """Get the markup of a saved position statement without the repeated nested elements."""
+    kept, nested = [], []
+    for fragment in lxml.html.fragments_fromstring(html_content):
+        if isinstance(fragment, str):
+            kept.append(fragment)
+            continue
+        serialized = outer_html(fragment)
+        # The walk saves the nested elements of a kept one right after it
+        if nested and serialized == nested[0]:
+            nested.pop(0)
+            continue
+        kept.append(serialized)
+        nested = [outer_html(element) for element in fragment.iterdescendants("p", "ul", "li")]
+    return "\n".join(kept)
+
+
+def render_document(policy):
+    """Rebuild the HTML document of a saved policy record."""
+    fields = {
+        key: html.escape(policy.get(key, ""))
+        for key in (
+            "subject",
+            "document_number",
+            "publish_date",
+            "status",
+            "last_review_date",
+        )
+    }
+    return DOCUMENT_TEMPLATE.format(
+        html_content=unwalked_content(policy["html_content"]), **fields
+    )
+
+
+class FixtureSite:
+    """Documents and listing of the local site, loaded from the saved policies."""
+
+    def __init__(self, data_dir=OUTPUT_DIR, categories=None, latency=0.05):
+        self.latency = latency
+        self.documents = {}
+        # Saved record of each document, by URL path
+        self.records = {}
+        self.listing = []
+        archive = HtmlArchive(os.path.join(data_dir, ".cache", "archive"))
+        for category in categories or ALLOWED_CATEGORIES:
+            path = os.path.join(data_dir, f"{category}_policies.json")
+            if not os.path.isfile(path):
+                continue
+            with open(path, encoding="utf-8") as file:
+                policies = json.load(file)
+            archived = archive.entries(category)
+            for policy in policies:
+                url_path = urlsplit(policy["url"]).path
+                if policy["url"] in archived:
+                    body = archive.get(archived[policy["url"]])
+                else:
+                    body = render_document(policy)
+                self.documents[url_path] = body.encode("utf-8")
+                self.records[url_path] = policy
+                self.listing.append(
+                    {
+                        "path": url_path,
+                        "title": html.escape(policy.get("subject", "")),
+                        "type": "medicalpolicy",
+                        "category": category,
+                    }
+                )
+            for index in range(OTHER_DOCUMENTS):
+                self.listing.append(
+                    {
+                        "path": f"/dam/medpolicies/abc/active/guidelines/cg_{category}_{index}.html",
+                        "title": f"Clinical guideline {index}",
+                        "type": "clinicalguideline",
+                        "category": category,
+                    }
+                )
+        # Same validators for the whole life of the server
+        self.last_modified = formatdate(time.time(), usegmt=True)
+        self.etags = {
+            path: '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+            for path, body in self.documents.items()
+        }
+
+    def categories(self):
+        """Get the categories present in the listing, in order."""
+        return list(dict.fromkeys(item["category"] for item in self.listing))
+
+    def num_policies(self, category):
+        """Get the number of medical policies listed in a category."""
+        return sum(
+            item["category"] == category and item["type"] == "medicalpolicy"
+            for item in self.listing
+        )
+
+    def listing_page(self):
+        """Render the listing page."""
+        options = "".join(
+            f'<li data-value="{category}">{category}</li>'
+            for category in self.categories()
+        )
+        return (
+            LISTING_TEMPLATE.replace("__CATEGORY_OPTIONS__", options)
+            .replace("__DOCUMENTS__", json.dumps(self.listing))
+            .replace("__LATENCY__", str(int(self.latency * 1000)))
+            .replace("__PAGE_SIZE__", str(PAGE_SIZE))
+            .encode("utf-8")
+        )
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    """Serve the listing page and the documents of the fixture site."""
+
+    site = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def send_body(self, status, body, headers=None):
+        """Send a response, omitting the body of HEAD requests."""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def serve(self):
+        """Serve a GET or HEAD request."""
+        path = urlsplit(self.path).path
+        if path == LISTING_PATH:
+            self.send_body(
+                200,
+                self.site.listing_page(),
+                {"Content-Type": "text/html; charset=utf-8"},
+            )
+            return
+        if path not in self.site.documents:
+            self.send_body(404, b"Not found")
+            return
+
+        time.sleep(self.site.latency)
+        validators = {
+            "ETag": self.site.etags[path],
+            "Last-Modified": self.site.last_modified,
+        }
+        if self.headers.get("If-None-Match") == validators["ETag"] or (
+            self.headers.get("If-Modified-Since") == validators["Last-Modified"]
+        ):
+            self.send_body(304, b"", validators)
+            return
+        self.send_body(
+            200,
+            self.site.documents[path],
+            {"Content-Type": "text/html; charset=utf-8", **validators},
+        )
+
+    do_GET = serve
+    do_HEAD = serve
+
+
+class FixtureServer(LocalServer):
+    """Run the fixture site on a local port, in a background thread."""
+
+    def __init__(self, site, port=0):
+        super().__init__(
+            type("Handler", (FixtureRequestHandler,), {"site": site}), port
+        )
+
+    @property
+    def base_url(self):
+        """Get the root URL of the site."""
+        return self.root_url
+
+    @property
+    def url(self):
+        """Get the URL of the listing page."""
+        return self.root_url + LISTING_PATH
+
+
+def main():
+    """Serve the fixture site until interrupted."""
+    parser = argparse.ArgumentParser(
+        description="Serve a local replica of the Anthem policy site."
+    )
+    parser.add_argument(
+        "--data", type=str, default=OUTPUT_DIR, help="Folder of the saved policies."
+    )
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on.")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Simulated server latency, in seconds, of each page and result update.",
+    )
+    args = parser.parse_args()
+
+    server = FixtureServer(FixtureSite(args.data, latency=args.latency), args.port)
+    print(f"Serving {server.url}")
+    server.serve_until_interrupted()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Local HTTP servers used as stand-ins for the remote sites and APIs."""
+
+import threading
+from http.server import ThreadingHTTPServer
+
+
+class QueuedHTTPServer(ThreadingHTTPServer):
+    """Threading HTTP server accepting as many pending connections as a wide concurrency."""
+
+    request_queue_size = 128
+
+
+class LocalServer:
+    """Run a request handler on a local port, in a background thread."""
+
+    def __init__(self, handler, port=0):
+        self.httpd = QueuedHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def root_url(self):
+        """Get the root URL of the server."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve_until_interrupted(self):
+        """Serve in the current thread until interrupted."""
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
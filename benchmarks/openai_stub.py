@@ -0,0 +1,513 @@
+"""Local stand-in for the OpenAI chat completions API, served from the saved data.
+
+A request whose position statement is the `content` of a saved policy is
+answered with the criteria stored for it (the first criteria entry), after a
+simulated latency, with token counts estimated from the text lengths. A packed
+request is answered with the criteria of each of its policies, and a section of
+a position statement with the stored criteria under its necessity headings.
+A rate limit on the requests per time window can be simulated, answered with
+the rate-limit headers of the API and 429 errors beyond it. A weaker model can
+be simulated too, answering faster but dropping a key of the criteria of a
+share of the position statements. Streamed requests are answered line by
+line, each line after the generation time of its tokens. Requests with the
+compact instructions are answered in the compact format, on a single line. The
+files and batches endpoints of the Batch API are served too, a batch completing
+after its own simulated delay. Point the extractor at it with
+`OPENAI_API_BASE=<url>/v1`, or use it as a llama.cpp server with
+`--model local:<url>`, the health and models endpoints being served too.
+"""
+
+import argparse
+import collections
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler
+
+from benchmarks.compact_encoder import compact_criteria
+from benchmarks.local_server import LocalServer
+from src.extraction_cache import text_hash
+from src.policy_packing import POLICY_HEADER
+from src.policy_sections import NECESSITY_HEADING, merge_criteria, split_sections
+from src.scraper_anthem import OUTPUT_DIR
+
+# Rough size of a token, in characters, used to estimate the usage
+CHARACTERS_PER_TOKEN = 4
+# Phrase of the compact instructions, telling their requests apart
+COMPACT_MARKER = "compact JSON format"
+POLICY_HEADER_PATTERN = re.compile(
+    "^" + re.escape(POLICY_HEADER).replace(re.escape("{key}"), "(.+)") + "$\n?",
+    re.MULTILINE,
+)
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens of a text."""
+    return max(1, len(text) // CHARACTERS_PER_TOKEN)
+
+
+def criteria_positions(content, criteria):
+    """Place each criteria entry at the necessity heading of its type, in order."""
+    headings = [
+        (match.start(), match.group().strip(" \t\xa0:").lower())
+        for match in NECESSITY_HEADING.finditer(content)
+    ]
+    positions = []
+    current = 0
+    for entry in criteria:
+        necessity_type = str(entry.get("necessity_type")).lower()
+        for index in range(current, len(headings)):
+            if headings[index][1] == necessity_type:
+                current = index
+                break
+        positions.append(headings[current][0] if headings else 0)
+    return positions
+
+
+class StubRateLimit:
+    """Requests accepted per time window, without limit if 0."""
+
+    def __init__(self, limit=0, window=60.0):
+        self.limit = limit
+        self.window = window
+        self.rejected = 0
+        self._accepted = collections.deque()
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """Admit a request under the simulated rate limit, returning whether it is and its headers."""
+        if not self.limit:
+            return True, {}
+        with self._lock:
+            now = time.monotonic()
+            while self._accepted and self._accepted[0] <= now - self.window:
+                self._accepted.popleft()
+            admitted = len(self._accepted) < self.limit
+            if admitted:
+                self._accepted.append(now)
+            else:
+                self.rejected += 1
+            reset = self._accepted[0] + self.window - now
+            headers = {
+                "x-ratelimit-limit-requests": str(self.limit),
+                "x-ratelimit-remaining-requests": str(self.limit - len(self._accepted)),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+            }
+            if not admitted:
+                headers["retry-after-ms"] = str(int(reset * 1000))
+            return admitted, headers
+
+
+class WeakModel:
+    """Weak model of a cascade, answering `speedup` times faster, and badly for a share `error_rate` of the position statements."""
+
+    def __init__(self, name, error_rate=0.0, speedup=1.0):
+        self.name = name
+        self.error_rate = error_rate
+        self.speedup = speedup
+
+    def degraded(self, statement, criteria):
+        """Get the criteria answered by the weak model, the last one missing its necessity type for a share of the statements."""
+        if not criteria or int(text_hash(statement)[:8], 16) >= self.error_rate * 16**8:
+            return criteria
+        degraded = {key: value for key, value in criteria[-1].items() if key != "necessity_type"}
+        return criteria[:-1] + [degraded]
+
+
+class GenerationTime:
+    """Simulated time of a completion: a latency, then a generation time per completion token."""
+
+    def __init__(self, latency=0.5, seconds_per_token=0.0):
+        self.latency = latency
+        self.seconds_per_token = seconds_per_token
+
+    def completion(self, completion_tokens, speedup=1.0):
+        """Get the time of a whole completion."""
+        return (self.latency + self.seconds_per_token * completion_tokens) / speedup
+
+    def tokens(self, count, speedup=1.0):
+        """Get the generation time of some tokens of a streamed completion."""
+        return self.seconds_per_token * count / speedup
+
+
+class StubModel:
+    """Answers of the stub model, loaded from the saved policies."""
+
+    def __init__(
+        self,
+        data_dir=OUTPUT_DIR,
+        latency=0.5,
+        seconds_per_token=0.0,
+        batch_delay=1.0,
+        rate_limit=0,
+        rate_window=60.0,
+        weak_model=None,
+        weak_error_rate=0.0,
+        weak_speedup=1.0,
+    ):
+        self.timing = GenerationTime(latency, seconds_per_token)
+        self.weak = weak_model and WeakModel(weak_model, weak_error_rate, weak_speedup)
+        self.rate_limit = StubRateLimit(rate_limit, rate_window)
+        self.batch_api = StubBatchApi(self, batch_delay)
+        self.answers = {}
+        for name in sorted(os.listdir(data_dir)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(data_dir, name), encoding="utf-8") as file:
+                for policy in json.load(file):
+                    if policy.get("criteria"):
+                        self.answers[policy["content"]] = policy["criteria"][0][
+                            "criteria"
+                        ]
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def criteria(self, statement):
+        """Get the criteria answered to a position statement or to a section of one."""
+        if statement in self.answers:
+            return self.answers[statement]
+        for content, criteria in self.answers.items():
+            start = content.find(statement)
+            if start >= 0:
+                end = start + len(statement)
+                return [
+                    entry
+                    for entry, position in zip(criteria, criteria_positions(content, criteria))
+                    if start <= position < end
+                ]
+        return []
+
+    def weak_criteria(self, statement):
+        """Get the criteria answered by the weak model to a position statement."""
+        return self.weak.degraded(statement, self.criteria(statement))
+
+    def expected_criteria(self, statement, split_threshold=0):
+        """Get the criteria of a position statement extracted in sections."""
+        if not split_threshold:
+            return self.criteria(statement)
+        return merge_criteria(
+            [self.criteria(section) for section in split_sections(statement, split_threshold)]
+        )
+
+    def answer(self, messages, weak=False):
+        """Get the answer of the model, or of the weak model, to the last user message, as JSON text."""
+        with self._lock:
+            self.requests += 1
+        criteria = self.weak_criteria if weak else self.criteria
+        if COMPACT_MARKER in messages[0]["content"]:
+            answer = {"separators": (",", ":")}
+
+            def answer_criteria(statement):
+                return compact_criteria(criteria(statement), statement)
+
+        else:
+            answer = {"indent": 2}
+            answer_criteria = criteria
+        statement = messages[-1]["content"]
+        parts = POLICY_HEADER_PATTERN.split(statement)
+        if len(parts) == 1:
+            return json.dumps(answer_criteria(statement), **answer)
+        # A packed request, alternating the keys and the position statements
+        return json.dumps(
+            {
+                key: answer_criteria(content.strip("\n"))
+                for key, content in zip(parts[1::2], parts[2::2])
+            },
+            **answer,
+        )
+
+    def is_weak(self, body):
+        """Check whether a request body is sent to the weak model."""
+        return self.weak is not None and body.get("model") == self.weak.name
+
+    def complete(self, body, delay=True):
+        """Build the chat completion of a request body, after the simulated latency."""
+        weak = self.is_weak(body)
+        content = self.answer(body["messages"], weak)
+        prompt_tokens = sum(
+            estimate_tokens(message["content"]) for message in body["messages"]
+        )
+        completion_tokens = estimate_tokens(content)
+        if delay:
+            time.sleep(self.timing.completion(completion_tokens, self.weak.speedup if weak else 1.0))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def stream(self, body):
+        """Yield the chunks of the streamed chat completion of a request body, as its lines are generated."""
+        completion = self.complete(body, delay=False)
+        speedup = self.weak.speedup if self.is_weak(body) else 1.0
+        chunk = {
+            "id": completion["id"],
+            "object": "chat.completion.chunk",
+            "created": completion["created"],
+            "model": completion["model"],
+        }
+        time.sleep(self.timing.completion(0, speedup))
+        content = completion["choices"][0]["message"]["content"]
+        for line in content.splitlines(keepends=True):
+            time.sleep(self.timing.tokens(estimate_tokens(line), speedup))
+            yield chunk | {
+                "choices": [{"index": 0, "delta": {"content": line}, "finish_reason": None}]
+            }
+        yield chunk | {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk | {"choices": [], "usage": completion["usage"]}
+
+
+class StubBatchApi:
+    """Files and batches of the Batch API, the batches answered by the stub model."""
+
+    def __init__(self, model, batch_delay=1.0):
+        self.model = model
+        self.batch_delay = batch_delay
+        self.files = {}
+        self.batches = {}
+
+    def create_file(self, content, filename, purpose):
+        """Store an uploaded or generated file."""
+        file_id = f"file-{uuid.uuid4().hex}"
+        self.files[file_id] = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+            "content": content,
+        }
+        return file_id
+
+    def create_batch(self, body):
+        """Create a batch job, run in the background."""
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        lines = self.files[body["input_file_id"]]["content"].decode("utf-8").splitlines()
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"],
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+        }
+        threading.Thread(
+            target=self.run_batch, args=(batch_id, lines), daemon=True
+        ).start()
+        return self.batches[batch_id]
+
+    def run_batch(self, batch_id, lines):
+        """Answer every request of a batch, after the simulated batch delay."""
+        time.sleep(self.batch_delay)
+        output = []
+        for line in lines:
+            request = json.loads(line)
+            output.append(
+                {
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "request_id": uuid.uuid4().hex,
+                        "body": self.model.complete(request["body"], delay=False),
+                    },
+                    "error": None,
+                }
+            )
+        content = "".join(json.dumps(result) + "\n" for result in output)
+        batch = self.batches[batch_id]
+        batch["output_file_id"] = self.create_file(
+            content.encode("utf-8"), f"{batch_id}_output.jsonl", "batch_output"
+        )
+        batch["request_counts"]["completed"] = len(output)
+        batch["completed_at"] = int(time.time())
+        batch["status"] = "completed"
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Serve the chat completions endpoint of the stub."""
+
+    model = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        """Send a JSON response."""
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self, chunks, headers=None):
+        """Send chunks as server-sent events, as they come, ending the stream like the API."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def read_json(self):
+        """Read the JSON body of the request."""
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length))
+
+    def read_upload(self):
+        """Read the multipart form of a file upload, returning its fields."""
+        length = int(self.headers.get("Content-Length", 0))
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+            + self.rfile.read(length)
+        )
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param("name", header="content-disposition")] = (
+                part.get_content(),
+                part.get_filename(),
+            )
+        return fields
+
+    def send_not_found(self):
+        """Send the error of an unknown endpoint or object."""
+        self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Serve a POST request."""
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            body = self.read_json()
+            admitted, headers = self.model.rate_limit.admit()
+            if admitted and body.get("stream"):
+                self.send_events(self.model.stream(body), headers)
+            elif admitted:
+                self.send_json(200, self.model.complete(body), headers)
+            else:
+                error = {
+                    "message": "Rate limit reached for requests",
+                    "type": "requests",
+                    "code": "rate_limit_exceeded",
+                }
+                self.send_json(429, {"error": error}, headers)
+        elif path.endswith("/files"):
+            fields = self.read_upload()
+            content, filename = fields["file"]
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            file_id = self.model.batch_api.create_file(content, filename, fields["purpose"][0])
+            self.send_json(200, self.file_object(file_id))
+        elif path.endswith("/batches"):
+            self.send_json(200, self.model.batch_api.create_batch(self.read_json()))
+        else:
+            self.send_not_found()
+
+    def file_object(self, file_id):
+        """Get the description of a stored file."""
+        return {
+            key: value
+            for key, value in self.model.batch_api.files[file_id].items()
+            if key != "content"
+        }
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve a GET request."""
+        parts = self.path.strip("/").split("/")
+        if parts == ["health"]:
+            self.send_json(200, {"status": "ok"})
+        elif parts[-1] == "models":
+            self.send_json(200, {"object": "list", "data": [{"id": "stub.gguf", "object": "model"}]})
+        elif len(parts) >= 3 and parts[-2] == "batches" and parts[-1] in self.model.batch_api.batches:
+            self.send_json(200, self.model.batch_api.batches[parts[-1]])
+        elif len(parts) >= 4 and parts[-1] == "content" and parts[-2] in self.model.batch_api.files:
+            content = self.model.batch_api.files[parts[-2]]["content"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_not_found()
+
+
+class StubServer(LocalServer):
+    """Run the stub API on a local port, in a background thread."""
+
+    def __init__(self, model, port=0, handler=StubRequestHandler):
+        super().__init__(type("Handler", (handler,), {"model": model}), port)
+
+    @property
+    def base_url(self):
+        """Get the base URL of the API, to use as OPENAI_API_BASE."""
+        return self.root_url + "/v1"
+
+
+def main():
+    """Serve the stub API until interrupted."""
+    parser = argparse.ArgumentParser(
+        description="Serve a local stand-in for the OpenAI chat completions API."
+    )
+    parser.add_argument(
+        "--data", type=str, default=OUTPUT_DIR, help="Folder of the saved policies."
+    )
+    parser.add_argument("--port", type=int, default=8001, help="Port to listen on.")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.5,
+        help="Simulated latency, in seconds, of each completion.",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=0,
+        help="Simulated limit of requests per window, 0 for no limit.",
+    )
+    parser.add_argument(
+        "--rate-window",
+        type=float,
+        default=60.0,
+        help="Window, in seconds, of the simulated rate limit.",
+    )
+    args = parser.parse_args()
+
+    model = StubModel(
+        args.data, args.latency, rate_limit=args.rate_limit, rate_window=args.rate_window
+    )
+    server = StubServer(model, args.port)
+    print(f"Serving {server.base_url}")
+    server.serve_until_interrupted()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Agreement of the rule-based extraction with the stored model criteria.
+
+Extracts every saved position statement by rules, and compares the criteria of
+the statements it covers with the ones stored for a model (gpt-4o by default).
+The structure agrees when both have the same number of criteria objects, with
+the same necessity types, descriptions, sub medical acts and conditions. The
+names of the medical acts are compared apart, leniently, as the model itself
+words them inconsistently. Also reports the tokens, cost and time the model
+spent on the covered statements, saved by the rules.
+"""
+
+import argparse
+import re
+import time
+
+from benchmarks.clean_html import load_policies
+from src.rule_extractor import extract_rules
+from src.scraper_anthem import OUTPUT_DIR
+
+STRUCTURE_FIELDS = ["necessity_type", "description", "sub_medical_act", "conditions"]
+
+
+def act_key(medical_act):
+    """Normalize the name of a medical act for a lenient comparison."""
+    return re.sub(r"^(?:the\s+)?(?:use of\s+)?", "", (medical_act or "").strip().lower())
+
+
+def stored_entry(policy, model_name):
+    """Get the criteria entry stored for a model, or None."""
+    for entry in policy.get("criteria", []):
+        if entry["model"] == model_name:
+            return entry
+    return None
+
+
+def compare(criteria, stored):
+    """Compare the rule criteria with the stored ones, returning whether the structure agrees and the agreeing acts."""
+    if isinstance(stored, dict):
+        stored = [stored]
+    if not isinstance(stored, list) or len(criteria) != len(stored):
+        return False, 0
+    structure = all(
+        criterion[field] == stored_criterion.get(field)
+        for criterion, stored_criterion in zip(criteria, stored)
+        for field in STRUCTURE_FIELDS
+    )
+    acts = sum(
+        act_key(criterion["medical_act"]) == act_key(stored_criterion.get("medical_act"))
+        for criterion, stored_criterion in zip(criteria, stored)
+    )
+    return structure, acts
+
+
+def agreement(policies, extractions, model_name, verbose=False):
+    """Compare the rule extractions with the stored criteria, returning the agreement counts and the usage saved."""
+    counts = {"covered": 0, "structures": 0, "criteria": 0, "acts": 0}
+    saved = {"total_tokens": 0, "total_cost": 0.0, "processing_time": 0.0}
+    for policy, criteria in zip(policies, extractions):
+        if criteria is None:
+            continue
+        entry = stored_entry(policy, model_name)
+        structure, acts = compare(criteria, entry["criteria"])
+        counts["covered"] += 1
+        counts["structures"] += structure
+        counts["criteria"] += len(criteria)
+        counts["acts"] += acts
+        for key in saved:
+            saved[key] += entry["usage"].get(key) or 0
+        if verbose and not structure:
+            print(f"! Disagreement for {policy['url']}")
+    return counts, saved
+
+
+def main():
+    """Measure the agreement of the rules with the stored criteria."""
+    parser = argparse.ArgumentParser(
+        description="Measure the agreement of the rule-based extraction with a model."
+    )
+    parser.add_argument(
+        "--data", type=str, default=OUTPUT_DIR, help="Folder of category JSON files."
+    )
+    parser.add_argument(
+        "--model", type=str, default="gpt-4o", help="Model of the stored criteria."
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Print the disagreeing statements."
+    )
+    args = parser.parse_args()
+
+    policies = [
+        policy for policy in load_policies(args.data) if stored_entry(policy, args.model)
+    ]
+    start_time = time.perf_counter()
+    extractions = [extract_rules(policy["content"]) for policy in policies]
+    elapsed = time.perf_counter() - start_time
+
+    counts, saved = agreement(policies, extractions, args.model, args.verbose)
+    covered = counts["covered"]
+
+    print(
+        f"Coverage: {covered}/{len(policies)} statements extracted by rules "
+        f"({covered / len(policies):.0%}), in {elapsed * 1000:.1f} ms"
+    )
+    print(
+        f"Agreement with {args.model}: {counts['structures']}/{covered} structures "
+        f"({counts['structures'] / max(covered, 1):.1%}), "
+        f"{counts['acts']}/{counts['criteria']} medical acts "
+        f"({counts['acts'] / max(counts['criteria'], 1):.1%})"
+    )
+    print(
+        f"Saved: {saved['total_tokens']} tokens, ${saved['total_cost']:.2f}, "
+        f"{saved['processing_time']:.0f} s of requests"
+    )
+
+
+if __name__ == "__main__":
+    main()
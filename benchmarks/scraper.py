@@ -0,0 +1,375 @@
+"""End-to-end benchmark of the scraper against the local fixture site.
+
+Runs `AnthemScraper.scrape()` on every category of the fixture site, writing to
+a temporary folder, and reports the throughput, the time spent in each phase
+and the peak memory of the process and its browsers. The report can be saved
+as a baseline, and later runs compared against it to catch regressions.
+
+The golden check scrapes the fixture site in both fetch modes instead, and
+checks that the HTTP mode gives the same records as the browser, field by field
+and the HTML of the documents exactly. Against the saved records, it fetches
+every document over HTTP instead, without the listing or any browser.
+
+The resume check stops a scrape of each category after its last results page,
+before the output is written, then scrapes it again, checking that the second
+run writes every record without fetching any document again.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import psutil
+
+from benchmarks.fixture_site import FixtureServer, FixtureSite
+from src.scraper_anthem import OUTPUT_DIR, AnthemScraper
+from src.browser_sessions import BrowserManager
+from src.scraping_engine import FETCH_MODES, PageVisits
+
+PHASES = ["listing", "navigation", "documents", "output"]
+
+
+class PeakMemory:
+    """Sample the resident memory of this process and its children (the browsers)."""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        """Record the peak of the summed RSS until stopped."""
+        process = psutil.Process()
+        while not self._stop.is_set():
+            rss = 0
+            for member in [process] + process.children(recursive=True):
+                try:
+                    rss += member.memory_info().rss
+                except psutil.Error:
+                    pass
+            self.peak = max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def fixture_scraper(server):
+    """Get the Anthem scraper pointed at the fixture server."""
+    return type(
+        "FixtureScraper", (AnthemScraper,), {"URL": server.url, "BASE_URL": server.base_url}
+    )
+
+
+def scrape_category(site, scraper_class, category, timings, **options):
+    """Scrape one category of the fixture site, returning the number of policies."""
+    scraper = scraper_class(category=category, verbose=False, resume=False, **options)
+    try:
+        scraper.scrape()
+    finally:
+        scraper.close()
+    for phase, seconds in scraper.log.timings.items():
+        timings[phase] += seconds
+    with open(scraper.output.output_path, encoding="utf-8") as file:
+        scraped = len(json.load(file))
+    if scraped != site.num_policies(category):
+        raise AssertionError(
+            f"Scraped {scraped} {category} policies, "
+            f"expected {site.num_policies(category)}."
+        )
+    return scraped
+
+
+def run(site, fetch="browser", workers=1, incremental=False, headful=False):
+    """Scrape every category of the fixture site, returning the benchmark report."""
+    timings = defaultdict(float)
+    pages = 0
+    with tempfile.TemporaryDirectory() as output_dir, FixtureServer(
+        site
+    ) as server, BrowserManager(headful, workers) as browser, PeakMemory() as memory:
+        start_time = time.perf_counter()
+        for category in site.categories():
+            pages += scrape_category(
+                site,
+                fixture_scraper(server),
+                category,
+                timings,
+                headful=headful,
+                visits=PageVisits(fetch, incremental, workers),
+                browser=browser,
+                output_dir=output_dir,
+            )
+        elapsed = time.perf_counter() - start_time
+
+    return {
+        "fetch": fetch,
+        "workers": workers,
+        "incremental": incremental,
+        "latency": site.latency,
+        "pages": pages,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(pages / elapsed, 3),
+        "phases": {phase: round(timings[phase], 3) for phase in PHASES},
+        "peak_rss_mb": round(memory.peak / 2**20, 1),
+    }
+
+
+def scraped_records(site, fetch, workers=1, headful=False):
+    """Scrape every category of the fixture site in a fetch mode, returning the records by category and URL."""
+    records = {}
+    with tempfile.TemporaryDirectory() as output_dir, FixtureServer(
+        site
+    ) as server, BrowserManager(headful, workers) as browser:
+        for category in site.categories():
+            scraper = fixture_scraper(server)(
+                category=category,
+                verbose=False,
+                resume=False,
+                headful=headful,
+                visits=PageVisits(fetch, workers=workers),
+                browser=browser,
+                output_dir=output_dir,
+            )
+            try:
+                scraper.scrape()
+            finally:
+                scraper.close()
+            with open(scraper.output.output_path, encoding="utf-8") as file:
+                records[category] = {policy["url"]: policy for policy in json.load(file)}
+    return records
+
+
+def fetched_records(site):
+    """Fetch every document of the fixture site over HTTP, returning the saved and the fetched records by category and URL."""
+    saved, fetched = defaultdict(dict), defaultdict(dict)
+    with tempfile.TemporaryDirectory() as output_dir, FixtureServer(site) as server:
+        for category in site.categories():
+            scraper = fixture_scraper(server)(
+                category=category,
+                verbose=False,
+                resume=False,
+                visits=PageVisits("http"),
+                archive=False,
+                output_dir=output_dir,
+            )
+            try:
+                for item in site.listing:
+                    if item["category"] != category or item["type"] != "medicalpolicy":
+                        continue
+                    link = server.base_url + item["path"]
+                    saved[category][link] = {
+                        **{
+                            field: value
+                            for field, value in site.records[item["path"]].items()
+                            if field not in ("content", "criteria")
+                        },
+                        "url": link,
+                    }
+                    fetched[category][link] = scraper.fetch_item_page(link)
+            finally:
+                scraper.close()
+    return saved, fetched
+
+
+def record_differences(expected, record):
+    """Get the fields of a record differing from the expected one."""
+    return [
+        field
+        for field in sorted(set(expected) | set(record))
+        if record.get(field) != expected.get(field)
+    ]
+
+
+def golden_check(site, reference="browser", workers=1, headful=False):
+    """Count the records the HTTP mode scrapes differently from the browser, or from the saved ones."""
+    if reference == "saved":
+        expected, scraped = fetched_records(site)
+    else:
+        expected = scraped_records(site, "browser", workers, headful)
+        scraped = scraped_records(site, "http", workers, headful)
+    mismatches = 0
+    for category, policies in expected.items():
+        for url in policies.keys() | scraped[category].keys():
+            if url not in scraped[category]:
+                differences = ["missing"]
+            elif url not in policies:
+                differences = ["unexpected"]
+            else:
+                differences = record_differences(policies[url], scraped[category][url])
+            if differences:
+                mismatches += 1
+                print(f"! Mismatch for {url} ({category}): {', '.join(differences)}")
+    total = sum(len(policies) for policies in expected.values())
+    print(f"Golden check: {total - mismatches}/{total} identical records over HTTP.")
+    return mismatches
+
+
+class InterruptedRun(Exception):
+    """Stop of a scrape after its last results page, before its output."""
+
+
+def interrupt_output(**_):
+    """Stop a scrape at its output phase."""
+    raise InterruptedRun()
+
+
+def resume_check(site, fetch="browser", workers=1, headful=False):
+    """Count the categories a scrape stopped after its last results page does not resume."""
+    failures = 0
+    with tempfile.TemporaryDirectory() as output_dir, FixtureServer(
+        site
+    ) as server, BrowserManager(headful, workers) as browser:
+        for category in site.categories():
+            scrapers = [
+                fixture_scraper(server)(
+                    category=category,
+                    verbose=False,
+                    resume=True,
+                    headful=headful,
+                    visits=PageVisits(fetch, workers=workers),
+                    browser=browser,
+                    output_dir=output_dir,
+                )
+                for _ in range(2)
+            ]
+            scrapers[0].output.save_policies = interrupt_output
+            try:
+                scrapers[0].scrape()
+            except InterruptedRun:
+                pass
+            finally:
+                scrapers[0].close()
+            try:
+                scrapers[1].scrape()
+            finally:
+                scrapers[1].close()
+
+            with open(scrapers[1].output.output_path, encoding="utf-8") as file:
+                scraped = len(json.load(file))
+            fetched = scrapers[1].log.counts["documents"]
+            if scraped != site.num_policies(category) or fetched:
+                failures += 1
+                print(
+                    f"! Resumed {category}: {scraped}/{site.num_policies(category)} "
+                    f"policies, {fetched} documents fetched again."
+                )
+    total = len(site.categories())
+    print(f"Resume check: {total - failures}/{total} categories resumed.")
+    return failures
+
+
+def compare(report, baseline, max_regression):
+    """Print the changes against a baseline report, returning the regressions."""
+    checks = [
+        ("pages_per_second", report["pages_per_second"], baseline["pages_per_second"], True),
+        ("peak_rss_mb", report["peak_rss_mb"], baseline["peak_rss_mb"], False),
+    ] + [
+        (f"phases.{phase}", report["phases"][phase], baseline["phases"][phase], False)
+        for phase in PHASES
+    ]
+    regressions = []
+    for name, value, reference, higher_is_better in checks:
+        if not reference:
+            continue
+        change = (value - reference) / reference
+        print(f"- {name:<20} {reference:10.3f} -> {value:10.3f} ({change:+.1%})")
+        if (-change if higher_is_better else change) > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    """Run the scraper benchmark."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scraper against a local replica of the site."
+    )
+    parser.add_argument(
+        "--data", type=str, default=OUTPUT_DIR, help="Folder of the saved policies."
+    )
+    parser.add_argument(
+        "--cat",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Categories to serve (all the saved ones by default).",
+    )
+    parser.add_argument(
+        "--fetch", type=str, default="browser", choices=FETCH_MODES, help="Fetch mode."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker browser sessions."
+    )
+    parser.add_argument(
+        "--incremental", action="store_true", help="Run the scraper incrementally."
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Simulated server latency, in seconds.",
+    )
+    parser.add_argument(
+        "--headful", action="store_true", help="Run browser in headful mode."
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="Write the report to this JSON file."
+    )
+    parser.add_argument(
+        "--baseline", type=str, default=None, help="Baseline report to compare with."
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Fail when a metric is worse than the baseline by more than this fraction.",
+    )
+    parser.add_argument(
+        "--golden",
+        nargs="?",
+        const="browser",
+        choices=["browser", "saved"],
+        help="Check that the HTTP mode scrapes the same records as the browser, "
+        "or as the saved records, instead.",
+    )
+    parser.add_argument(
+        "--resume-check",
+        action="store_true",
+        help="Check that a scrape stopped after its last results page resumes, instead.",
+    )
+    args = parser.parse_args()
+
+    site = FixtureSite(args.data, args.cat, args.latency)
+    if args.golden:
+        sys.exit(1 if golden_check(site, args.golden, args.workers, args.headful) else 0)
+    if args.resume_check:
+        sys.exit(1 if resume_check(site, args.fetch, args.workers, args.headful) else 0)
+    report = run(site, args.fetch, args.workers, args.incremental, args.headful)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        print(f"Compared with {args.baseline}:")
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions over {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+"""Benchmark of the standardization against the local stand-in of the OpenAI API.
+
+Copies the saved policies of a category, without their criteria, to a
+temporary folder, runs the extractor on them against `benchmarks.openai_stub`,
+and reports the wall-clock time, the number of requests and the prompt and
+completion tokens of each mode, including short statements packed in shared
+requests, a re-run served from the extraction cache and a batch job. The long
+statements of another category are extracted whole and in sections, reporting
+the slowest policy (the tail latency), streamed, reporting the time to their
+first criteria object against the time to their whole answer, and in the
+compact format, reporting the completion tokens saved (by the encoder of the
+stub, not by a model). The whole folder is extracted one file after the other
+and with the files in parallel under a global concurrency budget, against the
+largest file alone. The file is then
+extracted once more against a stub rejecting the requests above a rate limit,
+reporting the rejected and retried requests. Finally, the file is extracted
+with a cascade, against a stub also simulating a cheaper and faster model that
+answers invalid criteria for a share of the statements, reporting the
+escalated statements and the latency and cost per policy against the model
+alone. It also checks that every policy got the criteria the stub answers for
+it, once, in the order of the file.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.openai_stub import StubModel, StubServer
+from src.scraper_anthem import OUTPUT_DIR
+from src.batch_extraction import BatchJob
+from src.extraction_cache import ExtractionCache
+from src.file_extraction import data_files
+from src.standardize import MedicalPolicyExtractor
+
+
+def read_policies(path):
+    """Load the policies of a file."""
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def copy_without_criteria(source, folder):
+    """Copy the policies of a file to a folder, without their saved criteria."""
+    policies = read_policies(source)
+    for policy in policies:
+        policy.pop("criteria", None)
+    path = os.path.join(folder, os.path.basename(source))
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(policies, file)
+    return path
+
+
+def timed_extraction(model, extractor, source, folder, **options):
+    """Extract a fresh copy of the file, returning its path, the requests sent and the seconds taken."""
+    path = copy_without_criteria(source, folder)
+    requests_before = model.requests
+    start_time = time.perf_counter()
+    extractor.extract_policy_from_file(path, **options)
+    return path, model.requests - requests_before, time.perf_counter() - start_time
+
+
+def setup_environment(server):
+    """Point the OpenAI client of the extractor at the stub server."""
+    os.environ["OPENAI_API_BASE"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "stub"
+
+
+def check_output(path, model, model_name, split_threshold=0):
+    """Check the criteria set by the run, returning the number of policies."""
+    policies = read_policies(path)
+    for policy in policies:
+        entries = [entry for entry in policy["criteria"] if entry["model"] == model_name]
+        expected = model.expected_criteria(policy["content"], split_threshold)
+        if len(entries) != 1 or entries[0]["criteria"] != expected:
+            raise AssertionError(f"Unexpected criteria for {policy['url']}")
+    return len(policies)
+
+
+def summarize(path):
+    """Sum the usage of the last criteria entry of every policy, with the slowest policy."""
+    policies = read_policies(path)
+    totals = {"prompt_tokens": 0, "completion_tokens": 0, "max_seconds": 0.0}
+    for policy in policies:
+        usage = policy["criteria"][-1]["usage"]
+        for key in ["prompt_tokens", "completion_tokens"]:
+            totals[key] += usage[key]
+        totals["max_seconds"] = max(
+            totals["max_seconds"], round(usage["processing_time"] or 0.0, 3)
+        )
+    return totals
+
+
+def summarize_cascade(path):
+    """Count the policies and the escalated ones, with the median latency and the cost per policy."""
+    usages = [policy["criteria"][-1]["usage"] for policy in read_policies(path)]
+    return {
+        "policies": len(usages),
+        "escalated": sum(usage.get("cascade", {}).get("escalated", False) for usage in usages),
+        "median_seconds": round(
+            statistics.median(usage["processing_time"] for usage in usages), 3
+        ),
+        "cost_per_policy": round(sum(usage["total_cost"] for usage in usages) / len(usages), 6),
+    }
+
+
+def run_mode(
+    model,
+    source,
+    model_name,
+    runs=1,
+    cache_path=None,
+    split_threshold=0,
+    compact=False,
+    **options,
+):
+    """Run the extractor on fresh copies of the file, returning the report of the last run."""
+    with tempfile.TemporaryDirectory() as folder:
+        extractor = MedicalPolicyExtractor(
+            model_name=model_name,
+            cache=ExtractionCache(os.path.join(folder, cache_path)) if cache_path else None,
+            split_threshold=split_threshold,
+            compact=compact,
+        )
+        for _ in range(runs):
+            path, requests, elapsed = timed_extraction(model, extractor, source, folder, **options)
+        policies = check_output(path, model, model_name, split_threshold)
+        return {
+            "options": {
+                "runs": runs,
+                "cache": bool(cache_path),
+                "split_threshold": split_threshold,
+                "compact": compact,
+                "category": os.path.basename(source),
+                **options,
+            },
+            "policies": policies,
+            "requests": requests,
+            "seconds": round(elapsed, 3),
+            **summarize(path),
+        }
+
+
+def run_batch(model, source, model_name):
+    """Run the extraction of a copy of the file as a batch job, returning its report."""
+    with tempfile.TemporaryDirectory() as folder:
+        path = copy_without_criteria(source, folder)
+        extractor = MedicalPolicyExtractor(model_name=model_name)
+        requests_before = model.requests
+        start_time = time.perf_counter()
+        BatchJob(extractor, path).run(poll_interval=0.2)
+        elapsed = time.perf_counter() - start_time
+        policies = check_output(path, model, model_name)
+        return {
+            "options": {"batch": True},
+            "policies": policies,
+            "requests": model.requests - requests_before,
+            "seconds": round(elapsed, 3),
+            **summarize(path),
+        }
+
+
+def run_streaming(model, source, model_name, concurrency):
+    """Stream the criteria of the policies of the file concurrently, returning the report of the run."""
+    statements = [policy["content"] for policy in read_policies(source)]
+    extractor = MedicalPolicyExtractor(model_name=model_name)
+    limiter = extractor.requests.run_limiter(concurrency)
+
+    async def stream(statement):
+        stream = extractor.stream_policy(statement, limiter)
+        criteria = [criterion async for criterion in stream]
+        if criteria != model.criteria(statement) or stream.response["criteria"] != criteria:
+            raise AssertionError("Unexpected streamed criteria")
+        return stream.response["usage"]
+
+    async def stream_all():
+        return await asyncio.gather(*(stream(statement) for statement in statements))
+
+    requests_before = model.requests
+    start_time = time.perf_counter()
+    usages = asyncio.run(stream_all())
+    elapsed = time.perf_counter() - start_time
+    first_seconds = [usage["time_to_first_criterion"] or 0.0 for usage in usages]
+    seconds = [usage["processing_time"] for usage in usages]
+    return {
+        "options": {
+            "stream": True,
+            "concurrency": concurrency,
+            "category": os.path.basename(source),
+        },
+        "policies": len(usages),
+        "requests": model.requests - requests_before,
+        "seconds": round(elapsed, 3),
+        "median_first_seconds": round(statistics.median(first_seconds), 3),
+        "max_first_seconds": round(max(first_seconds), 3),
+        "median_seconds": round(statistics.median(seconds), 3),
+        "max_seconds": round(max(seconds), 3),
+    }
+
+
+def file_by_file_seconds(model, extractor, sources, folder, concurrency):
+    """Extract copies of the files one after the other, returning the seconds taken by each one."""
+    file_seconds = {}
+    for source in sources:
+        path, _, seconds = timed_extraction(
+            model, extractor, source, folder, concurrency=concurrency
+        )
+        file_seconds[os.path.basename(source)] = seconds
+        check_output(path, model, extractor.model_name)
+    return file_seconds
+
+
+def run_folder(model, data_dir, model_name, concurrency):
+    """Extract copies of every file of a folder one after the other, then in parallel."""
+    sources = data_files(data_dir)
+    extractor = MedicalPolicyExtractor(model_name=model_name)
+    with tempfile.TemporaryDirectory() as folder:
+        file_seconds = file_by_file_seconds(model, extractor, sources, folder, concurrency)
+        slowest = max(file_seconds, key=file_seconds.get)
+
+        paths = [copy_without_criteria(source, folder) for source in sources]
+        requests_before = model.requests
+        start_time = time.perf_counter()
+        extractor.extract_policy_from_folder(folder, concurrency=concurrency)
+        elapsed = time.perf_counter() - start_time
+        return {
+            "options": {"folder": True, "concurrency": concurrency},
+            "files": len(sources),
+            "policies": sum(check_output(path, model, model_name) for path in paths),
+            "requests": model.requests - requests_before,
+            "file_by_file_seconds": round(sum(file_seconds.values()), 3),
+            "slowest_file": slowest,
+            "slowest_file_seconds": round(file_seconds[slowest], 3),
+            "seconds": round(elapsed, 3),
+        }
+
+
+def run_rate_limited(model, source, model_name, concurrency):
+    """Run the extractor on a copy of the file against a stub limiting the requests per second."""
+    with StubServer(model) as server, tempfile.TemporaryDirectory() as folder:
+        setup_environment(server)
+        extractor = MedicalPolicyExtractor(model_name=model_name)
+        path, requests, elapsed = timed_extraction(
+            model, extractor, source, folder, concurrency=concurrency
+        )
+        policies = check_output(path, model, model_name)
+        retries = sum(
+            policy["criteria"][-1]["usage"]["retries"] for policy in read_policies(path)
+        )
+        return {
+            "options": {"rate_limit": model.rate_limit.limit, "concurrency": concurrency},
+            "policies": policies,
+            "requests": requests,
+            "rejected": model.rate_limit.rejected,
+            "retries": retries,
+            "seconds": round(elapsed, 3),
+            # Fastest run the rate limit allows
+            "min_seconds": round(policies * model.rate_limit.window / model.rate_limit.limit, 3),
+        }
+
+
+def run_cascade(model, source, model_name, concurrency):
+    """Run the extractor on a copy of the file with the model alone, then with the weak model of the stub as a cascade, returning their reports."""
+    reports = []
+    with StubServer(model) as server, tempfile.TemporaryDirectory() as folder:
+        setup_environment(server)
+        for cascade in [None, model.weak.name]:
+            extractor = MedicalPolicyExtractor(model_name=model_name, cascade_model=cascade)
+            path, requests, elapsed = timed_extraction(
+                model, extractor, source, folder, concurrency=concurrency
+            )
+            check_output(path, model, extractor.model_name)
+            reports.append(
+                {
+                    "options": {"cascade": cascade, "concurrency": concurrency},
+                    "requests": requests,
+                    "seconds": round(elapsed, 3),
+                    **summarize_cascade(path),
+                }
+            )
+    return reports
+
+
+def main():
+    """Run the standardization benchmark."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the standardization against a local stand-in of the API."
+    )
+    parser.add_argument(
+        "--data", type=str, default=OUTPUT_DIR, help="Folder of the saved policies."
+    )
+    parser.add_argument(
+        "--cat", type=str, default="radiology", help="Category to standardize."
+    )
+    parser.add_argument(
+        "--model", type=str, default="gpt-4o", help="Model name sent to the stub."
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.5,
+        help="Simulated latency, in seconds, of each completion of the stub.",
+    )
+    parser.add_argument(
+        "--batch-delay",
+        type=float,
+        default=1.0,
+        help="Simulated processing time, in seconds, of a batch job.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Concurrency of the concurrent mode.",
+    )
+    parser.add_argument(
+        "--long-cat",
+        type=str,
+        default="transplant",
+        help="Category of long position statements, extracted whole and in sections.",
+    )
+    parser.add_argument(
+        "--split-threshold",
+        type=int,
+        default=4000,
+        help="Characters above which a statement is extracted in sections.",
+    )
+    parser.add_argument(
+        "--seconds-per-token",
+        type=float,
+        default=0.002,
+        help="Simulated generation time, in seconds, of each completion token.",
+    )
+    parser.add_argument(
+        "--wide-concurrency",
+        type=int,
+        default=32,
+        help="Global concurrency of the long statements and folder modes.",
+    )
+    parser.add_argument(
+        "--pack-budget",
+        type=int,
+        default=1000,
+        help="Statement tokens per request of the packed mode.",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=4,
+        help="Requests per second accepted by the stub of the rate-limited mode.",
+    )
+    parser.add_argument(
+        "--cascade-model",
+        type=str,
+        default="gpt-3.5-turbo",
+        help="Cheaper model simulated by the stub for the cascade mode.",
+    )
+    parser.add_argument(
+        "--cascade-error-rate",
+        type=float,
+        default=0.2,
+        help="Share of the statements the cheaper model answers invalid criteria for.",
+    )
+    parser.add_argument(
+        "--cascade-speedup",
+        type=float,
+        default=3.0,
+        help="How many times faster the cheaper model answers.",
+    )
+    args = parser.parse_args()
+
+    source = os.path.join(args.data, f"{args.cat}_policies.json")
+    long_source = os.path.join(args.data, f"{args.long_cat}_policies.json")
+    model = StubModel(
+        args.data, args.latency, args.seconds_per_token, batch_delay=args.batch_delay
+    )
+    with StubServer(model) as server:
+        setup_environment(server)
+        reports = [
+            run_mode(model, source, args.model),
+            run_mode(model, source, args.model, concurrency=args.concurrency),
+            run_mode(model, source, args.model, pack_budget=args.pack_budget),
+            # Re-run over unchanged data, served from the cache
+            run_mode(model, source, args.model, runs=2, cache_path="cache.sqlite3"),
+            run_batch(model, source, args.model),
+            run_mode(model, long_source, args.model, concurrency=args.wide_concurrency),
+            run_mode(
+                model,
+                long_source,
+                args.model,
+                split_threshold=args.split_threshold,
+                concurrency=args.wide_concurrency,
+            ),
+            run_folder(model, args.data, args.model, args.wide_concurrency),
+            run_streaming(model, long_source, args.model, args.wide_concurrency),
+            run_mode(
+                model,
+                long_source,
+                args.model,
+                compact=True,
+                concurrency=args.wide_concurrency,
+            ),
+        ]
+    model = StubModel(args.data, args.latency, rate_limit=args.rate_limit, rate_window=1.0)
+    reports.append(run_rate_limited(model, source, args.model, args.wide_concurrency))
+    model = StubModel(
+        args.data,
+        args.latency,
+        args.seconds_per_token,
+        weak_model=args.cascade_model,
+        weak_error_rate=args.cascade_error_rate,
+        weak_speedup=args.cascade_speedup,
+    )
+    reports += run_cascade(model, source, args.model, args.concurrency)
+    for report in reports:
+        print(json.dumps(report))
+    print(f"Speed-up: {reports[0]['seconds'] / reports[1]['seconds']:.1f}x")
+    print(
+        f"Packing: {reports[0]['requests'] / reports[2]['requests']:.1f}x fewer requests, "
+        f"{reports[0]['prompt_tokens'] / reports[2]['prompt_tokens']:.1f}x fewer prompt tokens"
+    )
+    print(
+        f"Sections: slowest policy {reports[5]['max_seconds']}s whole, "
+        f"{reports[6]['max_seconds']}s in sections"
+    )
+    print(
+        f"Folder: {reports[7]['file_by_file_seconds']}s file by file, "
+        f"{reports[7]['seconds']}s in parallel, "
+        f"{reports[7]['slowest_file_seconds']}s for the slowest file alone"
+    )
+    print(
+        f"Streaming: first criteria after {reports[8]['median_first_seconds']}s "
+        f"(at most {reports[8]['max_first_seconds']}s), whole answers after "
+        f"{reports[8]['median_seconds']}s (at most {reports[8]['max_seconds']}s)"
+    )
+    print(
+        f"Compact: {reports[9]['completion_tokens']} completion tokens instead of "
+        f"{reports[5]['completion_tokens']} "
+        f"({1 - reports[9]['completion_tokens'] / reports[5]['completion_tokens']:.0%} fewer), "
+        f"slowest policy {reports[9]['max_seconds']}s instead of {reports[5]['max_seconds']}s"
+    )
+    print(
+        f"Rate limit: {reports[10]['policies']} policies in {reports[10]['seconds']}s "
+        f"({reports[10]['min_seconds']}s at best), {reports[10]['rejected']} requests "
+        f"rejected, {reports[10]['retries']} retries"
+    )
+    print(
+        f"Cascade: {reports[12]['escalated']}/{reports[12]['policies']} escalated, median "
+        f"{reports[11]['median_seconds']}s and ${reports[11]['cost_per_policy']:.4f} per policy "
+        f"with {args.model} alone, {reports[12]['median_seconds']}s and "
+        f"${reports[12]['cost_per_policy']:.4f} with {reports[12]['options']['cascade']} first"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Offline standardization of whole files or folders with the OpenAI Batch API.
+
+The prompts of every policy to extract are written to one batch input JSONL
+file, which is uploaded and submitted as a batch job. The job is described by a
+manifest saved next to the data, so its status can be checked and its results
+collected by later runs, without keeping a process alive. The collected
+criteria are merged into each policy, with their usage at batch pricing.
+"""
+
+import json
+import os
+import time
+
+import openai
+from langchain_community.adapters.openai import convert_message_to_dict
+from langchain_core.exceptions import OutputParserException
+
+from src.extraction_cache import text_hash
+from src.file_extraction import data_files, has_criteria, set_criteria_entry, write_policies
+from src.model_requests import PARSER, PROMPT
+from src.policy_packing import token_cost
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# Batch requests are billed at half the price of the interactive ones
+BATCH_PRICE_FACTOR = 0.5
+FINAL_STATUSES = frozenset(["completed", "failed", "expired", "cancelled"])
+
+
+class BatchJob:
+    """Submit, follow and collect the batch extraction of a file or folder."""
+
+    def __init__(self, extractor, data_path: str, client=None):
+        self.extractor = extractor
+        self.data_path = data_path
+        self.client = client or openai.OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_API_BASE"),
+        )
+        folder = data_path if os.path.isdir(data_path) else os.path.dirname(data_path)
+        name = "all" if os.path.isdir(data_path) else os.path.basename(data_path)
+        self.cache_dir = os.path.join(folder or ".", ".cache")
+        self.manifest_path = os.path.join(
+            self.cache_dir, f"batch_{extractor.model_name}_{name}.json"
+        )
+        self.input_path = self.manifest_path.replace(".json", "_input.jsonl")
+
+    def request_body(self, position_statement):
+        """Build the chat completion request of a position statement."""
+        messages = PROMPT.format_messages(
+            **self.extractor.requests.format.chain_input(position_statement)
+        )
+        return {
+            "model": self.extractor.model_name,
+            "temperature": 0,
+            "messages": [convert_message_to_dict(message) for message in messages],
+        }
+
+    def write_input(self):
+        """Write the batch input file, returning the manifest of its requests.
+
+        As in the file extraction, policies that already have criteria for the
+        model are skipped, unless forced, and the ones whose extraction is
+        cached are updated right away instead.
+        """
+        requests = {}
+        with open(self.input_path, "w", encoding="utf-8") as input_file:
+            for file_index, file_path in enumerate(data_files(self.data_path)):
+                with open(file_path, encoding="utf-8") as file:
+                    policies = json.load(file)
+                cached = 0
+                for index, policy in enumerate(policies):
+                    if not self.extractor.force and has_criteria(policy, self.extractor.model_name):
+                        continue
+                    response = self.extractor.cached_response(policy["content"])
+                    if response is not None:
+                        set_criteria_entry(policy, self.criteria_entry(response))
+                        cached += 1
+                        continue
+                    custom_id = f"{file_index}-{index}"
+                    line = {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": BATCH_ENDPOINT,
+                        "body": self.request_body(policy["content"]),
+                    }
+                    input_file.write(json.dumps(line) + "\n")
+                    requests[custom_id] = {
+                        "file": file_path,
+                        "url": policy["url"],
+                        "content_hash": text_hash(policy["content"]),
+                    }
+                if cached:
+                    write_policies(file_path, policies)
+                    print(f"{cached} cached policies updated in {file_path}")
+        return requests
+
+    def criteria_entry(self, response):
+        """Build the criteria entry of the model from an extraction response."""
+        return {
+            "model": self.extractor.model_name,
+            "criteria": response["criteria"],
+            "usage": response["usage"],
+        }
+
+    def load_manifest(self):
+        """Load the manifest of the submitted batch."""
+        if not os.path.isfile(self.manifest_path):
+            raise ValueError(f"No batch was submitted for {self.data_path}")
+        with open(self.manifest_path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def submit(self):
+        """Write the batch input, upload it and create the batch job."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        requests = self.write_input()
+        if not requests:
+            print("Every policy is already extracted, no batch to submit.")
+            return None
+        with open(self.input_path, "rb") as file:
+            input_file = self.client.files.create(file=file, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+        )
+        manifest = {
+            "batch_id": batch.id,
+            "model": self.extractor.model_name,
+            "prompt_hash": self.extractor.requests.format.prompt_hash,
+            "requests": requests,
+        }
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        print(f"Submitted batch {batch.id} with {len(requests)} requests.")
+        return batch
+
+    def status(self):
+        """Get the batch job of the manifest, printing its progress."""
+        batch = self.client.batches.retrieve(self.load_manifest()["batch_id"])
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""
+        print(f"Batch {batch.id}: {batch.status}{progress}")
+        return batch
+
+    def wait(self, poll_interval: float = 30.0):
+        """Poll the batch job until it reaches a final status."""
+        batch = self.status()
+        while batch.status not in FINAL_STATUSES:
+            time.sleep(poll_interval)
+            batch = self.status()
+        return batch
+
+    def batch_cost(self, prompt_tokens, completion_tokens):
+        """Get the cost of a request at batch pricing, 0 for an unknown model."""
+        return (
+            token_cost(self.extractor.model_name, prompt_tokens, completion_tokens)
+            * BATCH_PRICE_FACTOR
+        )
+
+    def parse_result(self, result, batch):
+        """Parse the output line of a request into an extraction response, or None."""
+        if result.get("error") or result["response"]["status_code"] != 200:
+            print(f"Request {result['custom_id']} failed: {result.get('error') or result['response']}")
+            return None
+        body = result["response"]["body"]
+        try:
+            criteria = PARSER.parse(
+                body["choices"][0]["message"]["content"]
+            )
+        except OutputParserException as exc:
+            print(f"Request {result['custom_id']} returned invalid JSON: {exc}")
+            return None
+        usage = body["usage"]
+        return {
+            "criteria": criteria,
+            "usage": {
+                "total_tokens": usage["total_tokens"],
+                "prompt_tokens": usage["prompt_tokens"],
+                "completion_tokens": usage["completion_tokens"],
+                "total_cost": self.batch_cost(
+                    usage["prompt_tokens"], usage["completion_tokens"]
+                ),
+                # The requests of a batch are not timed individually
+                "processing_time": None,
+                "batch_id": batch.id,
+            },
+        }
+
+    def read_results(self, batch):
+        """Parse the output and error files of a batch, returning the responses by request ID.
+
+        Either file is missing when none of the requests succeeded or failed,
+        and both are when the batch failed before running any of them.
+        """
+        responses = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    result = json.loads(line)
+                    response = self.parse_result(result, batch)
+                    if response is not None:
+                        responses[result["custom_id"]] = response
+        for error in batch.errors.data if batch.errors and batch.errors.data else []:
+            print(f"Batch {batch.id} error: {error.message}")
+        return responses
+
+    def collect(self):
+        """Merge the results of the finished batch into the policies, returning their number.
+
+        The requests completed by an expired, cancelled or failed batch are
+        collected too, the other ones are left to a new submission.
+        """
+        manifest = self.load_manifest()
+        batch = self.client.batches.retrieve(manifest["batch_id"])
+        if batch.status not in FINAL_STATUSES:
+            print(f"Batch {batch.id} is {batch.status}, nothing to collect yet.")
+            return 0
+        if batch.status != "completed":
+            print(f"Batch {batch.id} is {batch.status}, collecting its completed requests.")
+        responses = self.read_results(batch)
+
+        by_file = {}
+        for custom_id, request in manifest["requests"].items():
+            if custom_id in responses:
+                by_file.setdefault(request["file"], []).append(
+                    (request, responses[custom_id])
+                )
+        collected = 0
+        for file_path, results in by_file.items():
+            with open(file_path, encoding="utf-8") as file:
+                policies = json.load(file)
+            policies_by_url = {policy["url"]: policy for policy in policies}
+            for request, response in results:
+                policy = policies_by_url.get(request["url"])
+                # The position statement may have been re-scraped since the submission
+                if policy is None or text_hash(policy["content"]) != request["content_hash"]:
+                    print(f"-> Skipping {request['url']}, changed since the submission")
+                    continue
+                if manifest["prompt_hash"] == self.extractor.requests.format.prompt_hash:
+                    self.extractor.cache_response(policy["content"], response)
+                set_criteria_entry(policy, self.criteria_entry(response))
+                collected += 1
+            write_policies(file_path, policies)
+        print(f"Collected {collected} of {len(manifest['requests'])} requests of batch {batch.id}.")
+        return collected
+
+    def run(self, poll_interval: float = 30.0):
+        """Submit the batch, wait for it and collect its results."""
+        if self.submit() is None:
+            return 0
+        self.wait(poll_interval)
+        return self.collect()
@@ -0,0 +1,232 @@
+"""Browser sessions of the scrapers: the lean Firefox drivers and their pool.
+
+`BrowserManager` owns the WebDriver sessions of a run, a main one browsing the
+listing and a bounded `DriverPool` of headless ones visiting the documents,
+reused across categories and quit at exit. `HostLimiter` caps the concurrent
+page loads against a host, and `PageReadiness` waits on concrete page signals
+with timeouts adapted to the observed latencies.
+"""
+
+import atexit
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from selenium import webdriver
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Firefox preferences of the lean browser profile: the scraper only needs the
+# DOM, so images, web fonts and media are never loaded
+LEAN_PROFILE_PREFERENCES = {
+    "permissions.default.image": 2,
+    "gfx.downloadable_fonts.enabled": False,
+    "browser.display.use_document_fonts": 0,
+    "media.autoplay.default": 5,
+    "media.mediasource.enabled": False,
+    "media.peerconnection.enabled": False,
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "browser.sessionhistory.max_entries": 2,
+    "browser.shell.checkDefaultBrowser": False,
+    "datareporting.policy.dataSubmissionEnabled": False,
+    "toolkit.telemetry.enabled": False,
+}
+
+
+def setup_driver(headful: bool = False, user_agent: str = None, maximize: bool = False):
+    """Set up a Firefox driver with the lean browser profile, and the user-agent of the site if any."""
+    options = webdriver.FirefoxOptions()
+    if not headful:
+        options.add_argument("--headless")
+    for name, value in LEAN_PROFILE_PREFERENCES.items():
+        options.set_preference(name, value)
+    if user_agent:
+        options.set_preference("general.useragent.override", user_agent)
+    driver = webdriver.Firefox(options=options)
+    if maximize:
+        driver.maximize_window()
+    return driver
+
+
+def reset_driver(driver):
+    """Bring a driver back to a blank state: single window, no cookies nor storage."""
+    handles = driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+    driver.delete_all_cookies()
+    driver.execute_script(
+        "try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}"
+    )
+    driver.get("about:blank")
+
+
+class DriverPool:
+    """A bounded pool of WebDriver sessions shared by worker threads."""
+
+    def __init__(self, size: int, factory):
+        self.size = size
+        self.factory = factory
+        self.drivers = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Get an idle driver, starting a new session while the pool is not full."""
+        with self._lock:
+            if self._idle.empty() and len(self.drivers) < self.size:
+                driver = self.factory()
+                self.drivers.append(driver)
+                return driver
+        return self._idle.get()
+
+    def release(self, driver):
+        """Give a driver back to the pool."""
+        self._idle.put(driver)
+
+    @contextmanager
+    def session(self):
+        """Borrow a driver for the duration of a `with` block."""
+        driver = self.acquire()
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def quit(self):
+        """Quit every session started by the pool."""
+        with self._lock:
+            for driver in self.drivers:
+                driver.quit()
+            self.drivers = []
+            self._idle = queue.Queue()
+
+
+class HostLimiter:
+    """Cap the number of concurrent page loads against a single host."""
+
+    def __init__(self, max_per_host: int):
+        self.max_per_host = max_per_host
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, url):
+        """Hold one of the host's slots for the duration of a `with` block."""
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._slots.setdefault(
+                host, threading.BoundedSemaphore(self.max_per_host)
+            )
+        with semaphore:
+            yield
+
+
+class PageReadiness:
+    """Wait on concrete page signals, with timeouts adapted to the observed latencies."""
+
+    def __init__(
+        self,
+        min_delay: float = 0.0,
+        min_timeout: float = 2.0,
+        max_timeout: float = 30.0,
+        history: int = 50,
+    ):
+        self.min_delay = min_delay
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.latencies = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        """Record how long the site took to reach a signal."""
+        with self._lock:
+            self.latencies.append(latency)
+
+    def timeout(self):
+        """Get a timeout of a few times the recent 95th percentile latency, within bounds."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return self.max_timeout
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        return min(self.max_timeout, max(self.min_timeout, 4 * p95))
+
+    def wait(self, driver, condition, timeout=None):
+        """Wait until `condition` holds, and record how long it took."""
+        start_time = time.perf_counter()
+        result = WebDriverWait(
+            driver, timeout or self.timeout(), poll_frequency=0.05
+        ).until(condition)
+        self.record(time.perf_counter() - start_time)
+        return result
+
+    def load(self, driver, url):
+        """Navigate to a URL, and record how long the page load took."""
+        start_time = time.perf_counter()
+        driver.get(url)
+        self.record(time.perf_counter() - start_time)
+
+    def pause(self):
+        """Sleep for the optional politeness delay between two requests to the site."""
+        if self.min_delay > 0:
+            time.sleep(random.uniform(self.min_delay, 2 * self.min_delay))
+
+
+def text_changed(locator, previous):
+    """Expected condition: the text of an element is present and differs from `previous`."""
+
+    def condition(driver):
+        elements = driver.find_elements(*locator)
+        return bool(elements) and elements[0].text != previous
+
+    return condition
+
+
+class BrowserManager:
+    """Own the WebDriver sessions of a run, reused across categories and quit at exit."""
+
+    def __init__(
+        self, headful: bool = False, workers: int = 1, user_agent: str = None, maximize: bool = False
+    ):
+        self.headful = headful
+        self.user_agent = user_agent
+        self.maximize = maximize
+        self._driver = None
+        # Worker sessions are always headless and only started when needed
+        self.pool = DriverPool(
+            max(1, workers), lambda: setup_driver(False, self.user_agent, self.maximize)
+        )
+        atexit.register(self.quit)
+
+    @property
+    def driver(self):
+        """The main session, used to browse the listing pages."""
+        if self._driver is None:
+            self._driver = setup_driver(self.headful, self.user_agent, self.maximize)
+        return self._driver
+
+    def reset(self):
+        """Reset the sessions between two categories so no filter state leaks."""
+        if self._driver is not None:
+            reset_driver(self._driver)
+        for driver in self.pool.drivers:
+            driver.get("about:blank")
+
+    def quit(self):
+        """Quit every session, it is safe to call it several times."""
+        self.pool.quit()
+        if self._driver is not None:
+            self._driver.quit()
+            self._driver = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.quit()
@@ -0,0 +1,136 @@
+"""Compact output format of the model, expanded back to the schema of the instructions.
+
+In the compact format, the criteria objects have short keys ("a", "s", "n",
+"d", "c"), the necessity types are codes (e.g. "INMN"), the medical act is
+omitted when it repeats the previous one, the null keys are omitted, and a
+text copied from the position statement is a span, the pair of its first and
+last words, instead of the text itself. The JSON is written on a single line.
+This cuts the completion tokens, the slowest and most expensive part of a
+request, and the extractor expands every answer back to the same criteria as
+the full format.
+
+A span is looked up in the text of the statement without its HTML tags, from
+the end of the previous span, so that repeated sentences resolve in the order
+of the statement, then from its start. A span found nowhere, misquoted by the
+model, is kept as its two ends joined by " ... " and listed in the usage, so
+that one wrong quote does not fail the whole policy.
+"""
+
+import html
+import json
+import re
+
+from src.criteria_schema import LOGIC_OPERATORS
+from src.policy_packing import count_tokens
+
+NECESSITY_CODES = {
+    "MN": "Medically Necessary",
+    "NMN": "Not Medically Necessary",
+    "INMN": "Investigational and Not Medically Necessary",
+    "CNMN": "Cosmetic and Not Medically Necessary",
+    "COS": "Cosmetic",
+    "REC": "Reconstructive",
+}
+
+
+def plain_text(position_statement: str):
+    """Get the text of a position statement without its HTML tags, as the spans refer to it."""
+    text = html.unescape(re.sub(r"<[^>]*>", " ", position_statement))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def find_span(text: str, prefix: str, suffix: str, start: int = 0):
+    """Find the span starting with `prefix` and ending with `suffix`, returning its start and end.
+
+    The span is looked up from `start`, then from the start of the text.
+    """
+    for origin in dict.fromkeys([start, 0]):
+        position = text.find(prefix, origin)
+        while position >= 0:
+            end = text.find(suffix, position + len(prefix))
+            if end >= 0:
+                return position, end + len(suffix)
+            position = text.find(prefix, position + 1)
+    raise ValueError(f"Span not found in the position statement: {prefix!r} ... {suffix!r}")
+
+
+class CompactCodec:
+    """Expand the compact criteria of a position statement, in order."""
+
+    def __init__(self, position_statement: str):
+        self.text = plain_text(position_statement)
+        self.cursor = 0
+        self.medical_act = None
+        # Spans not found in the statement, as answered
+        self.unresolved = []
+
+    def expand_text(self, value):
+        """Expand a text, copied from the statement if it is a span."""
+        if not isinstance(value, list):
+            return value
+        if len(value) != 2 or not all(isinstance(words, str) for words in value):
+            raise ValueError(f"Invalid span: {value!r}")
+        try:
+            start, self.cursor = find_span(self.text, value[0], value[1], self.cursor)
+        except ValueError:
+            self.unresolved.append(value)
+            return " ... ".join(value)
+        return self.text[start : self.cursor]
+
+    def expand_conditions(self, node):
+        """Expand a conditions tree, the other values being kept as they are."""
+        if isinstance(node, dict) and len(node) == 1 and next(iter(node)) in LOGIC_OPERATORS:
+            operator, items = next(iter(node.items()))
+            if isinstance(items, list):
+                return {operator: [self.expand_conditions(item) for item in items]}
+        if isinstance(node, dict) and "d" in node and set(node) <= {"d", "c"}:
+            return {
+                "desc": self.expand_text(node["d"]),
+                "conditions": self.expand_conditions(node.get("c")),
+            }
+        return node
+
+    def expand_criterion(self, item):
+        """Expand a compact criteria object, an object in the full format being kept as it is."""
+        if not isinstance(item, dict) or "medical_act" in item or "necessity_type" in item:
+            return item
+        if "a" in item:
+            self.medical_act = item["a"]
+        elif self.medical_act is None:
+            raise ValueError(f"Missing medical act in the compact criteria: {item!r}")
+        necessity_type = item.get("n")
+        return {
+            "medical_act": self.medical_act,
+            "sub_medical_act": item.get("s"),
+            "necessity_type": NECESSITY_CODES.get(necessity_type, necessity_type),
+            "description": self.expand_text(item.get("d")),
+            "conditions": self.expand_conditions(item.get("c")),
+        }
+
+
+def expand_criteria(criteria, position_statement: str):
+    """Expand the compact criteria answered for a position statement to the full format.
+
+    Return the expanded criteria and the spans not found in the statement.
+    """
+    codec = CompactCodec(position_statement)
+    if isinstance(criteria, list):
+        criteria = [codec.expand_criterion(item) for item in criteria]
+    else:
+        criteria = codec.expand_criterion(criteria)
+    return criteria, codec.unresolved
+
+
+def compact_usage(usage, criteria, model_name: str, unresolved=()):
+    """Record in the usage the completion tokens saved by the compact format, and the unresolved spans.
+
+    They are counted against the criteria written in the full format, indented
+    as the model writes them.
+    """
+    expanded_tokens = count_tokens(json.dumps(criteria, indent=2), model_name)
+    usage["compact"] = {
+        "expanded_tokens": expanded_tokens,
+        "saved_tokens": expanded_tokens - usage["completion_tokens"],
+        "unresolved_spans": list(unresolved),
+    }
+    return usage
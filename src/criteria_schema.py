@@ -0,0 +1,107 @@
+"""Validation of the extracted criteria against the schema of the instructions.
+
+The criteria of a position statement are a list of objects with the keys of
+the instructions, a known necessity type, and conditions that are either null
+or a single ALL/ANY operator over a non-empty list of conditions (`desc` and
+`conditions`) or nested operators. Every necessity heading of the statement
+must be covered by at least one criteria object, and the list can only be
+empty for a statement without any necessity wording.
+"""
+
+import re
+
+from src.policy_sections import NECESSITY_HEADING
+
+CRITERIA_KEYS = ["medical_act", "sub_medical_act", "necessity_type", "description", "conditions"]
+LOGIC_OPERATORS = ["ALL", "ANY"]
+# Necessity types of the instructions and of the headings of the saved policies,
+# the headings of the statement being valid too
+NECESSITY_TYPES = frozenset(
+    [
+        "medically necessary",
+        "not medically necessary",
+        "investigational and not medically necessary",
+        "cosmetic",
+        "cosmetic and not medically necessary",
+        "reconstructive",
+    ]
+)
+# Wording of a necessity type, in a heading or in a sentence
+NECESSITY_WORDING = re.compile(
+    r"\b(?:medically\s+necessary|investigational|cosmetic|reconstructive)\b", re.IGNORECASE
+)
+
+
+def normalize_necessity(text: str):
+    """Normalize a necessity type or heading for the comparisons."""
+    return re.sub(r"\s+", " ", text).strip(" :").lower()
+
+
+def statement_necessity_types(position_statement: str):
+    """Get the normalized necessity headings of a position statement."""
+    return {
+        normalize_necessity(heading.group(0))
+        for heading in NECESSITY_HEADING.finditer(position_statement)
+    }
+
+
+def condition_errors(node, path: str):
+    """Get the errors of a conditions tree."""
+    if node is None:
+        return []
+    if not isinstance(node, dict) or len(node) != 1 or next(iter(node)) not in LOGIC_OPERATORS:
+        return [f"{path}: expected null or a single ALL or ANY operator"]
+    operator, items = next(iter(node.items()))
+    if not isinstance(items, list) or not items:
+        return [f"{path}.{operator}: expected a non-empty list"]
+    errors = []
+    for index, item in enumerate(items):
+        item_path = f"{path}.{operator}[{index}]"
+        if isinstance(item, dict) and "desc" in item:
+            if not isinstance(item["desc"], str) or not item["desc"].strip():
+                errors.append(f"{item_path}.desc: expected a text")
+            errors += condition_errors(item.get("conditions"), f"{item_path}.conditions")
+        else:
+            # A nested operator
+            errors += condition_errors(item, item_path)
+    return errors
+
+
+def criterion_errors(criterion, path: str, headings):
+    """Get the errors of a criteria object."""
+    if not isinstance(criterion, dict):
+        return [f"{path}: expected an object"]
+    errors = []
+    missing = [key for key in CRITERIA_KEYS if key not in criterion]
+    if missing:
+        errors.append(f"{path}: missing {', '.join(missing)}")
+    if not isinstance(criterion.get("medical_act"), str) or not criterion["medical_act"].strip():
+        errors.append(f"{path}.medical_act: expected a text")
+    necessity_type = criterion.get("necessity_type")
+    if not isinstance(necessity_type, str) or (
+        normalize_necessity(necessity_type) not in NECESSITY_TYPES | headings
+    ):
+        errors.append(f"{path}.necessity_type: unknown {necessity_type!r}")
+    return errors + condition_errors(criterion.get("conditions"), f"{path}.conditions")
+
+
+def validate_criteria(criteria, position_statement: str):
+    """Get the errors of the criteria extracted from a position statement, none if they are valid."""
+    if isinstance(criteria, dict):
+        criteria = [criteria]
+    if not isinstance(criteria, list):
+        return ["expected a list of criteria"]
+    if not criteria and NECESSITY_WORDING.search(position_statement):
+        return ["no criteria for a statement with necessity wording"]
+    headings = statement_necessity_types(position_statement)
+    errors = []
+    for index, criterion in enumerate(criteria):
+        errors += criterion_errors(criterion, f"[{index}]", headings)
+    covered = {
+        normalize_necessity(criterion["necessity_type"])
+        for criterion in criteria
+        if isinstance(criterion, dict) and isinstance(criterion.get("necessity_type"), str)
+    }
+    for heading in sorted(headings - covered):
+        errors.append(f"no criteria for the {heading!r} heading")
+    return errors
@@ -0,0 +1,273 @@
+"""Streaming extraction, yielding each criteria object as soon as it is parsed.
+
+The answer of the model is a JSON list of criteria objects, possibly in a
+markdown code block. As its tokens come, the text is scanned for the top-level
+objects of the list, and each one is decoded once its closing brace arrives, so
+the first criteria of a long position statement can be used well before the
+end of the completion. An answer that is a single object, not a list, is
+decoded once complete. In the compact format, each object is expanded as it
+comes. The whole answer is still parsed by the JSON parser of the model chains at
+the end, into the same criteria as `extract_policy`.
+
+A statement longer than the split threshold of the extractor is streamed in
+sections, requested concurrently as in `extract_statement`: the criteria of a
+section come once the ones of the sections before it are done.
+"""
+
+import asyncio
+import itertools
+import json
+import time
+
+from src.compact_schema import CompactCodec, compact_usage, expand_criteria
+from src.model_requests import PARSER
+from src.policy_packing import count_tokens, token_cost
+from src.policy_sections import merge_criteria, merge_usage
+from src.rate_limit import RETRYABLE_ERRORS, reported_errors
+
+# Marks the end of the criteria of a section in its queue
+SECTION_END = object()
+
+
+def criteria_list(criteria):
+    """Get the criteria objects of an answer, a single object being a list of one."""
+    return criteria if isinstance(criteria, list) else [criteria]
+
+
+class CriteriaParser:
+    """Decode the top-level criteria objects of a JSON answer as its text comes."""
+
+    def __init__(self):
+        self.text = ""
+        # "[" or "{", once the answer started
+        self.root = None
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._start = None
+
+    @property
+    def done(self):
+        """Whether the answer is complete, its root closed."""
+        return self.root is not None and self._depth == 0
+
+    def object_depth(self):
+        """Get the depth of the criteria objects, inside the list or alone."""
+        return 2 if self.root == "[" else 1
+
+    def scan_string(self, char):
+        """Follow a character of a JSON string, until its closing quote."""
+        if self._escaped:
+            self._escaped = False
+        elif char == "\\":
+            self._escaped = True
+        elif char == '"':
+            self._in_string = False
+
+    def feed(self, text: str):
+        """Add a chunk of the answer, returning the criteria objects it completes."""
+        self.text += text
+        criteria = []
+        for index in range(self._scanned, len(self.text)):
+            char = self.text[index]
+            if self.done:
+                break
+            if self._in_string:
+                self.scan_string(char)
+            elif self.root is None and char not in "[{":
+                # The opening of a markdown code block
+                continue
+            elif char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self.root = self.root or char
+                self._depth += 1
+                if char == "{" and self._depth == self.object_depth():
+                    self._start = index
+            elif char in "]}":
+                if char == "}" and self._depth == self.object_depth() and self._start is not None:
+                    try:
+                        criteria.append(json.loads(self.text[self._start : index + 1]))
+                    except json.JSONDecodeError:
+                        # Left to the parser of the whole answer, which raises it
+                        pass
+                    self._start = None
+                self._depth -= 1
+        self._scanned = len(self.text)
+        return criteria
+
+
+class CriteriaStream:
+    """Stream the criteria of a position statement, synchronously or asynchronously.
+
+    Iterating over the stream (with `for` or `async for`) yields each criteria
+    object as soon as it is parsed. Once the iteration is over, `response`
+    holds the criteria and the usage of the extraction, as returned by
+    `extract_statement`, with `time_to_first_criterion` next to
+    `processing_time`, or None if the extraction failed.
+
+    Simple, cached and cascaded position statements are not streamed, their
+    criteria are yielded at once, the ones of a cascade model being validated
+    whole before they are kept.
+    """
+
+    def __init__(self, extractor, position_statement: str, limiter=None):
+        self.extractor = extractor
+        self.position_statement = position_statement
+        self.limiter = limiter
+        self.response = None
+        self.codec = None
+
+    def build_response(self, parser, usage_metadata, start_time, first_time, retries):
+        """Parse the whole answer and gather its usage, counting the tokens if the API did not."""
+        requests = self.extractor.requests
+        criteria = PARSER.parse(parser.text)
+        unresolved = ()
+        if requests.format.compact:
+            criteria, unresolved = expand_criteria(criteria, self.position_statement)
+        end_time = time.time()
+        if usage_metadata:
+            prompt_tokens = usage_metadata["input_tokens"]
+            completion_tokens = usage_metadata["output_tokens"]
+        else:
+            chain_input = requests.format.chain_input(self.position_statement)
+            prompt_tokens = requests.estimate_tokens(chain_input)
+            completion_tokens = count_tokens(parser.text, requests.chains.strong_model)
+        usage = {
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_cost": token_cost(requests.chains.strong_model, prompt_tokens, completion_tokens),
+            "processing_time": end_time - start_time,
+            # None when the answer has no criteria
+            "time_to_first_criterion": first_time and first_time - start_time,
+            "retries": retries,
+        }
+        if requests.format.compact:
+            compact_usage(usage, criteria, requests.chains.strong_model, unresolved)
+        response = {"criteria": criteria, "usage": usage}
+        self.extractor.cache_response(self.position_statement, response)
+        return response
+
+    def parsed(self, parser, text):
+        """Add a chunk of the answer to the parser, returning the criteria objects it completes, expanded."""
+        criteria = parser.feed(text)
+        if self.extractor.requests.format.compact:
+            criteria = [self.codec.expand_criterion(criterion) for criterion in criteria]
+        return criteria
+
+    async def astream(self):
+        """Yield the criteria objects of the answer as they are parsed, in turn in the limiter, setting the response at the end.
+
+        A failed request is retried until its first token only, the criteria
+        already yielded could not be taken back.
+        """
+        requests = self.extractor.requests
+        limiter = self.limiter or requests.limiter
+        chain_input = requests.format.chain_input(self.position_statement)
+        estimated_tokens = requests.estimate_tokens(chain_input)
+        for attempt in itertools.count():
+            requests.circuit_breaker.check()
+            parser = CriteriaParser()
+            self.codec = CompactCodec(self.position_statement)
+            usage_metadata = first_time = None
+            try:
+                async with limiter.request(estimated_tokens):
+                    start_time = time.time()
+                    async for chunk in requests.chains.stream_chain.astream(chain_input):
+                        usage_metadata = chunk.usage_metadata or usage_metadata
+                        for criterion in self.parsed(parser, chunk.content):
+                            first_time = first_time or time.time()
+                            yield criterion
+            except RETRYABLE_ERRORS as exc:
+                if parser.text:
+                    raise
+                await asyncio.sleep(requests.request_failed(exc, attempt, limiter))
+                continue
+            self.response = self.build_response(
+                parser, usage_metadata, start_time, first_time, attempt
+            )
+            limiter.adjust(self.response["usage"]["total_tokens"] - estimated_tokens)
+            limiter.succeeded()
+            requests.circuit_breaker.record_success()
+            return
+
+    async def astream_policy(self):
+        """Yield the criteria of the position statement, from the cache or streamed."""
+        self.response = self.extractor.cached_response(self.position_statement)
+        if self.response is not None:
+            for criterion in criteria_list(self.response["criteria"]):
+                yield criterion
+            return
+        with reported_errors():
+            async for criterion in self.astream():
+                yield criterion
+
+    async def astream_sections(self, sections):
+        """Stream the sections of the position statement concurrently, yielding their criteria in order, then merging them."""
+        start_time = time.time()
+        streams = [CriteriaStream(self.extractor, section, self.limiter) for section in sections]
+        queues = [asyncio.Queue() for _ in streams]
+
+        async def fill(stream, queue):
+            try:
+                async for criterion in stream.astream_policy():
+                    await queue.put(criterion)
+            finally:
+                queue.put_nowait(SECTION_END)
+
+        tasks = [
+            asyncio.ensure_future(fill(stream, queue)) for stream, queue in zip(streams, queues)
+        ]
+        first_time = None
+        try:
+            for queue in queues:
+                while (criterion := await queue.get()) is not SECTION_END:
+                    first_time = first_time or time.time()
+                    yield criterion
+            await asyncio.gather(*tasks)
+        finally:
+            # Only the sections of a stream left before its end are still running
+            for task in tasks:
+                task.cancel()
+        responses = [stream.response for stream in streams]
+        if any(response is None for response in responses):
+            return
+        usage = merge_usage([response["usage"] for response in responses], time.time() - start_time)
+        usage["time_to_first_criterion"] = first_time and first_time - start_time
+        self.response = {
+            "criteria": merge_criteria([response["criteria"] for response in responses]),
+            "usage": usage,
+        }
+
+    async def __aiter__(self):
+        extractor = self.extractor
+        self.response = extractor.rule_response(self.position_statement)
+        if self.response is None and extractor.requests.chains.cascade_chain is not None:
+            self.response = await extractor.aextract_statement(self.position_statement, self.limiter)
+            if self.response is None:
+                return
+        if self.response is not None:
+            for criterion in criteria_list(self.response["criteria"]):
+                yield criterion
+            return
+        sections = extractor.statement_sections(self.position_statement)
+        criteria = (
+            self.astream_policy() if len(sections) == 1 else self.astream_sections(sections)
+        )
+        async for criterion in criteria:
+            yield criterion
+
+    def __iter__(self):
+        # The stream runs on the event loop of the synchronous calls of the extractor
+        criteria = self.__aiter__()
+        try:
+            while True:
+                try:
+                    criterion = self.extractor.requests.run(criteria.__anext__())
+                except StopAsyncIteration:
+                    return
+                yield criterion
+        finally:
+            self.extractor.requests.run(criteria.aclose())
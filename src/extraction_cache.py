@@ -0,0 +1,111 @@
+"""Persistent cache of the LLM extractions, in a local SQLite database.
+
+An extraction is keyed by the model name, a hash of the instructions and prompt
+template, and a hash of the position statement, so a change to any of them is a
+miss. The least recently used entries are evicted above a size budget.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = "./ddata/.cache/extractions.sqlite3"
+DEFAULT_CACHE_SIZE = 256 * 2**20
+
+
+def text_hash(text):
+    """Get the SHA-256 hex digest of a text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """Store the extraction responses by model, prompt and content hash."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size: int = DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS extractions (
+                    model TEXT NOT NULL,
+                    prompt_hash TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, prompt_hash, content_hash)
+                )
+                """
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS extractions_last_used ON extractions (last_used)"
+            )
+
+    def get(self, model, prompt_hash, content):
+        """Get the cached response of an extraction, or None."""
+        key = (model, prompt_hash, text_hash(content))
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT response FROM extractions"
+                " WHERE model = ? AND prompt_hash = ? AND content_hash = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE extractions SET last_used = ?"
+                " WHERE model = ? AND prompt_hash = ? AND content_hash = ?",
+                (time.time(), *key),
+            )
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, model, prompt_hash, content, response):
+        """Store the response of an extraction, evicting the oldest entries if needed."""
+        data = json.dumps(response)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    model,
+                    prompt_hash,
+                    text_hash(content),
+                    data,
+                    len(data),
+                    time.time(),
+                ),
+            )
+            self._evict()
+
+    def _evict(self):
+        """Delete the least recently used entries until the cache fits its size budget."""
+        total = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM extractions"
+        ).fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self._connection.execute(
+            "SELECT rowid, size FROM extractions ORDER BY last_used"
+        )
+        evicted = []
+        for rowid, size in rows:
+            if total <= self.max_size:
+                break
+            evicted.append((rowid,))
+            total -= size
+        self._connection.executemany("DELETE FROM extractions WHERE rowid = ?", evicted)
+
+    def close(self):
+        """Close the database."""
+        self._connection.close()
@@ -0,0 +1,203 @@
+"""Extraction of the policies of the JSON files of the scraped data.
+
+Policies that already have criteria for the model are not extracted again,
+unless forced. Each extraction is appended to the results log of the file as
+soon as it is done, and the file is written atomically once all its policies
+are done, so an interrupted run resumes from the log.
+"""
+
+import asyncio
+import json
+import os
+
+from src.policy_packing import pack_policies
+from src.results_log import ResultsLog
+from src.rule_extractor import extract_rules
+
+
+def data_files(data_path):
+    """Get the JSON files of a file or folder path."""
+    if os.path.isfile(data_path):
+        return [data_path]
+    return sorted(
+        os.path.join(data_path, name)
+        for name in os.listdir(data_path)
+        if os.path.isfile(os.path.join(data_path, name)) and name.endswith(".json")
+    )
+
+
+def write_policies(file_path, policies):
+    """Write the policies of a file, replacing it atomically."""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(policies, file, indent=2)
+    os.replace(tmp_path, file_path)
+
+
+def single_groups(policies):
+    """Function to get the groups extracting each policy in its own request."""
+    return [[index] for index in range(len(policies))]
+
+
+def has_criteria(policy, model_name: str):
+    """Function to check whether a policy already has criteria for a model."""
+    return any(entry["model"] == model_name for entry in policy.get("criteria", []))
+
+
+def set_criteria_entry(policy, criteria_entry):
+    """Function to set the criteria of a model, replacing its previous entry."""
+    entries = policy.setdefault("criteria", [])
+    for index, entry in enumerate(entries):
+        if entry["model"] == criteria_entry["model"]:
+            entries[index] = criteria_entry
+            return
+    entries.append(criteria_entry)
+
+
+class FileExtraction:
+    """Class extracting the policies of a JSON file with an extractor."""
+
+    def __init__(self, extractor, file_path: str, verbose: bool = False, pack_budget: int = 0):
+        """Initialize the extraction of a file.
+
+        With a packing budget, consecutive short position statements are packed
+        in one request, up to `pack_budget` statement tokens.
+        """
+        self.extractor = extractor
+        self.file_path = file_path
+        self.verbose = verbose
+        self.pack_budget = pack_budget
+        self.log = ResultsLog(file_path, extractor.model_name)
+        self.failed = []
+
+    def load(self):
+        """Function to load the policies of the file, resumed from its log, with the ones to extract."""
+        # Read the position statement from the json file
+        with open(self.file_path, encoding="utf-8") as file:
+            policies = json.load(file)
+
+        resumed = set()
+        for policy, criteria_entry in self.log.replay(policies):
+            set_criteria_entry(policy, criteria_entry)
+            resumed.add(id(policy))
+        pending = [
+            policy
+            for policy in policies
+            if id(policy) not in resumed
+            and (self.extractor.force or not has_criteria(policy, self.extractor.model_name))
+        ]
+
+        if self.verbose:
+            print(
+                f"Extracting {len(pending)} of {len(policies)} policies from {self.file_path}"
+                f" ({len(resumed)} resumed from the log)"
+            )
+        return policies, pending, bool(resumed)
+
+    def groups(self, policies):
+        """Function to group the policies to extract in each request.
+
+        The policies extracted by rules are never packed, the runs of policies
+        between them are.
+        """
+        if not self.pack_budget:
+            return single_groups(policies)
+
+        def pack(run):
+            # Groups of indices into the run, mapped back into `policies`
+            groups = pack_policies(
+                [policies[index] for index in run], self.pack_budget, self.extractor.model_name
+            )
+            return [[run[index] for index in group] for group in groups]
+
+        groups, run = [], []
+        for index, policy in enumerate(policies):
+            if self.extractor.rules and extract_rules(policy["content"]) is not None:
+                groups += pack(run)
+                groups.append([index])
+                run = []
+            else:
+                run.append(index)
+        groups += pack(run)
+        if self.verbose:
+            print(f"Packed {len(policies)} policies in {len(groups)} requests")
+        return groups
+
+    def record(self, policy, response):
+        """Function to set, log and measure the criteria of a response."""
+        model_name = self.extractor.model_name
+        if response is None:
+            self.failed.append(policy)
+            self.extractor.metrics.record_error(
+                model_name,
+                self.file_path,
+                self.extractor.failed_retries.pop(policy["content"], 0),
+            )
+            return
+        self.extractor.metrics.record(model_name, self.file_path, response["usage"])
+        criteria_entry = {
+            "model": model_name,
+            "criteria": response["criteria"],
+            "usage": response["usage"],
+        }
+        set_criteria_entry(policy, criteria_entry)
+        self.log.append(policy, criteria_entry)
+
+    def save(self, policies):
+        """Function to save the policies to the JSON file, then drop the log saved in it."""
+        write_policies(self.file_path, policies)
+        self.log.remove()
+        if self.failed:
+            print(
+                f"{len(self.failed)} policies of {self.file_path} could not be extracted,"
+                " run again to retry them."
+            )
+
+    def extract(self):
+        """Function to extract the policies of the file one request after the other."""
+        policies, pending, resumed = self.load()
+        if not pending and not resumed:
+            return
+        # Extract the policy for each medical act
+        try:
+            for group in self.groups(pending):
+                group_policies = [pending[index] for index in group]
+                responses = self.extractor.extract_group(group_policies, self.verbose)
+                for policy, response in zip(group_policies, responses):
+                    self.record(policy, response)
+        finally:
+            self.log.close()
+        self.save(policies)
+
+    async def aextract(self, limiter):
+        """Function to extract the policies of the file concurrently, with the requests limited by `limiter`."""
+        policies, pending, resumed = self.load()
+        if not pending and not resumed:
+            return
+        try:
+            await self.extractor.aextract_policies(
+                pending,
+                limiter.max_in_flight,
+                self.verbose,
+                self.groups(pending),
+                on_response=self.record,
+                limiter=limiter,
+            )
+        finally:
+            self.log.close()
+        self.save(policies)
+
+
+async def aextract_folder(extractor, folder_path: str, limiter, verbose: bool = False, pack_budget: int = 0):
+    """Function to extract the files of a folder concurrently, under the limits of `limiter`.
+
+    The largest files are started first, so the small ones are extracted
+    while they run, instead of after them.
+    """
+    files = sorted(data_files(folder_path), key=os.path.getsize, reverse=True)
+    await asyncio.gather(
+        *(
+            FileExtraction(extractor, file_path, verbose, pack_budget).aextract(limiter)
+            for file_path in files
+        )
+    )
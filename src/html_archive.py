@@ -0,0 +1,96 @@
+"""Content-addressed archive of the fetched documents.
+
+Every document is stored once, gzip-compressed and keyed by the SHA-256 of its
+HTML, with a per-category JSONL index of the URLs it was fetched from, so that
+the policies can be re-extracted offline after a change to the extraction or
+cleaning code.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class HtmlArchive:
+    """Content-addressed store of the fetched documents, gzip-compressed."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def object_path(self, digest):
+        """Get the path of the archived document with the given SHA-256 digest."""
+        return os.path.join(self.root, "objects", digest[:2], f"{digest}.html.gz")
+
+    def index_path(self, category):
+        """Get the path of the URL index of a category."""
+        return os.path.join(self.root, "index", f"{category}.jsonl")
+
+    def put(self, category, url, html):
+        """Store a document once, and record that it was fetched from the URL."""
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+
+        entry = {"url": url, "sha256": digest, "fetched_at": time.time()}
+        with self._lock:
+            os.makedirs(os.path.dirname(self.index_path(category)), exist_ok=True)
+            with open(self.index_path(category), "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+        return digest
+
+    def get(self, digest):
+        """Read an archived document."""
+        with gzip.open(self.object_path(digest), "rb") as file:
+            return file.read().decode("utf-8")
+
+    def latest_entries(self, category):
+        """Get the index entry of the latest fetch of each URL of a category, in index order."""
+        latest = {}
+        if os.path.isfile(self.index_path(category)):
+            with open(self.index_path(category), encoding="utf-8") as file:
+                for line in file:
+                    entry = json.loads(line)
+                    latest[entry["url"]] = entry
+        return latest
+
+    def entries(self, category):
+        """Get the digest of the latest fetch of each URL of a category, in index order."""
+        return {
+            url: entry["sha256"] for url, entry in self.latest_entries(category).items()
+        }
+
+    def compact(self, category, urls):
+        """Rewrite the index of a category with only the latest fetch of the given URLs.
+
+        The URLs no longer listed by the site are dropped, so they do not come
+        back when the category is rebuilt. A category without an index, where
+        nothing was archived yet, is left as is.
+        """
+        with self._lock:
+            if not os.path.isfile(self.index_path(category)):
+                return
+            latest = self.latest_entries(category)
+            tmp_path = f"{self.index_path(category)}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                for url in urls:
+                    if url in latest:
+                        file.write(json.dumps(latest[url]) + "\n")
+            os.replace(tmp_path, self.index_path(category))
+
+
+def extract_archived_document(scraper_class, archive_root, url, digest):
+    """Re-extract a policy record from an archived document."""
+    html = HtmlArchive(archive_root).get(digest)
+    policy = {"url": url, **scraper_class.parse_document(html)}
+    policy["content"] = scraper_class.clean_html(policy["html_content"])
+    return policy
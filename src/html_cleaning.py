@@ -0,0 +1,285 @@
+"""Bulk cleaning of the scraped position statement HTML fragments.
+
+`clean_html` produces exactly the output of `clean_html_soup`, the original
+BeautifulSoup implementation, without building a tree: it re-serializes the
+stream of events of the standard library HTML tokenizer (the one behind
+BeautifulSoup's "html.parser" backend) the way BeautifulSoup would, skipping the
+unwrapped tags. Fragments using features whose serialization is not replicated
+(comments, declarations, scripts, preformatted text, ...) fall back to
+BeautifulSoup.
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from html import unescape
+from html.parser import HTMLParser
+from itertools import islice
+
+from bs4 import BeautifulSoup
+from bs4.dammit import EntitySubstitution
+
+# Tags removed by the cleaning, keeping their content
+UNWRAPPED_TAGS = frozenset(["strong", "em", "div", "p"])
+
+# Serialization rules of BeautifulSoup's HTML tree builder
+VOID_TAGS = frozenset(
+    [
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "keygen",
+        "link",
+        "menuitem",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+        "basefont",
+        "bgsound",
+        "command",
+        "frame",
+        "image",
+        "isindex",
+        "nextid",
+        "spacer",
+    ]
+)
+MULTI_VALUED_ATTRIBUTES = {
+    "*": ("class", "accesskey", "dropzone"),
+    "a": ("rel", "rev"),
+    "link": ("rel", "rev"),
+    "td": ("headers",),
+    "th": ("headers",),
+    "form": ("accept-charset",),
+    "object": ("archive",),
+    "area": ("rel",),
+    "icon": ("sizes",),
+    "iframe": ("sandbox",),
+    "output": ("for",),
+}
+# Tags whose content BeautifulSoup stores or outputs differently
+FALLBACK_TAGS = frozenset(
+    ["script", "style", "template", "rt", "rp", "pre", "textarea", "meta"]
+)
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+NON_WHITESPACE = re.compile(r"\S+")
+MARKUP_CHARACTERS = re.compile("[<>&]")
+ESCAPED_CHARACTERS = {"<": "&lt;", ">": "&gt;", "&": "&amp;"}
+
+DEFAULT_BATCH_SIZE = 256
+MIN_PARALLEL_SIZE = 64
+
+
+def clean_html_soup(html):
+    """Clean the HTML content with BeautifulSoup."""
+    soup = BeautifulSoup(html, "html.parser")
+
+    # Remove specific tags but keep their content
+    for tag in soup.find_all(["strong", "em", "div", "p"]):
+        tag.unwrap()
+
+    return str(soup)
+
+
+class UnsupportedMarkup(Exception):
+    """Raised when a fragment has to be cleaned by BeautifulSoup."""
+
+
+def escape(text):
+    """Escape text the way BeautifulSoup's 'minimal' formatter does."""
+    return MARKUP_CHARACTERS.sub(lambda match: ESCAPED_CHARACTERS[match.group()], text)
+
+
+class CleaningSerializer(HTMLParser):
+    """Serialize the cleaned fragment while it is being tokenized."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.output = []
+        self.open_tags = []
+        self.data = []
+        self.already_closed_void_tags = []
+
+    def flush_data(self):
+        """End the current text segment, collapsing it if it is only whitespace."""
+        if not self.data:
+            return
+        text = "".join(self.data)
+        self.data = []
+        if not text.strip(ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+        self.output.append(escape(text))
+
+    @staticmethod
+    def format_start_tag(tag, attrs, void):
+        """Format a start tag with its attributes sorted, as BeautifulSoup does."""
+        attributes = {}
+        multi_valued = MULTI_VALUED_ATTRIBUTES["*"] + MULTI_VALUED_ATTRIBUTES.get(
+            tag, ()
+        )
+        for key, value in attrs:
+            value = "" if value is None else value
+            if key in multi_valued:
+                value = " ".join(NON_WHITESPACE.findall(value))
+            attributes[key] = value
+
+        parts = [tag]
+        for key, value in sorted(attributes.items()):
+            value = escape(value)
+            quote = '"'
+            if '"' in value:
+                if "'" in value:
+                    value = value.replace('"', "&quot;")
+                else:
+                    quote = "'"
+            parts.append(f"{key}={quote}{value}{quote}")
+        return "<" + " ".join(parts) + ("/>" if void else ">")
+
+    def open_tag(self, tag, attrs):
+        """Open a tag, writing it unless it is unwrapped."""
+        if tag in FALLBACK_TAGS:
+            raise UnsupportedMarkup(tag)
+        if tag not in UNWRAPPED_TAGS:
+            self.output.append(self.format_start_tag(tag, attrs, False))
+        self.open_tags.append(tag)
+
+    def close_tag(self, tag):
+        """Close the most recent open tag with this name and the ones opened after it."""
+        if tag not in self.open_tags:
+            return
+        while True:
+            closed = self.open_tags.pop()
+            if closed not in UNWRAPPED_TAGS:
+                self.output.append(f"</{closed}>")
+            if closed == tag:
+                return
+
+    def handle_starttag(self, tag, attrs):
+        self.flush_data()
+        if tag in VOID_TAGS:
+            self.output.append(self.format_start_tag(tag, attrs, True))
+            self.already_closed_void_tags.append(tag)
+        else:
+            self.open_tag(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        self.flush_data()
+        if tag in VOID_TAGS:
+            if tag in self.already_closed_void_tags:
+                raise UnsupportedMarkup(tag)
+            self.output.append(self.format_start_tag(tag, attrs, True))
+        else:
+            self.open_tag(tag, attrs)
+            self.close_tag(tag)
+
+    def handle_endtag(self, tag):
+        # The end tag of an already closed void tag does not even end the text segment
+        if tag in self.already_closed_void_tags:
+            self.already_closed_void_tags.remove(tag)
+            return
+        self.flush_data()
+        self.close_tag(tag)
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_charref(self, name):
+        # Same conversion as BeautifulSoup, including its windows-1252 fallback
+        if name.startswith(("x", "X")):
+            number = int(name.lstrip("xX"), 16)
+        else:
+            number = int(name)
+        data = None
+        if number < 256:
+            try:
+                data = bytearray([number]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(number)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.handle_data(character if character is not None else f"&{name}")
+
+    def handle_comment(self, data):
+        raise UnsupportedMarkup("comment")
+
+    def handle_decl(self, decl):
+        raise UnsupportedMarkup("declaration")
+
+    def unknown_decl(self, data):
+        raise UnsupportedMarkup("declaration")
+
+    def handle_pi(self, data):
+        raise UnsupportedMarkup("processing instruction")
+
+    def serialize(self, html):
+        """Tokenize the fragment and return the cleaned HTML."""
+        self.feed(html)
+        self.close()
+        self.flush_data()
+        while self.open_tags:
+            self.close_tag(self.open_tags[-1])
+        return "".join(self.output)
+
+
+def clean_html(html):
+    """Clean the HTML content, with the same output as `clean_html_soup`."""
+    try:
+        return CleaningSerializer().serialize(html)
+    except (UnsupportedMarkup, AssertionError, ValueError):
+        return clean_html_soup(html)
+
+
+def content_text(html):
+    """Get the text of an HTML fragment, whitespace collapsed, to compare two serializations of it."""
+    return " ".join(unescape(re.sub(r"<[^>]*>", " ", html)).split())
+
+
+def _clean_batch(fragments):
+    """Clean a list of fragments, in a worker process."""
+    return [clean_html(html) for html in fragments]
+
+
+def clean_html_bulk(fragments, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Clean an iterable of HTML fragments, yielding the results in order.
+
+    The fragments are consumed in batches, so memory stays bounded on large
+    inputs. Batches large enough to amortize the inter-process overhead are
+    spread over a pool of processes (`workers`, one per core by default).
+    """
+    fragments = iter(fragments)
+    workers = workers or os.cpu_count() or 1
+    executor = None
+    try:
+        while True:
+            batch = list(islice(fragments, batch_size))
+            if not batch:
+                return
+            if workers <= 1 or len(batch) < MIN_PARALLEL_SIZE:
+                yield from _clean_batch(batch)
+                continue
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=workers)
+            chunk_size = -(-len(batch) // workers)
+            chunks = [
+                batch[start : start + chunk_size]
+                for start in range(0, len(batch), chunk_size)
+            ]
+            for cleaned in executor.map(_clean_batch, chunks):
+                yield from cleaned
+    finally:
+        if executor is not None:
+            executor.shutdown()
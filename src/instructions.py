@@ -89,3 +89,101 @@ Output:
   }}
 ]
 """
+
+PACKED_POLICIES = """
+PACKED POLICIES:
+This time I will provide the position statements of several medical policies at once. Each position statement starts with a line "### POLICY <policy id> ###". Extract the criteria logic schemas of each position statement independently, following the instructions above, and output a single JSON object mapping each policy id to the JSON array of its criteria. Include every policy id, with an empty array if a position statement has no criteria.
+
+For example:
+
+Input:
+### POLICY RAD.00001 ###
+--Example Procedure 1--
+Investigational and Not Medically Necessary:
+The procedure is considered investigational and not medically necessary under the specified conditions.
+
+### POLICY LAB.00002 ###
+--Example Procedure 4--
+Not Medically Necessary:
+The test is considered not medically necessary for all indications.
+"""
+
+PACKED_INSTRUCTIONS = (
+    INSTRUCTIONS
+    + PACKED_POLICIES
+    + """
+Output:
+{{
+  "RAD.00001": [
+    {{
+      "medical_act": "Example Procedure 1",
+      "sub_medical_act": null,
+      "necessity_type": "Investigational and Not Medically Necessary",
+      "description": "The procedure is considered investigational and not medically necessary under the specified conditions.",
+      "conditions": null
+    }}
+  ],
+  "LAB.00002": [
+    {{
+      "medical_act": "Example Procedure 4",
+      "sub_medical_act": null,
+      "necessity_type": "Not Medically Necessary",
+      "description": "The test is considered not medically necessary for all indications.",
+      "conditions": null
+    }}
+  ]
+}}
+"""
+)
+
+COMPACT_INSTRUCTIONS = """
+INSTRUCTIONS:
+You are a medical policy expert. I will provide you with the position statement for a medical policy. Each policy includes one or several medical acts with a degree of necessity such as Medically Necessary, Not Medically Necessary, Investigational and Not Medically Necessary, Cosmetic, etc. The policy also includes compliance criteria that must be met.
+
+Your task is to extract the different criteria logic schemas and output them in a compact JSON format, on a single line, without indentation.
+
+Output a JSON array with an object for each medical act and degree of necessity, with the keys:
+- "a": the medical act. Omit it when it is the same as in the previous object.
+- "s": the sub medical act, such as "Adult" or "Pediatric". Omit it if there is none.
+- "n": the code of the degree of necessity: "MN" for Medically Necessary, "NMN" for Not Medically Necessary, "INMN" for Investigational and Not Medically Necessary, "CNMN" for Cosmetic and Not Medically Necessary, "COS" for Cosmetic, "REC" for Reconstructive. For any other degree of necessity, write its heading in full.
+- "d": the description, the sentence of the position statement stating the necessity.
+- "c": the conditions. For conditions that must all be met, use the "ALL" logic operator. For conditions where any one can be met, use the "ANY" logic operator. Each condition is an object with its text in "d" and its own conditions in "c". Omit "c" if no specific conditions are provided.
+
+Do not copy long texts of the position statement: write a text of more than 10 words that appears word for word in the position statement, ignoring the HTML tags, as a span, the array of its first 4 words and its last 4 words, with more words if they appear elsewhere in the statement, e.g. ["The procedure is considered", "following criteria are met:"]. Write shorter texts, and texts that are not word for word in the position statement, in full.
+
+For example:
+
+Input:
+--Example Procedure 1--
+Investigational and Not Medically Necessary:
+The procedure is considered investigational and not medically necessary under the specified conditions.
+
+Output:
+[{{"a":"Example Procedure 1","n":"INMN","d":["The procedure is considered","under the specified conditions."]}}]
+
+Input:
+--Example Procedure 2--
+Medically Necessary:
+<li>The procedure is considered medically necessary when all of the following criteria are met: <ol> <li>Condition A; and</li> <li>Condition B; and</li> <li>When one of the following is true: <ol start="1" style="list-style-type:lower-alpha"> <li>Condition C; or</li> <li>Condition D.</li> </ol> </li> </ol> </li>
+
+Output:
+[{{"a":"Example Procedure 2","n":"MN","d":["The procedure is considered","following criteria are met:"],"c":{{"ALL":[{{"d":"Condition A"}},{{"d":"Condition B"}},{{"ANY":[{{"d":"Condition C"}},{{"d":"Condition D"}}]}}]}}}}]
+
+Input:
+--Example Procedure 3--
+Medically Necessary:
+<li>The procedure is considered medically necessary when the following criteria are met: <ol> <li>Condition X; and</li> <li>Condition Y.</li> </ol> </li>
+<li>The procedure is considered medically necessary for pediatric patients when the following criteria are met: <ol> <li>Condition P; and</li> <li>Condition Q.</li> </ol> </li>
+
+Output:
+[{{"a":"Example Procedure 3","s":"Adult","n":"MN","d":["The procedure is considered","following criteria are met:"],"c":{{"ALL":[{{"d":"Condition X"}},{{"d":"Condition Y"}}]}}}},{{"s":"Pediatric","n":"MN","d":["The procedure is considered","following criteria are met:"],"c":{{"ALL":[{{"d":"Condition P"}},{{"d":"Condition Q"}}]}}}}]
+"""
+
+PACKED_COMPACT_INSTRUCTIONS = (
+    COMPACT_INSTRUCTIONS
+    + PACKED_POLICIES
+    + """
+Output:
+{{"RAD.00001":[{{"a":"Example Procedure 1","n":"INMN","d":["The procedure is considered","under the specified conditions."]}}],"LAB.00002":[{{"a":"Example Procedure 4","n":"NMN","d":"The test is considered not medically necessary for all indications."}}]}}
+"""
+)
@@ -0,0 +1,188 @@
+"""Local inference backend: a quantized GGUF model run on the CPU by llama.cpp.
+
+`--model local:<path>` starts the llama.cpp server (`llama-server`) on the GGUF
+file at <path>, and the extractor sends its requests to the OpenAI-compatible
+endpoint of the server, through the same prompt, parser, concurrency limit and
+retries as for the OpenAI models. The server decodes with several threads and
+gives each concurrent request a slot of its own, the slots being decoded
+together and refilled as soon as a request is done (continuous batching), so
+the policies of a concurrent run are batched as they come.
+
+`--model local:http://<host>:<port>` uses a llama.cpp server already running
+instead, e.g. one shared by several runs on the same node.
+"""
+
+import atexit
+import os
+import socket
+import subprocess
+import tempfile
+import time
+
+import requests
+
+LOCAL_PREFIX = "local:"
+# The llama.cpp server binary, on the PATH by default
+SERVER_BINARY = os.getenv("LLAMA_SERVER", "llama-server")
+# Context of each slot, in tokens: the instructions, the statement and its criteria
+DEFAULT_CONTEXT_SIZE = 8192
+# Loading a large model from a cold disk can take minutes
+STARTUP_TIMEOUT = 600
+HEALTH_INTERVAL = 0.5
+
+
+def is_local_model(model_name: str):
+    """Check whether a model name selects the local backend."""
+    return model_name.startswith(LOCAL_PREFIX)
+
+
+def is_server_url(location: str):
+    """Check whether the location of a local model is the URL of a running server."""
+    return location.startswith(("http://", "https://"))
+
+
+def local_model_name(model_name: str):
+    """Get the name recorded with the criteria of a local model, e.g. local:qwen2-7b-q4_k_m.
+
+    The name of the GGUF file is kept rather than its path, so the same model
+    is recognized on every node. With a running server, the name is the one of
+    the model it serves.
+    """
+    location = model_name[len(LOCAL_PREFIX) :]
+    if is_server_url(location):
+        response = requests.get(f"{location.rstrip('/')}/v1/models", timeout=30)
+        response.raise_for_status()
+        location = response.json()["data"][0]["id"]
+    name = os.path.basename(location.rstrip("/"))
+    return LOCAL_PREFIX + (name[: -len(".gguf")] if name.endswith(".gguf") else name)
+
+
+def serve_local_model(
+    model_name: str, parallel: int = 1, threads: int = 0, context_size: int = DEFAULT_CONTEXT_SIZE
+):
+    """Get the name, the API base URL and the server of a local model.
+
+    The server is started on the GGUF file, or None when the model is served
+    by a running server.
+    """
+    location = model_name[len(LOCAL_PREFIX) :]
+    if is_server_url(location):
+        return local_model_name(model_name), f"{location.rstrip('/')}/v1", None
+    server = LocalModelServer(location, parallel, threads, context_size).start()
+    return local_model_name(model_name), server.base_url, server
+
+
+def free_port():
+    """Get a free local port for the server."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalModelServer:
+    """Run a llama.cpp server on a GGUF model, stopped at exit."""
+
+    def __init__(
+        self,
+        model_path: str,
+        parallel: int = 1,
+        threads: int = 0,
+        context_size: int = DEFAULT_CONTEXT_SIZE,
+    ):
+        """Serve `parallel` requests at once, decoded with `threads` threads (all the cores if 0).
+
+        Each request has a context of `context_size` tokens.
+        """
+        self.model_path = model_path
+        self.parallel = max(1, parallel)
+        self.threads = threads or os.cpu_count()
+        self.context_size = context_size
+        self.port = None
+        self.process = None
+        self._log = None
+
+    @property
+    def base_url(self):
+        """Get the base URL of the OpenAI-compatible API of the server."""
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def command(self):
+        """Get the command line of the server."""
+        return [
+            SERVER_BINARY,
+            "--model",
+            self.model_path,
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(self.port),
+            "--threads",
+            str(self.threads),
+            "--parallel",
+            str(self.parallel),
+            "--cont-batching",
+            # The context is shared by the slots
+            "--ctx-size",
+            str(self.context_size * self.parallel),
+        ]
+
+    def start(self):
+        """Start the server and wait until its model is loaded."""
+        if not os.path.isfile(self.model_path):
+            raise ValueError(f"Model file not found: {self.model_path}")
+        self.port = free_port()
+        print(
+            f"Starting the llama.cpp server on {self.model_path}, with {self.parallel} "
+            f"slots and {self.threads} threads"
+        )
+        # The server logs every request, to a file read back if it fails to start
+        self._log = tempfile.TemporaryFile()  # pylint: disable=consider-using-with
+        try:
+            self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+                self.command(), stdout=self._log, stderr=subprocess.STDOUT
+            )
+        except FileNotFoundError as exc:
+            raise ValueError(
+                f"The llama.cpp server {SERVER_BINARY} was not found, "
+                "install llama.cpp or set LLAMA_SERVER to its path"
+            ) from exc
+        atexit.register(self.stop)
+        self.wait_until_ready()
+        return self
+
+    def wait_until_ready(self, timeout: float = STARTUP_TIMEOUT):
+        """Wait until the health endpoint of the server is up, it answers 503 while loading."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self._log.seek(0)
+                error = self._log.read().decode(errors="replace")
+                raise RuntimeError(
+                    f"The llama.cpp server exited with code {self.process.returncode}: "
+                    f"{error[-2000:]}"
+                )
+            try:
+                response = requests.get(
+                    f"http://127.0.0.1:{self.port}/health", timeout=HEALTH_INTERVAL
+                )
+                if response.status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(HEALTH_INTERVAL)
+        self.stop()
+        raise RuntimeError(f"The llama.cpp server did not start within {timeout:.0f}s")
+
+    def stop(self):
+        """Stop the server, it is safe to call it several times."""
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+        if self._log is not None:
+            self._log.close()
+            self._log = None
@@ -0,0 +1,275 @@
+"""Metrics of the extractions: latency percentiles, throughput, cost, errors and retries.
+
+The usage of each extraction is recorded by model, category and file, either
+live by the extractor or backfilled from the `usage` blocks stored in the
+policies. The summaries are written as JSON at three levels: per model, per
+model and category, and per model, category and file. The Prometheus text
+exposition format only has the file level, which the queries aggregate.
+"""
+
+import argparse
+import json
+import os
+import statistics
+
+from src.file_extraction import data_files
+
+QUANTILES = [0.5, 0.95, 0.99]
+TOKEN_TYPES = ["prompt_tokens", "completion_tokens", "total_tokens"]
+DEFAULT_METRICS_PATH = "./ddata/.cache/metrics.json"
+
+
+def file_category(file_path: str):
+    """Get the category of a data file, e.g. radiology for radiology_policies.json."""
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return name[: -len("_policies")] if name.endswith("_policies") else name
+
+
+def quantile(values, fraction):
+    """Get a quantile of the values, interpolated between the closest ranks."""
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[round(fraction * 100) - 1]
+
+
+class ExtractionMetrics:
+    """Aggregate the usage of the extractions by model, category and file."""
+
+    def __init__(self):
+        self.records = {}
+
+    def _record(self, model, file_path):
+        """Get the record of a model and a file, created on first use."""
+        key = (model, file_category(file_path), os.path.basename(file_path))
+        if key not in self.records:
+            self.records[key] = {
+                "extractions": 0,
+                "cached": 0,
+                "rule_based": 0,
+                "errors": 0,
+                "retries": 0,
+                "cascaded": 0,
+                "escalated": 0,
+                "saved_cost": 0.0,
+                "latencies": [],
+                # IDs of the packed requests already measured
+                "packed_requests": set(),
+                "total_cost": 0.0,
+                **{token_type: 0 for token_type in TOKEN_TYPES},
+            }
+        return self.records[key]
+
+    def record(self, model, file_path, usage):
+        """Record the usage of an extraction.
+
+        The latencies are the ones of the requests: a packed request is measured
+        once for all its policies, and each section of a statement extracted in
+        sections is measured on its own.
+        """
+        record = self._record(model, file_path)
+        record["extractions"] += 1
+        packed_request = usage.get("packed_request")
+        measured = packed_request in record["packed_requests"]
+        if packed_request is not None:
+            record["packed_requests"].add(packed_request)
+        if not measured:
+            record["retries"] += usage.get("retries", 0)
+        if usage.get("cached"):
+            # Served without a request, its tokens and cost were spent before
+            record["cached"] += 1
+            return
+        if usage.get("rule_based"):
+            # Extracted without a request
+            record["rule_based"] += 1
+            return
+        if usage.get("cascade"):
+            record["cascaded"] += 1
+            record["escalated"] += usage["cascade"]["escalated"]
+            record["saved_cost"] += usage["cascade"]["saved_cost"]
+        for token_type in TOKEN_TYPES:
+            record[token_type] += usage.get(token_type) or 0
+        record["total_cost"] += usage.get("total_cost") or 0.0
+        # The requests of a batch are not timed individually
+        if measured or usage.get("processing_time") is None:
+            return
+        if "section_times" in usage:
+            record["latencies"].extend(usage["section_times"])
+        else:
+            record["latencies"].append(usage["processing_time"])
+
+    def record_error(self, model, file_path, retries=0):
+        """Record an extraction that failed."""
+        record = self._record(model, file_path)
+        record["errors"] += 1
+        record["retries"] += retries
+
+    def backfill(self, data_path):
+        """Record the usage stored in the policies of a file or folder."""
+        for file_path in data_files(data_path):
+            with open(file_path, encoding="utf-8") as file:
+                policies = json.load(file)
+            for policy in policies:
+                for entry in policy.get("criteria", []):
+                    self.record(entry["model"], file_path, entry["usage"])
+
+    @staticmethod
+    def summarize(records):
+        """Summarize a list of records into the metrics of their extractions."""
+        latencies = sorted(
+            latency for record in records for latency in record["latencies"]
+        )
+        summary = {
+            key: sum(record[key] for record in records)
+            for key in [
+                "extractions",
+                "cached",
+                "rule_based",
+                "errors",
+                "retries",
+                "cascaded",
+                "escalated",
+                *TOKEN_TYPES,
+            ]
+        }
+        for key in ["total_cost", "saved_cost"]:
+            summary[key] = round(sum(record[key] for record in records), 6)
+        summary["requests_timed"] = len(latencies)
+        summary["processing_seconds"] = round(sum(latencies), 3)
+        summary["latency_seconds"] = {}
+        summary["tokens_per_second"] = None
+        if latencies:
+            for fraction in QUANTILES:
+                summary["latency_seconds"][f"p{round(fraction * 100)}"] = round(
+                    quantile(latencies, fraction), 3
+                )
+        if summary["processing_seconds"]:
+            # Throughput of a request in flight, to size the concurrency
+            summary["tokens_per_second"] = round(
+                summary["total_tokens"] / summary["processing_seconds"], 1
+            )
+        return summary
+
+    def summary(self):
+        """Summarize the metrics per model, per category and per file."""
+        levels = {"models": 1, "categories": 2, "files": 3}
+        summary = {}
+        for level, size in levels.items():
+            groups = {}
+            for key, record in sorted(self.records.items()):
+                groups.setdefault(key[:size], []).append(record)
+            summary[level] = [
+                {
+                    **dict(zip(["model", "category", "file"], labels)),
+                    **self.summarize(records),
+                }
+                for labels, records in groups.items()
+            ]
+        return summary
+
+    @staticmethod
+    def prometheus_samples(row):
+        """Get the (metric name, extra labels, value) samples of a summary row."""
+        samples = []
+        for fraction in QUANTILES:
+            percentile = f"p{round(fraction * 100)}"
+            if percentile in row["latency_seconds"]:
+                samples.append(
+                    (
+                        "extraction_latency_seconds",
+                        [f'quantile="{fraction}"'],
+                        row["latency_seconds"][percentile],
+                    )
+                )
+        if row["requests_timed"]:
+            samples.append(("extraction_latency_seconds_sum", [], row["processing_seconds"]))
+            samples.append(("extraction_latency_seconds_count", [], row["requests_timed"]))
+        for key in ["extractions", "cached", "rule_based", "errors", "retries", "cascaded", "escalated"]:
+            samples.append((f"extraction_{key}_total", [], row[key]))
+        for token_type in ["prompt", "completion"]:
+            samples.append(
+                ("extraction_tokens_total", [f'type="{token_type}"'], row[f"{token_type}_tokens"])
+            )
+        samples.append(("extraction_cost_dollars_total", [], row["total_cost"]))
+        if row["cascaded"]:
+            samples.append(("extraction_saved_cost_dollars", [], row["saved_cost"]))
+        if row["tokens_per_second"] is not None:
+            samples.append(("extraction_tokens_per_second", [], row["tokens_per_second"]))
+        return samples
+
+    def prometheus(self):
+        """Format the summary per model, category and file in the Prometheus text exposition format.
+
+        The other levels are left out, so that summing a metric over its labels
+        counts each extraction once.
+        """
+        families = {
+            "extraction_latency_seconds": ("summary", "Latency of the extraction requests."),
+            "extraction_extractions_total": ("counter", "Extractions, cached ones included."),
+            "extraction_cached_total": ("counter", "Extractions served from the cache."),
+            "extraction_rule_based_total": ("counter", "Extractions done by rules, without the model."),
+            "extraction_errors_total": ("counter", "Extractions that failed."),
+            "extraction_retries_total": ("counter", "Retried extraction requests."),
+            "extraction_cascaded_total": ("counter", "Extractions sent to a cascade model first."),
+            "extraction_escalated_total": ("counter", "Extractions escalated from the cascade model."),
+            "extraction_tokens_total": ("counter", "Tokens of the extraction requests."),
+            "extraction_cost_dollars_total": ("counter", "Cost of the extraction requests."),
+            "extraction_saved_cost_dollars": ("gauge", "Cost saved by the cascade, net of escalations."),
+            "extraction_tokens_per_second": ("gauge", "Tokens per second of a request in flight."),
+        }
+        lines_by_name = {}
+        for row in self.summary()["files"]:
+            labels = [f'{name}="{row[name]}"' for name in ["model", "category", "file"]]
+            for name, extra_labels, value in self.prometheus_samples(row):
+                label_text = ",".join(labels + extra_labels)
+                lines_by_name.setdefault(name, []).append(f"{name}{{{label_text}}} {value}")
+        lines = []
+        for name, (metric_type, description) in families.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+            lines += lines_by_name.get(name, [])
+            if metric_type == "summary":
+                lines += lines_by_name.get(f"{name}_sum", [])
+                lines += lines_by_name.get(f"{name}_count", [])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str = DEFAULT_METRICS_PATH):
+        """Write the summary as JSON to `path`, and in the Prometheus format next to it (.prom)."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.summary(), file, indent=2)
+        prometheus_path = os.path.splitext(path)[0] + ".prom"
+        with open(prometheus_path, "w", encoding="utf-8") as file:
+            file.write(self.prometheus())
+        print(f"Metrics written to {path} and {prometheus_path}")
+
+
+def main():
+    """Report the metrics of the extractions stored in the data."""
+    parser = argparse.ArgumentParser(description="Report the metrics of the extractions.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser(
+        "report", help="Report the metrics of the usage stored in the policies."
+    )
+    report.add_argument(
+        "--data",
+        type=str,
+        default="./ddata/anthem",
+        help="A JSON file, or a folder containing multiple JSON files.",
+    )
+    report.add_argument(
+        "--output",
+        type=str,
+        default=DEFAULT_METRICS_PATH,
+        help="The JSON file of the report, the Prometheus file is written next to it.",
+    )
+    args = parser.parse_args()
+
+    metrics = ExtractionMetrics()
+    metrics.backfill(args.data)
+    metrics.write(args.output)
+    for row in metrics.summary()["models"]:
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""Request layer of the extractor, sending the position statements to the model.
+
+The requests go through the chains of the model, and of its cascade model if
+any, in turn in the limiter of the run, and the failed ones are retried. The
+instructions are the full or the compact ones, alone or packed, and a compact
+answer is expanded back to the full format.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import time
+
+from langchain_openai import ChatOpenAI
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_community.callbacks import get_openai_callback
+import openai
+
+from src.compact_schema import compact_usage, expand_criteria
+from src.criteria_schema import validate_criteria
+from src.extraction_cache import text_hash
+from src.instructions import (
+    COMPACT_INSTRUCTIONS,
+    INSTRUCTIONS,
+    PACKED_COMPACT_INSTRUCTIONS,
+    PACKED_INSTRUCTIONS,
+)
+from src.local_model import DEFAULT_CONTEXT_SIZE, is_local_model, serve_local_model
+from src.policy_packing import count_tokens, packed_statement, packing_keys, token_cost
+from src.rate_limit import (
+    DEFAULT_MAX_RETRIES,
+    RETRYABLE_ERRORS,
+    CircuitBreaker,
+    RequestLimiter,
+    retry_delay,
+)
+
+# Joins the cascade model and the model in the name of a cascade, e.g. gpt-3.5-turbo+gpt-4o
+CASCADE_SEPARATOR = "+"
+# Validation errors kept in the usage of an escalated extraction
+MAX_CASCADE_ERRORS = 5
+
+PROMPT_MESSAGES = [
+    (
+        "system",
+        "You are a helpful assistant that follows the following instructions {instructions}.",
+    ),
+    ("human", "{position_statement}"),
+]
+PROMPT = ChatPromptTemplate.from_messages(PROMPT_MESSAGES)
+PARSER = JsonOutputParser()
+
+
+def initialize_model(model_name: str, on_response=None, base_url=None):
+    """Function to initialize the model.
+
+    The requests are not retried by the client, and `on_response` is called
+    with every HTTP response, e.g. to follow the rate-limit headers. With
+    `base_url`, the model is served by another OpenAI-compatible API, e.g. a
+    local llama.cpp server.
+    """
+    if model_name in ["gpt-4o", "gpt-4", "gpt-3.5-turbo", "gpt-3.5"] or base_url:
+        # A local server does not check the key
+        openai_api_key = "local" if base_url else os.getenv("OPENAI_API_KEY")
+        http_client = http_async_client = None
+        if on_response is not None:
+
+            async def aon_response(response):
+                on_response(response)
+
+            http_client = openai.DefaultHttpxClient(
+                event_hooks={"response": [on_response]}
+            )
+            http_async_client = openai.DefaultAsyncHttpxClient(
+                event_hooks={"response": [aon_response]}
+            )
+        llm = ChatOpenAI(
+            model=model_name,
+            temperature=0,
+            max_tokens=None,
+            openai_api_key=openai_api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=http_client,
+            http_async_client=http_async_client,
+        )
+    else:
+        raise ValueError(f"Invalid model name: {model_name}")
+    return llm
+
+
+class ModelChains:
+    """Class holding the chains of the model, and of the cascade model if any."""
+
+    def __init__(self, model_name: str, cascade_model: str = None, local_options=(), on_response=None):
+        """Initialize the chains, serving the local models.
+
+        A local model (`local:<path>`) is served with the `local_options`
+        (parallel slots, threads and context size) of `serve_local_model`.
+        `on_response` is called with every HTTP response of the models.
+        """
+        self.local_servers = []
+        self.strong_model, llm = self.initialize_llm(model_name, local_options, on_response)
+        self.model_name = self.strong_model
+        self.chain = PROMPT | llm | PARSER
+        # Streams the text of the answer, with the usage in its last chunk
+        self.stream_chain = PROMPT | llm.bind(stream_options={"include_usage": True})
+        self.cascade_model = self.cascade_chain = None
+        if cascade_model:
+            self.cascade_model, cascade_llm = self.initialize_llm(
+                cascade_model, local_options, on_response
+            )
+            self.cascade_chain = PROMPT | cascade_llm | PARSER
+            self.model_name = f"{self.cascade_model}{CASCADE_SEPARATOR}{self.strong_model}"
+
+    def initialize_llm(self, model_name: str, local_options, on_response):
+        """Function to initialize a model, serving it if it is local, returning its name and the model."""
+        base_url = None
+        if is_local_model(model_name):
+            model_name, base_url, server = serve_local_model(model_name, *local_options)
+            if server is not None:
+                self.local_servers.append(server)
+        return model_name, initialize_model(model_name, on_response, base_url)
+
+
+class PromptFormat:
+    """Class building the inputs of the chains, in the full or the compact format."""
+
+    def __init__(self, compact: bool = False):
+        self.compact = compact
+        self.instructions = COMPACT_INSTRUCTIONS if compact else INSTRUCTIONS
+        self.packed_instructions = PACKED_COMPACT_INSTRUCTIONS if compact else PACKED_INSTRUCTIONS
+        self.prompt_hash = text_hash(json.dumps([self.instructions, PROMPT_MESSAGES]))
+        self.packed_prompt_hash = text_hash(
+            json.dumps([self.packed_instructions, PROMPT_MESSAGES])
+        )
+
+    def chain_input(self, position_statement):
+        """Function to build the input of the chain for a position statement."""
+        return {
+            "instructions": self.instructions,
+            "position_statement": position_statement,
+        }
+
+    def packed_chain_input(self, policies):
+        """Function to build the keys and the input of the chain for a group of policies."""
+        keys = packing_keys(policies)
+        return keys, {
+            "instructions": self.packed_instructions,
+            "position_statement": packed_statement(keys, policies),
+        }
+
+
+class ModelRequests:
+    """Class sending the requests of the extractor to the model, retrying the failed ones."""
+
+    def __init__(
+        self,
+        model_name: str,
+        cascade_model: str = None,
+        compact: bool = False,
+        tokens_per_minute: int = 0,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        parallel: int = 1,
+        threads: int = 0,
+        context_size: int = DEFAULT_CONTEXT_SIZE,
+    ):
+        """Initialize the requests of the model, and of the `cascade_model` if any.
+
+        The runs send at most `tokens_per_minute` tokens per minute (no limit
+        if 0). A failed request is retried up to `max_retries` times.
+
+        A local model (`local:<path>`) is served with `parallel` slots of
+        `context_size` tokens, decoded with `threads` threads (all the cores if
+        0).
+
+        With `compact`, the model answers in the compact format of
+        `src.compact_schema`, expanded back to the full format.
+        """
+        self.tokens_per_minute = tokens_per_minute
+        self.limiter = RequestLimiter(0, tokens_per_minute)
+        # Event loop running the requests of the synchronous calls
+        self.loop = None
+        self.max_retries = max_retries
+        self.circuit_breaker = CircuitBreaker()
+        self.format = PromptFormat(compact)
+        self.chains = ModelChains(
+            model_name,
+            cascade_model,
+            (parallel, threads, context_size),
+            lambda response: self.limiter.observe(response.headers),
+        )
+
+    def estimate_tokens(self, chain_input):
+        """Function to estimate the prompt tokens of a chain input, before sending it."""
+        return count_tokens(
+            chain_input["instructions"] + chain_input["position_statement"],
+            self.chains.model_name,
+        )
+
+    def run_limiter(self, concurrency: int):
+        """Function to start the limiter of a concurrent run, shared by all its requests."""
+        self.limiter = RequestLimiter(concurrency, self.tokens_per_minute)
+        return self.limiter
+
+    def request_failed(self, exc, attempt: int, limiter):
+        """Function to get the delay before retrying a failed request, raising it if it is the last try.
+
+        The raised error carries the number of retries in its `retries` attribute.
+        """
+        if attempt >= self.max_retries:
+            if not isinstance(exc, openai.RateLimitError):
+                self.circuit_breaker.record_failure()
+            exc.retries = attempt
+            raise exc
+        delay = retry_delay(attempt, exc)
+        if isinstance(exc, openai.RateLimitError):
+            limiter.throttled(delay)
+        else:
+            self.circuit_breaker.record_failure()
+        print(f"Retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries}) after: {exc}")
+        return delay
+
+    def run(self, coroutine):
+        """Function to run a coroutine to completion from synchronous code.
+
+        Every synchronous call runs on the same event loop, the one the
+        asynchronous HTTP client of the model is bound to.
+        """
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(coroutine)
+
+    async def ainvoke_chain(self, chain_input, limiter, chain=None):
+        """Function to invoke the chain, by default the one of the model, in turn in the limiter, retrying the failed requests.
+
+        Returns the result, the usage callback, the start time of the request
+        and the number of retries.
+        """
+        chain = chain or self.chains.chain
+        estimated_tokens = self.estimate_tokens(chain_input)
+        for attempt in itertools.count():
+            self.circuit_breaker.check()
+            try:
+                async with limiter.request(estimated_tokens):
+                    start_time = time.time()
+                    # The callback is bound to the current task, so concurrent
+                    # extractions each count their own tokens
+                    with get_openai_callback() as cb:
+                        result = await chain.ainvoke(chain_input)
+            except RETRYABLE_ERRORS as exc:
+                await asyncio.sleep(self.request_failed(exc, attempt, limiter))
+                continue
+            limiter.adjust(cb.total_tokens - estimated_tokens)
+            limiter.succeeded()
+            self.circuit_breaker.record_success()
+            return result, cb, start_time, attempt
+
+    def build_response(self, criteria, cb, start_time, retries=0, position_statement=None):
+        """Function to gather the criteria and the usage of an extraction.
+
+        In the compact format, the criteria answered for `position_statement`
+        are expanded to the full format, with the completion tokens saved.
+        """
+        usage = {
+            "total_tokens": cb.total_tokens,
+            "prompt_tokens": cb.prompt_tokens,
+            "completion_tokens": cb.completion_tokens,
+            "total_cost": cb.total_cost,
+        }
+        end_time = time.time()
+        processing_time = end_time - start_time
+        usage["processing_time"] = processing_time
+        usage["retries"] = retries
+        if self.format.compact and position_statement is not None:
+            criteria, unresolved = expand_criteria(criteria, position_statement)
+            compact_usage(usage, criteria, self.chains.strong_model, unresolved)
+
+        response = {
+            "criteria": criteria,
+            "usage": usage,
+        }
+        return response
+
+    def packed_response(self, position_statement, criteria, usage):
+        """Function to build the response of a policy of a packed extraction, from its share of the usage.
+
+        The response is None if its compact criteria cannot be expanded, or if
+        they fail the validation of a cascade.
+        """
+        if self.format.compact:
+            try:
+                criteria, unresolved = expand_criteria(criteria, position_statement)
+            except ValueError as exc:
+                print(f"Value error: {exc}")
+                return None
+            compact_usage(usage, criteria, self.chains.strong_model, unresolved)
+        response = {"criteria": criteria, "usage": usage}
+        if self.chains.cascade_chain is None:
+            return response
+        if validate_criteria(criteria, position_statement):
+            return None
+        return self.cascaded(response)
+
+    def cascaded(self, response):
+        """Function to record in its usage that the response of the cascade model is kept, with the cost saved."""
+        usage = response["usage"]
+        saved_cost = (
+            token_cost(self.chains.strong_model, usage["prompt_tokens"], usage["completion_tokens"])
+            - usage["total_cost"]
+        )
+        usage["cascade"] = {
+            "model": self.chains.cascade_model,
+            "escalated": False,
+            "saved_cost": saved_cost,
+        }
+        return response
+
+    def escalated(self, response, cascade_response, errors):
+        """Function to record in its usage that a position statement was escalated, adding the usage of the cascade model."""
+        print(f"Escalated to {self.chains.strong_model}: {errors[0]}")
+        usage = response["usage"]
+        wasted_cost = 0.0
+        if cascade_response is not None:
+            for key in [
+                "total_tokens",
+                "prompt_tokens",
+                "completion_tokens",
+                "total_cost",
+                "processing_time",
+                "retries",
+            ]:
+                usage[key] += cascade_response["usage"][key]
+            wasted_cost = cascade_response["usage"]["total_cost"]
+        usage["cascade"] = {
+            "model": self.chains.cascade_model,
+            "escalated": True,
+            "errors": errors[:MAX_CASCADE_ERRORS],
+            "saved_cost": -wasted_cost,
+        }
+        return response
+
+    async def arequest_policy(self, position_statement, limiter):
+        """Function to request the criteria of a position statement, from the cascade model first if any.
+
+        The answer of the cascade model is kept if its criteria are valid,
+        the position statement is escalated to the model otherwise.
+        """
+        chain_input = self.format.chain_input(position_statement)
+        if self.chains.cascade_chain is None:
+            return self.build_response(
+                *await self.ainvoke_chain(chain_input, limiter), position_statement
+            )
+        cascade_response = None
+        try:
+            cascade_response = self.build_response(
+                *await self.ainvoke_chain(chain_input, limiter, self.chains.cascade_chain),
+                position_statement,
+            )
+            errors = validate_criteria(cascade_response["criteria"], position_statement)
+        except ValueError as exc:
+            errors = [f"invalid answer: {exc}"]
+        if not errors:
+            return self.cascaded(cascade_response)
+        response = self.build_response(
+            *await self.ainvoke_chain(chain_input, limiter), position_statement
+        )
+        return self.escalated(response, cascade_response, errors)
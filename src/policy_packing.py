@@ -0,0 +1,151 @@
+"""Packing of several short position statements into a single extraction request.
+
+The instructions make most of the prompt of a short statement, so statements
+are grouped, in file order, up to a budget of statement tokens per request.
+Each statement of a group is introduced by a header with its key, usually the
+document number of the policy, and the model answers with a JSON object of the
+criteria of every key. The usage
+of the request is then split between the policies of the group.
+"""
+
+import json
+import uuid
+from functools import lru_cache
+
+import tiktoken
+from langchain_community.callbacks.openai_info import (
+    MODEL_COST_PER_1K_TOKENS,
+    get_openai_token_cost_for_model,
+    standardize_model_name,
+)
+
+# Characters per token of the estimate used when no tokenizer is available
+CHARACTERS_PER_TOKEN = 4
+FALLBACK_ENCODING = "cl100k_base"
+POLICY_HEADER = "### POLICY {key} ###"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str):
+    """Get the tokenizer of a model, or None if it cannot be loaded."""
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        pass
+    except Exception as exc:
+        print(f"Could not load the tokenizer of {model_name}, estimating tokens: {exc}")
+        return None
+    try:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as exc:
+        print(f"Could not load the {FALLBACK_ENCODING} tokenizer, estimating tokens: {exc}")
+        return None
+
+
+def count_tokens(text: str, model_name: str):
+    """Count the tokens of a text for a model, estimating them without a tokenizer."""
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return max(1, len(text) // CHARACTERS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def token_cost(model_name: str, prompt_tokens: int, completion_tokens: int):
+    """Get the cost of tokens at the prices of a model, 0 if they are unknown (e.g. local models)."""
+    model_name = standardize_model_name(model_name)
+    if model_name not in MODEL_COST_PER_1K_TOKENS:
+        return 0.0
+    return get_openai_token_cost_for_model(
+        model_name, prompt_tokens
+    ) + get_openai_token_cost_for_model(model_name, completion_tokens, is_completion=True)
+
+
+def pack_policies(policies, budget: int, model_name: str):
+    """Group the policies, in order, so each group has at most `budget` statement tokens.
+
+    Returns lists of indices into `policies`. A statement above the budget is
+    alone in its group.
+    """
+    groups = []
+    group, group_tokens = [], 0
+    for index, policy in enumerate(policies):
+        tokens = count_tokens(policy["content"], model_name)
+        if group and group_tokens + tokens > budget:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(index)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def packing_keys(policies):
+    """Get a unique key for each policy of a group, its document number when possible."""
+    keys = []
+    for index, policy in enumerate(policies):
+        key = policy.get("document_number") or f"POLICY-{index + 1}"
+        if key in keys:
+            key = f"{key}-{index + 1}"
+        keys.append(key)
+    return keys
+
+
+def packed_statement(keys, policies):
+    """Join the position statements of a group, each introduced by the header of its key."""
+    return "\n\n".join(
+        f"{POLICY_HEADER.format(key=key)}\n{policy['content']}"
+        for key, policy in zip(keys, policies)
+    )
+
+
+def split_shares(total, weights):
+    """Split a total proportionally to the weights, the parts summing to the total."""
+    weight_sum = sum(weights)
+    if not weight_sum:
+        weights, weight_sum = [1] * len(weights), len(weights)
+    if isinstance(total, int):
+        parts = [total * weight // weight_sum for weight in weights]
+        parts[-1] += total - sum(parts)
+        return parts
+    return [total * weight / weight_sum for weight in weights]
+
+
+def split_usage(usage, statements, criteria, model_name):
+    """Split the usage of a packed request between its policies.
+
+    The prompt tokens are split in proportion to the statement tokens, the
+    completion tokens to the size of the criteria of each policy, and the cost
+    to the resulting total tokens. The policies share the ID of the request,
+    so that its latency and retries are measured once.
+    """
+    prompt_tokens = split_shares(
+        usage["prompt_tokens"],
+        [count_tokens(statement, model_name) for statement in statements],
+    )
+    completion_tokens = split_shares(
+        usage["completion_tokens"],
+        [len(json.dumps(policy_criteria)) for policy_criteria in criteria],
+    )
+    total_tokens = [
+        prompt + completion
+        for prompt, completion in zip(prompt_tokens, completion_tokens)
+    ]
+    total_costs = split_shares(usage["total_cost"], total_tokens)
+    packed_request = uuid.uuid4().hex
+    return [
+        {
+            "total_tokens": total,
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_cost": cost,
+            # Every policy of the group waited for the whole request
+            "processing_time": usage["processing_time"],
+            "retries": usage.get("retries", 0),
+            "packed_policies": len(statements),
+            "packed_request": packed_request,
+        }
+        for total, prompt, completion, cost in zip(
+            total_tokens, prompt_tokens, completion_tokens, total_costs
+        )
+    ]
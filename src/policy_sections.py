@@ -0,0 +1,96 @@
+"""Splitting of long position statements into sections, extracted separately.
+
+A long position statement is cut at its necessity-type headings ("Medically
+Necessary:", "Investigational and Not Medically Necessary:", ...), each section
+keeping its heading. The sections are extracted concurrently and their criteria
+arrays are merged in the order of the sections, so the merged criteria do not
+depend on which extraction finishes first.
+"""
+
+import re
+
+# Necessity-type heading, on a line of its own, leniently on the whitespace
+NECESSITY_HEADING = re.compile(
+    r"^[ \t\xa0]*[A-Za-z ]*(?:Necessary|Reconstructive|Cosmetic)[ \t\xa0]*:[ \t\xa0]*$",
+    re.MULTILINE,
+)
+# Longest line above a heading taken for the title of its medical act
+TITLE_LENGTH = 100
+
+
+def section_starts(position_statement: str):
+    """Get the start of each section of a position statement, after the first one.
+
+    A section starts at a necessity heading, or at the titles of the medical
+    act just above it (short lines that do not end a sentence or a list).
+    """
+    starts = []
+    for match in NECESSITY_HEADING.finditer(position_statement):
+        start = match.start()
+        while start > 0:
+            line_start = position_statement.rfind("\n", 0, start - 1) + 1
+            line = position_statement[line_start:start].strip(" \t\n\xa0")
+            if not line or len(line) > TITLE_LENGTH or line[-1] in ".;:>":
+                break
+            start = line_start
+        if start > 0:
+            starts.append(start)
+    return starts
+
+
+def split_sections(position_statement: str, threshold: int):
+    """Cut a position statement longer than `threshold` characters at its necessity headings.
+
+    Consecutive sections are kept together as long as they fit in the
+    threshold, and the text before the first heading stays with the first
+    section. A statement shorter than the threshold, or with a single heading,
+    is a single section.
+    """
+    if len(position_statement) <= threshold:
+        return [position_statement]
+    starts = section_starts(position_statement)
+    cuts = [0]
+    for index, start in enumerate(starts):
+        following = starts[index + 1] if index + 1 < len(starts) else len(position_statement)
+        if following - cuts[-1] > threshold:
+            cuts.append(start)
+    ends = cuts[1:] + [len(position_statement)]
+    sections = [
+        position_statement[start:end].strip("\n") for start, end in zip(cuts, ends)
+    ]
+    return [section for section in sections if section.strip()]
+
+
+def merge_criteria(criteria):
+    """Merge the criteria arrays of the sections, in the order of the sections."""
+    merged = []
+    for section_criteria in criteria:
+        if isinstance(section_criteria, dict):
+            section_criteria = [section_criteria]
+        merged.extend(section_criteria or [])
+    return merged
+
+
+def merge_usage(usages, processing_time):
+    """Sum the usage of the sections of a position statement.
+
+    The time of each requested section is kept apart, to measure the latency
+    of the requests. When only some sections are cached, the tokens and cost
+    are the ones of the requested sections, the cached ones having been spent
+    before.
+    """
+    requested = [section_usage for section_usage in usages if not section_usage.get("cached")]
+    usage = {
+        key: sum(section_usage[key] for section_usage in requested or usages)
+        for key in ["total_tokens", "prompt_tokens", "completion_tokens", "total_cost"]
+    }
+    # The sections are extracted concurrently, the time is the one of the whole
+    usage["processing_time"] = processing_time
+    usage["section_times"] = [section_usage["processing_time"] for section_usage in requested]
+    usage["retries"] = sum(section_usage.get("retries", 0) for section_usage in requested)
+    usage["sections"] = len(usages)
+    if not requested:
+        usage["cached"] = True
+    elif len(requested) < len(usages):
+        usage["cached_sections"] = len(usages) - len(requested)
+    return usage
@@ -0,0 +1,315 @@
+"""Rate limiting, retries and circuit breaking of the extraction requests.
+
+A single limiter is shared by every request of a run, whatever the file,
+policy, section or packed group it belongs to. A request waits for a free slot
+and for enough tokens in a bucket refilled at the tokens-per-minute rate. The
+bucket is debited with an estimate of the request first, then corrected with
+the tokens it actually used.
+
+The limiter also adapts to the limits reported by the API: it pauses every
+request until the reset of an exhausted `x-ratelimit-remaining-*` budget, and
+halves the requests in flight on a rate-limit error, growing them back one by
+one as requests succeed. Failed requests are retried with an exponential
+backoff and jitter, or after the delay the API asks for, and a circuit breaker
+stops sending requests for a while after consecutive failures. The errors
+failing an extraction are reported in one place, `reported_errors`.
+"""
+
+import asyncio
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import openai
+
+# Errors worth retrying: rate limits, server errors, timeouts and connection errors
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+DEFAULT_MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+BREAKER_THRESHOLD = 10
+BREAKER_COOLDOWN = 30.0
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+@contextmanager
+def reported_errors():
+    """Print the error failing an extraction in a `with` block, instead of raising it.
+
+    The block gets a dict where the retries of the failed request are set.
+    """
+    failure = {"retries": 0}
+    try:
+        yield failure
+    except CircuitOpenError as exc:
+        print(f"Circuit open: {exc}")
+    except openai.AuthenticationError as exc:
+        print(f"OpenAI authentication error: {exc}")
+    except openai.APIError as exc:
+        print(f"OpenAI API error: {exc}")
+        failure["retries"] = getattr(exc, "retries", 0)
+    except ValueError as exc:
+        print(f"Value error: {exc}")
+
+
+def parse_duration(text):
+    """Parse a duration of the rate-limit headers, e.g. "20ms", "1s" or "6m0s", in seconds."""
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(text)
+    if not parts:
+        return None
+    return sum(float(value) * DURATION_UNITS[unit] for value, unit in parts)
+
+
+def retry_after(headers):
+    """Get the delay, in seconds, a response asks to wait before retrying, or None."""
+    if headers is None:
+        return None
+    if headers.get("retry-after-ms") is not None:
+        delay = parse_duration(headers["retry-after-ms"])
+        return delay / 1000 if delay is not None else None
+    return parse_duration(headers.get("retry-after"))
+
+
+def retry_delay(attempt: int, exc=None, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Get the delay before retrying a failed request.
+
+    The delay asked by the API (retry-after headers, then the reset of the
+    exhausted rate limit) is honored, otherwise the delay is drawn between 0
+    and an exponential backoff (full jitter).
+    """
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    delay = retry_after(headers)
+    if delay is None and isinstance(exc, openai.RateLimitError) and headers is not None:
+        resets = [
+            parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            for kind in ["requests", "tokens"]
+        ]
+        resets = [reset for reset in resets if reset is not None]
+        delay = max(resets) if resets else None
+    if delay is not None:
+        # A little jitter, so the throttled requests do not all come back at once
+        return min(cap, delay) + random.uniform(0, base / 4)
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class CircuitBreaker:
+    """Stop sending requests for a cooldown after consecutive failures.
+
+    Rate-limit errors are throttled by the limiter instead, and do not count.
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        """Open the circuit after `threshold` consecutive failures (never if 0)."""
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Raise CircuitOpenError while the circuit is open.
+
+        Once the cooldown is over, requests are let through again, and a new
+        failure reopens the circuit right away.
+        """
+        if time.monotonic() < self._open_until:
+            raise CircuitOpenError(
+                f"requests paused for {self._open_until - time.monotonic():.0f}s "
+                f"after {self.threshold} consecutive failures"
+            )
+
+    def record_success(self):
+        """Close the circuit after a successful request."""
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self):
+        """Count a failed request, opening the circuit above the threshold."""
+        with self._lock:
+            self.failures += 1
+            if self.threshold and self.failures >= self.threshold:
+                if time.monotonic() >= self._open_until:
+                    self.opened += 1
+                self._open_until = time.monotonic() + self.cooldown
+
+
+class TokenBucket:
+    """Hold the tokens of the requests, refilled at the tokens-per-minute rate."""
+
+    def __init__(self, tokens_per_minute: int = 0):
+        """Create a full bucket, 0 disabling the limit."""
+        self.tokens_per_minute = tokens_per_minute
+        self._available = float(tokens_per_minute)
+        self._updated = time.monotonic()
+
+    def refill(self):
+        """Refill the token bucket for the time elapsed since the last refill."""
+        now = time.monotonic()
+        self._available = min(
+            self.tokens_per_minute,
+            self._available + (now - self._updated) * self.tokens_per_minute / 60,
+        )
+        self._updated = now
+
+    async def take(self, tokens: int):
+        """Wait until the bucket has the tokens of a request, and take them, returning the time waited."""
+        if not self.tokens_per_minute:
+            return 0.0
+        # A request larger than the bucket waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        self.refill()
+        while self._available < tokens:
+            delay = (tokens - self._available) * 60 / self.tokens_per_minute
+            waited += delay
+            await asyncio.sleep(delay)
+            self.refill()
+        self._available -= tokens
+        return waited
+
+    def adjust(self, tokens: int):
+        """Correct the bucket with the difference between the used and estimated tokens."""
+        if self.tokens_per_minute:
+            self.refill()
+            self._available -= tokens
+
+
+class InFlightLimit:
+    """Limit the requests in flight at once, halved on rate-limit errors and grown back one by one."""
+
+    def __init__(self, max_in_flight: int = 0):
+        """Create the limit, 0 disabling it."""
+        self.max_in_flight = max_in_flight
+        # Requests allowed in flight, lowered on rate-limit errors
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._successes = 0
+        self._condition = None
+        self._loop = None
+
+    def condition(self):
+        """Get the condition notified when a slot is freed, for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def throttled(self, halve: bool = True):
+        """Start counting the successes again after a rate-limit error, halving the limit if asked."""
+        self._successes = 0
+        if self.max_in_flight and halve:
+            self.limit = max(1, self.limit // 2)
+
+    def succeeded(self):
+        """Grow the requests in flight by one after as many successes as the current limit."""
+        if not self.max_in_flight or self.limit >= self.max_in_flight:
+            return
+        self._successes += 1
+        if self._successes >= self.limit:
+            self._successes = 0
+            self.limit += 1
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a slot for the duration of a request."""
+        condition = self.condition()
+        async with condition:
+            await condition.wait_for(
+                lambda: not self.max_in_flight or self.in_flight < self.limit
+            )
+            self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            async with condition:
+                self.in_flight -= 1
+                condition.notify_all()
+
+
+class RequestLimiter:
+    """Limit the requests in flight at once and the tokens they use per minute."""
+
+    def __init__(self, max_in_flight: int = 0, tokens_per_minute: int = 0):
+        """Create the limiter, 0 disabling a limit."""
+        self.slots = InFlightLimit(max_in_flight)
+        self.bucket = TokenBucket(tokens_per_minute)
+        self.waited = 0.0
+        self.throttles = 0
+        self._paused_until = 0.0
+
+    @property
+    def max_in_flight(self):
+        """Most requests in flight at once, 0 if unlimited."""
+        return self.slots.max_in_flight
+
+    @property
+    def peak_in_flight(self):
+        """Most requests that were in flight at once."""
+        return self.slots.peak_in_flight
+
+    def adjust(self, tokens: int):
+        """Correct the bucket with the difference between the used and estimated tokens."""
+        self.bucket.adjust(tokens)
+
+    def pause(self, seconds: float):
+        """Hold back every new request for some time."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def wait_for_pause(self):
+        """Wait until the pause asked by the API is over."""
+        while time.monotonic() < self._paused_until:
+            delay = self._paused_until - time.monotonic()
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+    def observe(self, headers):
+        """Adapt to the rate-limit headers of a response, pausing until an exhausted budget resets."""
+        for kind in ["requests", "tokens"]:
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining is not None and reset and int(remaining) <= 0:
+                self.pause(reset)
+
+    def throttled(self, delay: float = 0.0):
+        """Halve the requests in flight after a rate-limit error, and pause for its delay.
+
+        The errors of the requests sent before the pause count as one.
+        """
+        self.throttles += 1
+        self.slots.throttled(halve=time.monotonic() >= self._paused_until)
+        if delay:
+            self.pause(delay)
+
+    def succeeded(self):
+        """Grow the requests in flight by one after as many successes as the current limit."""
+        self.slots.succeeded()
+
+    @asynccontextmanager
+    async def request(self, estimated_tokens: int):
+        """Hold a slot and the estimated tokens for the duration of a request."""
+        await self.wait_for_pause()
+        async with self.slots.slot():
+            self.waited += await self.bucket.take(estimated_tokens)
+            yield
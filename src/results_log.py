@@ -0,0 +1,68 @@
+"""Append-only log of the extractions of a file, to resume an interrupted run.
+
+Each criteria entry is appended to the log as soon as it is extracted, and the
+log is removed once the file itself is written. A run interrupted before that
+replays the log into the policies, so the extractions already paid for are not
+requested again.
+"""
+
+import json
+import os
+
+from src.extraction_cache import text_hash
+
+
+class ResultsLog:
+    """Log the criteria entries of a model for the policies of a file."""
+
+    def __init__(self, file_path: str, model_name: str):
+        folder, name = os.path.split(file_path)
+        self.path = os.path.join(folder or ".", ".cache", f"{name}.{model_name}.log.jsonl")
+        self._file = None
+
+    def replay(self, policies):
+        """Yield the logged (policy, criteria entry) pairs of the policies.
+
+        An entry is only replayed on the policy with the same URL and position
+        statement, and a last line cut by a crash is ignored.
+        """
+        if not os.path.isfile(self.path):
+            return
+        policies_by_key = {
+            (policy["url"], text_hash(policy["content"])): policy for policy in policies
+        }
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                policy = policies_by_key.get((record["url"], record["content_hash"]))
+                if policy is not None:
+                    yield policy, record["entry"]
+
+    def append(self, policy, criteria_entry):
+        """Append the criteria entry of a policy to the log, flushed to the disk."""
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        record = {
+            "url": policy["url"],
+            "content_hash": text_hash(policy["content"]),
+            "entry": criteria_entry,
+        }
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Close the log."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """Close and delete the log, once its entries are saved in the file."""
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,77 @@
+"""Rule-based extraction of the simple position statements, without the model.
+
+Many position statements are only necessity headings followed by sentences
+such as "Topographic genotyping is considered investigational and not
+medically necessary for all indications.", each mapping to one criteria object
+without conditions. They are extracted by rules, in the schema of the
+instructions, at no cost. A statement with anything else (a list, a note, a
+title, a condition, or a medically necessary act, which is necessary under
+conditions) is left to the model.
+"""
+
+import html
+import re
+
+from src.policy_sections import NECESSITY_HEADING
+
+# "<medical act> is considered <necessity> ..."
+CONSIDERED_SENTENCE = re.compile(r"^(?P<act>.+?)\s+(?:is|are)\s+considered\s+(?P<rest>.+)$")
+# Words introducing conditions the model would extract
+CONDITION_WORDS = re.compile(r"\b(?:when|if|unless|following|criteria|except)\b", re.IGNORECASE)
+# Necessity types that are not subject to conditions
+UNCONDITIONAL_NECESSITY = re.compile(r"\bnot\b|\bcosmetic\b", re.IGNORECASE)
+# Qualifiers ending the name of the medical act in its sentence
+ACT_QUALIFIER = re.compile(
+    r",?\s+(?:including\b|in any capacity\b|as a guide\b)|,\s*\(for example|,\s*$"
+)
+
+
+def medical_act(subject: str):
+    """Get the name of the medical act from the subject of its sentence."""
+    act = re.sub(r"^The\s+", "", subject)
+    qualifier = ACT_QUALIFIER.search(act)
+    if qualifier:
+        act = act[: qualifier.start()]
+    return act[:1].upper() + act[1:]
+
+
+def unconditional_sentence(text: str, necessity_type: str):
+    """Match a sentence considering a medical act with the necessity of its heading, without conditions."""
+    sentence = CONSIDERED_SENTENCE.match(text)
+    if sentence is None or "<" in text or text.endswith(":") or CONDITION_WORDS.search(text):
+        return None
+    if necessity_type.lower() not in sentence["rest"].lower():
+        return None
+    return sentence
+
+
+def extract_rules(position_statement: str):
+    """Extract the criteria of a simple position statement, or None if it needs the model.
+
+    Every line must be a necessity heading, or a sentence considering a medical
+    act with the necessity of its heading, without conditions.
+    """
+    necessity_type = None
+    criteria = []
+    for line in position_statement.split("\n"):
+        text = line.strip(" \t\xa0")
+        if not text:
+            continue
+        if NECESSITY_HEADING.match(line):
+            necessity_type = text.rstrip(" :\t\xa0")
+            if not UNCONDITIONAL_NECESSITY.search(necessity_type):
+                return None
+            continue
+        sentence = necessity_type and unconditional_sentence(text, necessity_type)
+        if not sentence:
+            return None
+        criteria.append(
+            {
+                "medical_act": medical_act(html.unescape(sentence["act"])),
+                "sub_medical_act": None,
+                "necessity_type": necessity_type,
+                "description": html.unescape(text),
+                "conditions": None,
+            }
+        )
+    return criteria or None
@@ -0,0 +1,209 @@
+"""Output of a scrape: the category JSON file and the checkpointed log of its records.
+
+The records are appended to a JSONL log as each page is visited, with a
+checkpoint of the current results page, so that an interrupted scrape resumes
+where it stopped. Once the listing is done, the records are cleaned and
+written to the category JSON file, and the log and the checkpoint removed.
+`ScrapeOutput` gathers the files of a category: its JSON file and the records
+of the previous run, the checkpointed log and the document archive.
+"""
+
+import json
+import os
+from itertools import islice
+
+from src import html_cleaning
+from src.html_archive import HtmlArchive
+
+
+def write_json_array(path, records):
+    """Write records as an indented JSON array, one at a time, replacing the file atomically."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write("[")
+        separator = "\n"
+        for record in records:
+            file.write(separator)
+            file.write(
+                "\n".join(
+                    "  " + line for line in json.dumps(record, indent=2).split("\n")
+                )
+            )
+            separator = ",\n"
+        file.write("\n]" if separator == ",\n" else "]")
+    os.replace(tmp_path, path)
+
+
+class ScrapeCheckpoint:
+    """Append-only JSONL log of the scraped records and resume point of a scrape."""
+
+    def __init__(self, records_path, checkpoint_path):
+        self.records_path = records_path
+        self.checkpoint_path = checkpoint_path
+        self.completed = set()
+        self._file = None
+
+    def load(self):
+        """Load the resume point and the URLs already saved, if a previous run stopped.
+
+        A run stopped before its first checkpoint resumes from the first results
+        page, with the records of its log.
+        """
+        state = None
+        if os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as file:
+                state = json.load(file)
+
+        # Collect the saved URLs, dropping a record truncated by a crash
+        valid_size = 0
+        if os.path.isfile(self.records_path):
+            with open(self.records_path, "rb") as file:
+                for line in file:
+                    try:
+                        self.completed.add(json.loads(line)["url"])
+                    except ValueError:
+                        break
+                    valid_size += len(line)
+            os.truncate(self.records_path, valid_size)
+        if state is None and self.completed:
+            state = {"page": 0, "num_results": None}
+        return state
+
+    def save(self, page: int, num_results: int):
+        """Save the results page to resume from, replacing the checkpoint atomically."""
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"page": page, "num_results": num_results}, file)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def append(self, policy):
+        """Append a scraped record to the log."""
+        self._file.write(json.dumps(policy) + "\n")
+        self._file.flush()
+        self.completed.add(policy["url"])
+
+    def records(self):
+        """Iterate over the records in the log."""
+        with open(self.records_path, encoding="utf-8") as file:
+            for line in file:
+                yield json.loads(line)
+
+    def clear(self):
+        """Remove the log and the checkpoint."""
+        for path in (self.records_path, self.checkpoint_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        self.completed = set()
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.records_path), exist_ok=True)
+        self._file = open(self.records_path, "a", encoding="utf-8")
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+        self._file = None
+
+
+class ScrapeOutput:
+    """The files of a scraped category, under an output folder."""
+
+    def __init__(self, output_dir: str, category: str, resume: bool = True, archive: bool = True):
+        self.category = category
+        self.output_path = os.path.join(output_dir, f"{category}_policies.json")
+        self.cache_dir = os.path.join(output_dir, ".cache")
+        self.existing_policies = {}
+        self.resume = resume
+        self.checkpoint = ScrapeCheckpoint(
+            os.path.join(self.cache_dir, f"{category}_policies.jsonl"),
+            os.path.join(self.cache_dir, f"{category}_checkpoint.json"),
+        )
+        self.archive = (
+            HtmlArchive(os.path.join(self.cache_dir, "archive")) if archive else None
+        )
+
+    def cache_path(self, name: str):
+        """Get the path of a cache file of the category."""
+        return os.path.join(self.cache_dir, f"{self.category}_{name}")
+
+    def load_previous_run(self):
+        """Load the policies saved by the previous run."""
+        if os.path.isfile(self.output_path):
+            with open(self.output_path, encoding="utf-8") as file:
+                self.existing_policies = {
+                    policy["url"]: policy for policy in json.load(file)
+                }
+
+    def unchanged_record(self, policy):
+        """Get the existing record of a policy whose document did not change, or None.
+
+        As in `keep_existing_criteria`, the content is compared by its text.
+        """
+        existing = self.existing_policies.get(policy["url"])
+        if (
+            existing is not None
+            and all(
+                existing.get(key) == policy.get(key)
+                for key in ("publish_date", "last_review_date")
+            )
+            and html_cleaning.content_text(existing.get("html_content", ""))
+            == html_cleaning.content_text(policy["html_content"])
+        ):
+            return existing
+        return None
+
+    def keep_existing_criteria(self, policy):
+        """Carry the criteria of the existing record over when the text of its content did not change.
+
+        The texts are compared rather than the HTML, which the browser and lxml
+        serialize differently.
+        """
+        existing = self.existing_policies.get(policy["url"], {})
+        if "criteria" in existing and html_cleaning.content_text(
+            existing.get("content", "")
+        ) == html_cleaning.content_text(policy["content"]):
+            policy["criteria"] = existing["criteria"]
+        return policy
+
+    def archive_document(self, url, html):
+        """Store a fetched document in the archive, if the scrape keeps one."""
+        if self.archive is not None:
+            self.archive.put(self.category, url, html)
+
+    def compact_archive(self, urls):
+        """Keep only the latest fetch of the listed URLs in the archive index."""
+        if self.archive is not None:
+            self.archive.compact(self.category, urls)
+
+    def save_policies(self, report_reused: bool = False):
+        """Clean the saved records and write them to the category JSON file, returning their URLs."""
+        counts = {"reused": 0, "total": 0}
+        urls = []
+
+        def cleaned_policies():
+            records = self.checkpoint.records()
+            while batch := list(islice(records, html_cleaning.DEFAULT_BATCH_SIZE)):
+                # Records kept from the previous run are already cleaned
+                to_clean = [policy for policy in batch if "content" not in policy]
+                cleaned = html_cleaning.clean_html_bulk(
+                    policy["html_content"] for policy in to_clean
+                )
+                for policy, content in zip(to_clean, cleaned):
+                    policy["content"] = content
+                for policy in batch:
+                    counts["reused"] += policy == self.existing_policies.get(
+                        policy["url"]
+                    )
+                    counts["total"] += 1
+                    urls.append(policy["url"])
+                    yield policy
+
+        # Save the policies to a JSON file without pandas
+        write_json_array(self.output_path, cleaned_policies())
+
+        if report_reused:
+            print(
+                f"Kept {counts['reused']} unchanged policies, "
+                f"updated {counts['total'] - counts['reused']}."
+            )
+        return urls
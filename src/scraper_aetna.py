@@ -0,0 +1,94 @@
+"""Scraper script for the Aetna website using Selenium."""
+
+import json
+
+import lxml.html
+from selenium.webdriver.common.by import By
+
+# The search queries are the categories of the Anthem site
+from src.scraper_anthem import ALLOWED_CATEGORIES
+from src.scraping_engine import PolicyScraper, run_cli
+
+BASE_URL = "https://www.aetna.com/cpb/medical/data/"
+URL = "https://www.aetna.com/health-care-professionals/clinical-policy-bulletins/medical-clinical-policy-bulletins/medical-clinical-policy-bulletins-search-results.html?query={category}"
+OUTPUT_DIR = "./ddata/aetna"
+# The site is browsed as Chrome, in a maximized window
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+POPUP_BUTTON = (
+    By.XPATH,
+    "//a[@class='modalContinueBtn btn--primary type__btn--primary' and contains(text(), 'I accept')]",
+)
+POLICY_SECTION = (
+    "//h2[@class='policyHead' and contains(text(), 'Policy')]/following-sibling::ol"
+)
+
+# Extract the 'Policy' section in one WebDriver round-trip. The bulletins have
+# no details table, only the policy list is extracted.
+EXTRACT_DOCUMENT_SCRIPT = (
+    """
+var section = document.evaluate(
+    %s, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+).singleNodeValue;
+return {
+    details: {},
+    heading: section !== null,
+    content: section ? [section.outerHTML] : [],
+    source: arguments[0] ? document.documentElement.outerHTML : null
+};
+"""
+    % json.dumps(POLICY_SECTION)
+)
+
+
+class AetnaScraper(PolicyScraper):
+    """A class to scrape Aetna site for clinical policy bulletins."""
+
+    NAME = "Aetna"
+    URL = URL
+    BASE_URL = BASE_URL
+    OUTPUT_DIR = OUTPUT_DIR
+    CATEGORIES = ALLOWED_CATEGORIES
+    POPUP_BUTTON = POPUP_BUTTON
+    RESULTS_LABEL = (By.XPATH, "//p[@class='sr_results_message']")
+    ITEM_LINKS = (By.CSS_SELECTOR, ".sr_list_element .link__headline")
+    EXTRACT_DOCUMENT_SCRIPT = EXTRACT_DOCUMENT_SCRIPT
+    USER_AGENT = USER_AGENT
+    MAXIMIZE_WINDOW = True
+
+    def parse_num_results(self, result_msg):
+        """Get the number of results from the search results message."""
+        return int(result_msg.split(" ")[4])
+
+    def check_link(self, link):
+        """Check that a listed link is a clinical policy bulletin."""
+        if not link.startswith(self.BASE_URL):
+            raise ValueError(
+                f"Problem with Medical Policy filter! Expected URL to start with '{self.BASE_URL}'"
+            )
+        return link
+
+    def document_ready(self, result):
+        """The bulletin is loaded once its 'Policy' section is present."""
+        return result["heading"]
+
+    @classmethod
+    def parse_document(cls, html):
+        """Parse the 'Policy' section of a static bulletin."""
+        sections = lxml.html.fromstring(html).xpath(POLICY_SECTION)
+        if not sections:
+            print("Policy not found or page format different.")
+            return {"html_content": ""}
+        return {
+            "html_content": lxml.html.tostring(
+                sections[0], encoding="unicode", with_tail=False
+            )
+        }
+
+
+def main():
+    """Run the scraper."""
+    run_cli(AetnaScraper)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,17 @@
 """Scraper script for the Anthem website using Selenium."""
 
-import argparse
-import json
-import time
-import random
-
-from bs4 import BeautifulSoup
-from selenium import webdriver
-import selenium
+import lxml.etree
+import lxml.html
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+
+from src.browser_sessions import text_changed
+from src.scraping_engine import PolicyScraper, run_cli
 
 BASE_URL = "https://www.anthem.com"
 URL = "https://www.anthem.com/ca/provider/policies/clinical-guidelines/updates/"
+OUTPUT_DIR = "./ddata/anthem"
 ALLOWED_CATEGORIES = [
     "ancillarymiscellaneous",
     "medicine",
@@ -27,313 +24,192 @@ ALLOWED_CATEGORIES = [
     "orthoticsprosthetics",
 ]
 
-
-class AnthemScraper:
+# Extract the document details and the 'Position Statement' content in one
+# WebDriver round-trip. The XPaths and the element walk are the ones of
+# `parse_details` and `parse_position_statement`.
+EXTRACT_DOCUMENT_SCRIPT = """
+function first(xpath, context) {
+    return document.evaluate(
+        xpath, context, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+}
+function text(xpath, context) {
+    var node = first(xpath, context);
+    return node ? node.innerText.replace(/\u00a0/g, ' ') : '';
+}
+var result = {details: null, heading: false, content: [], source: null};
+var table = document.getElementById('docDetails');
+if (table) {
+    result.details = {
+        subject: text('.//tr[1]/td', table),
+        document_number: text('.//tr[2]/td[1]', table),
+        publish_date: text('.//tr[2]/td[2]', table),
+        status: text('.//tr[3]/td[1]', table),
+        last_review_date: text('.//tr[3]/td[2]', table)
+    };
+}
+var heading = first("//strong[contains(text(), 'Position Statement')]", document);
+if (heading) {
+    result.heading = true;
+    var collect = false;
+    for (var elem of document.body.getElementsByTagName('*')) {
+        if (elem === heading) {
+            collect = true;
+            continue;
+        }
+        if (collect) {
+            if (elem.tagName === 'TABLE') break;
+            if (['P', 'UL', 'LI'].includes(elem.tagName)) {
+                result.content.push(elem.outerHTML);
+            }
+        }
+    }
+}
+if (arguments[0]) {
+    result.source = document.documentElement.outerHTML;
+}
+return result;
+"""
+# Cell of each detail in the 'docDetails' table, and the label it starts with
+DETAIL_CELLS = {
+    "subject": ".//tr[1]/td",
+    "document_number": ".//tr[2]/td[1]",
+    "publish_date": ".//tr[2]/td[2]",
+    "status": ".//tr[3]/td[1]",
+    "last_review_date": ".//tr[3]/td[2]",
+}
+DETAIL_LABELS = {
+    "subject": "Subject: ",
+    "document_number": "Document #: ",
+    "publish_date": "Publish Date: ",
+    "status": "Status: ",
+    "last_review_date": "Last Review Date: ",
+}
+
+
+class AnthemScraper(PolicyScraper):
     """A class to scrape Anthem site for clinical guidelines."""
 
-    def __init__(
-        self, headful: bool = False, category: str = "surgery", verbose: bool = False
-    ):
-        self.url = URL
-        self.base_url = BASE_URL
-        self.headless = not headful
-        self.category = category
-        self.verbose = verbose
-        self.driver = self.setup_driver(headful)
-
-    def get_random_wait_time(self):
-        """Get a random wait time between 0.01 and 1 second."""
-        return random.uniform(0.01, 1) if self.headless else 0.5
-
-    def setup_driver(self, headful):
-        """Set up the Firefox driver."""
-        options = webdriver.FirefoxOptions()
-        if not headful:
-            options.add_argument("--headless")
-        return webdriver.Firefox(options=options)
-
-    def close_popup(self):
-        """Close the popup modal if it exists."""
-        try:
-            continue_button = WebDriverWait(
-                self.driver, self.get_random_wait_time()
-            ).until(
-                EC.element_to_be_clickable(
-                    (
-                        By.XPATH,
-                        "//button[@class='btn btn-primary' and contains(text(), 'Continue')]",
-                    )
-                )
-            )
-            continue_button.click()
-        except TimeoutException:
-            print("No popup found or popup already handled.")
+    NAME = "Anthem"
+    URL = URL
+    BASE_URL = BASE_URL
+    OUTPUT_DIR = OUTPUT_DIR
+    CATEGORIES = ALLOWED_CATEGORIES
+    POPUP_BUTTON = (
+        By.XPATH,
+        "//button[@class='btn btn-primary' and contains(text(), 'Continue')]",
+    )
+    RESULTS_LABEL = (By.XPATH, "//div[contains(@class, 'pretend-pagination')]/span")
+    ITEM_LINKS = (By.CSS_SELECTOR, ".news-item-wrapper .article-headline a")
+    EXTRACT_DOCUMENT_SCRIPT = EXTRACT_DOCUMENT_SCRIPT
+    DETAIL_LABELS = DETAIL_LABELS
+    CONTENT_NAME = "Position Statement"
+
+    def filter_results(self):
+        """Filter the listing on the medical policies of the category."""
+        self.select_filter("formsDocTypeFilter", "medicalpolicy")
+        self.select_filter("categoryFilter", self.category)
 
     def select_filter(self, filter_name, value):
         """Select a filter option by its data-value attribute."""
-        filter_button = WebDriverWait(self.driver, self.get_random_wait_time()).until(
-            EC.element_to_be_clickable((By.ID, f"{filter_name}_button"))
+        previous_label = self.get_results_label()
+        filter_button = self.visits.readiness.wait(
+            self.driver, EC.element_to_be_clickable((By.ID, f"{filter_name}_button"))
         )
         filter_button.click()
-        time.sleep(self.get_random_wait_time())  # Wait for dropdown to load
 
-        option = WebDriverWait(self.driver, self.get_random_wait_time()).until(
-            EC.element_to_be_clickable((By.XPATH, f"//li[@data-value='{value}']"))
+        # Wait for the dropdown to open
+        option = self.visits.readiness.wait(
+            self.driver,
+            EC.element_to_be_clickable((By.XPATH, f"//li[@data-value='{value}']")),
         )
         option.click()
-        time.sleep(self.get_random_wait_time())  # Wait for any updates
 
-    def get_num_results(self):
-        """Get the number of results displayed on the page."""
-        result_msg = (
-            WebDriverWait(self.driver, self.get_random_wait_time())
-            .until(
-                EC.visibility_of_element_located(
-                    (
-                        By.XPATH,
-                        "//div[contains(@class, 'pretend-pagination')]/span",
-                    )
-                )
+        # Wait for the results to update
+        try:
+            self.visits.readiness.wait(
+                self.driver, text_changed(self.RESULTS_LABEL, previous_label)
             )
-            .text
-        )
-        num_results = int(result_msg.split(" ")[-1])
-        print(f"Number of results: {num_results}")
-        return num_results
-
-    def get_item_links(self):
-        """Get the link to each item on the page."""
-        item_links = []
-        items = self.driver.find_elements(
-            By.CSS_SELECTOR, ".news-item-wrapper .article-headline a"
-        )
-        for item in items:
-            link = item.get_attribute("href")
-            if link.split("/")[-1][:2] != "mp":
-                raise ValueError(
-                    "Problem with Medical Policy filter! Expected 'mp_...'"
-                )
-            if link.startswith("/"):
-                link = self.base_url + link
-            item_links.append(link)
-        return item_links
+        except TimeoutException:
+            if self.log.verbose:
+                print(f"! Results did not change after selecting {value}.")
 
-    def extract_details(self):
-        """Extract the details of the document."""
-        try:
-            # Wait for the 'docDetails' table to load
-            doc_details_table = WebDriverWait(
-                self.driver, self.get_random_wait_time()
-            ).until(EC.visibility_of_element_located((By.ID, "docDetails")))
+    def parse_num_results(self, result_msg):
+        """Get the number of results from the 'Showing a - b of n' label."""
+        return int(result_msg.split(" ")[-1])
 
-            # Extracting details
-            subject = (
-                doc_details_table.find_element(By.XPATH, ".//tr[1]/td")
-                .text.replace("Subject: ", "")
-                .strip()
-            )
-            document_number = (
-                doc_details_table.find_element(By.XPATH, ".//tr[2]/td[1]")
-                .text.replace("Document #: ", "")
-                .strip()
-            )
-            publish_date = (
-                doc_details_table.find_element(By.XPATH, ".//tr[2]/td[2]")
-                .text.replace("Publish Date: ", "")
-                .strip()
-            )
-            status = (
-                doc_details_table.find_element(By.XPATH, ".//tr[3]/td[1]")
-                .text.replace("Status: ", "")
-                .strip()
-            )
-            last_review_date = (
-                doc_details_table.find_element(By.XPATH, ".//tr[3]/td[2]")
-                .text.replace("Last Review Date: ", "")
-                .strip()
-            )
+    def check_link(self, link):
+        """Check that a listed link is a medical policy ('mp_...'), returning its absolute URL."""
+        if link.split("/")[-1][:2] != "mp":
+            raise ValueError("Problem with Medical Policy filter! Expected 'mp_...'")
+        if link.startswith("/"):
+            link = self.BASE_URL + link
+        return link
 
-            return {
-                "subject": subject,
-                "document_number": document_number,
-                "publish_date": publish_date,
-                "status": status,
-                "last_review_date": last_review_date,
-            }
-        except TimeoutException:
+    @staticmethod
+    def element_text(element):
+        """Get the text of an lxml element the way WebDriver renders it."""
+        return " ".join(element.text_content().replace("\xa0", " ").split())
+
+    @classmethod
+    def parse_details(cls, tree):
+        """Parse the details of the document from its lxml tree."""
+        tables = tree.xpath("//*[@id='docDetails']")
+        if not tables:
             print("Failed to find the document details table.")
             return {}
+        table = tables[0]
 
-    def extract_position_statement(self):
-        """Extract the content under the 'Position Statement' heading."""
-        try:
-            # Locate the 'Position Statement' heading to ensure we are extracting the right paragraph
-            position_heading = WebDriverWait(
-                self.driver, self.get_random_wait_time()
-            ).until(
-                EC.visibility_of_element_located(
-                    (By.XPATH, "//strong[contains(text(), 'Position Statement')]")
-                )
-            )
-            # Collect all subsequent siblings until the next <table> is encountered
-            content_elements = self.driver.execute_script(
-                """
-                var heading = arguments[0];
-                var collect = false;
-                var content = [];
-                var elements = document.body.getElementsByTagName('*');
-                for (var elem of elements) {
-                    if (elem === heading) {
-                        collect = true;
-                        continue;
-                    }
-                    if (collect) {
-                        if (elem.tagName === 'TABLE') break;
-                        if (['P', 'UL', 'LI'].includes(elem.tagName)) {
-                            content.push(elem.outerHTML);
-                        }
-                    }
-                }
-                return content;
-                """,
-                position_heading,
-            )
+        def cell(key):
+            cells = table.xpath(DETAIL_CELLS[key])
+            text = cls.element_text(cells[0]) if cells else ""
+            return text.replace(cls.DETAIL_LABELS[key], "").strip()
 
-            if not content_elements:
-                raise ValueError("No content was extracted.")
+        return {key: cell(key) for key in cls.DETAIL_LABELS}
 
-            return "\n".join(content_elements)
-        except TimeoutException:
+    @staticmethod
+    def parse_position_statement(tree):
+        """Parse the content under the 'Position Statement' heading from the lxml tree."""
+        headings = tree.xpath("//strong[contains(text(), 'Position Statement')]")
+        if not headings:
             print("Position Statement not found or page format different.")
             return ""
-        except ValueError as exception:
-            print(f"An error occurred: {exception}")
-            return ""
-
-    def visit_item_pages(self, item_links):
-        """Visit each item page and process it as needed."""
-        main_window = self.driver.current_window_handle  # Store the main window handle
-        policies = []
-        for link in item_links:
-            self.driver.execute_script("window.open('');")  # Open a new tab
-            self.driver.switch_to.window(
-                self.driver.window_handles[1]
-            )  # Switch to the new tab
-            self.driver.get(link)
-            time.sleep(self.get_random_wait_time())  # Allow page to load
-
-            # Extract the document details and the 'Position Statement' content
-            policy = {"url": link}
-            policy = {**policy, **self.extract_details()}
-            content = self.extract_position_statement()
-            policy["html_content"] = content
 
-            policies.append(policy)
-
-            print(f"-> Visited: {link}")
-            self.driver.close()  # Close the current tab
-            self.driver.switch_to.window(main_window)  # Switch back to the main window
-        return policies
-
-    def navigate_next_page(self):
-        """Navigate to the next page."""
-        clicked = False
-        trial = 0
-        while not clicked:
-            try:
-                next_page_link = WebDriverWait(
-                    self.driver, self.get_random_wait_time()
-                ).until(
-                    EC.element_to_be_clickable(
-                        (By.XPATH, "//a[contains(@aria-label, 'Go to Next Page')]")
+        # Same walk as the injected script: every element after the heading,
+        # in document order, until the next <table>
+        content_elements = []
+        collect = False
+        for elem in tree.iter(lxml.etree.Element):
+            if elem is headings[0]:
+                collect = True
+                continue
+            if collect:
+                if elem.tag == "table":
+                    break
+                if elem.tag in ("p", "ul", "li"):
+                    outer_html = lxml.html.tostring(
+                        elem, encoding="unicode", with_tail=False
                     )
-                )
-                next_page_link.click()
-                clicked = True
-            except selenium.common.exceptions.ElementClickInterceptedException:
-                trial += 1
-                if self.verbose:
-                    print(f"! Failed to click next page link. Trial {trial}.")
-            time.sleep(self.get_random_wait_time())  # Allow page to load
-
-    @staticmethod
-    def clean_html(html):
-        """Clean the HTML content."""
-        soup = BeautifulSoup(html, "html.parser")
-
-        # Remove specific tags but keep their content
-        for tag in soup.find_all(["strong", "em", "div", "p"]):
-            tag.unwrap()
-
-        return str(soup)
-
-    def scrape(self):
-        """Scrape the Anthem site for clinical guidelines."""
-        if self.verbose:
-            print(f"Scraping Anthem site for {self.category} guidelines.")
-        self.driver.get(self.url)
-        time.sleep(self.get_random_wait_time())  # Allow page to load
-        self.close_popup()
-        self.select_filter("formsDocTypeFilter", "medicalpolicy")
-        self.select_filter("categoryFilter", self.category)
-        num_results = self.get_num_results()
-
-        visited_links = set()
-        policies = []
-        while True:
-            try:
-                item_links = self.get_item_links()
-                visited_links.update(item_links)
-                policies.extend(self.visit_item_pages(item_links))
-                self.navigate_next_page()
-            except ValueError as exception:
-                print(exception)
-                break
-            except TimeoutException:
-                print("No more pages or next page button not found.")
-                break
-        assert len(visited_links) == num_results, "Some items were not visited."
+                    content_elements.append(outer_html.replace("\xa0", "&nbsp;"))
 
-        # Clean the HTML content
-        for policy in policies:
-            policy["content"] = self.clean_html(policy["html_content"])
+        if not content_elements:
+            print("An error occurred: No content was extracted.")
+            return ""
+        return "\n".join(content_elements)
 
-        # Save the policies to a JSON file without pandas
-        with open(
-            f"./ddata/anthem/{self.category}_policies.json", "w", encoding="utf-8"
-        ) as file:
-            json.dump(policies, file, indent=2)
+    @classmethod
+    def parse_document(cls, html):
+        """Parse the details and the 'Position Statement' content of a static document."""
+        tree = lxml.html.fromstring(html)
+        return {
+            **cls.parse_details(tree),
+            "html_content": cls.parse_position_statement(tree),
+        }
 
 
 def main():
     """Run the scraper."""
-    parser = argparse.ArgumentParser(
-        description="Scrape Anthem site for clinical guidelines."
-    )
-    parser.add_argument(
-        "--cat",
-        type=str,
-        default="surgery",
-        help="Category to filter the guidelines.",
-        choices=["all"] + ALLOWED_CATEGORIES,
-    )
-    parser.add_argument(
-        "--headful", action="store_true", help="Run browser in headful mode."
-    )
-    parser.add_argument("--verbose", action="store_true", help="Print verbose output.")
-    args = parser.parse_args()
-
-    if args.cat == "all":
-        for cat in ALLOWED_CATEGORIES:
-            scraper = AnthemScraper(
-                headful=args.headful, category=cat, verbose=args.verbose
-            )
-            scraper.scrape()
-    else:
-        scraper = AnthemScraper(
-            headful=args.headful, category=args.cat, verbose=args.verbose
-        )
-        scraper.scrape()
+    run_cli(AnthemScraper)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,761 @@
+"""Payer-agnostic scraping engine for the medical policy sites.
+
+`PolicyScraper` runs the scrape shared by every payer: it browses the listing,
+visits the item pages concurrently (`PageVisits`) in pooled browser sessions
+(`src.browser_sessions`) or over HTTP with conditional requests
+(`HttpFetcher`), retries transient failures, and streams the records to the
+resumable output of the category (`src.scrape_output`) and its document
+archive (`src.html_archive`), timing each phase (`ScrapeLog`). A payer scraper
+is a small subclass describing its site: the listing locators, how to filter
+the listing and read its links, and how to extract a document in the browser
+and from static HTML.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+import selenium
+from requests.adapters import HTTPAdapter
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+
+from src import html_cleaning
+from src.browser_sessions import BrowserManager, HostLimiter, PageReadiness, text_changed
+from src.html_archive import extract_archived_document
+from src.scrape_output import ScrapeOutput, write_json_array
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:126.0) Gecko/20100101 Firefox/126.0"
+FETCH_MODES = ["browser", "http"]
+MAX_CLICK_TRIALS = 10
+# Page loads and downloads failing with these errors are retried, with an
+# exponential backoff starting at RETRY_BACKOFF seconds
+RETRYABLE_ERRORS = (WebDriverException, requests.RequestException)
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+DEFAULT_MAX_RETRIES = 2
+RETRY_BACKOFF = 0.5
+
+
+class ScrapeLog:
+    """Progress output of a scrape, with the time spent in each phase and its event counts."""
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+        # Wall-clock seconds spent in each phase of the scrape, and event counts
+        self.timings = defaultdict(float)
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in a `with` block to the timings of a phase."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start_time
+
+    def count(self, event):
+        """Count an event of the scrape, from any worker thread."""
+        with self._lock:
+            self.counts[event] += 1
+
+    def metrics(self):
+        """Get the timings and event counts of the scrape."""
+        return {
+            "timings": {name: round(value, 3) for name, value in self.timings.items()},
+            "counts": dict(self.counts),
+        }
+
+
+class PageVisits:
+    """How the item pages are visited: fetch mode, concurrency, per-host limit, politeness delay and retries."""
+
+    def __init__(
+        self,
+        fetch: str = "browser",
+        incremental: bool = False,
+        workers: int = 1,
+        max_per_host: int = 4,
+        min_delay: float = 0.0,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        if fetch not in FETCH_MODES:
+            raise ValueError(f"Invalid fetch mode: {fetch}")
+        self.fetch = fetch
+        self.incremental = incremental
+        self.concurrency = max(1, min(workers, max_per_host))
+        self.max_retries = max_retries
+        self.host_limiter = HostLimiter(max_per_host)
+        self.readiness = PageReadiness(min_delay)
+
+    def retry(self, action, link, log):
+        """Run `action`, retrying transient failures with an exponential backoff."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return action()
+            except RETRYABLE_ERRORS as exception:
+                if attempt == self.max_retries:
+                    raise
+                log.count("retries")
+                if log.verbose:
+                    print(f"! Retrying {link} after: {exception}")
+                time.sleep(RETRY_BACKOFF * 2**attempt)
+        return None
+
+    def map(self, visit, item_links):
+        """Apply `visit` to every link, concurrently if allowed, yielding in their order."""
+        if self.concurrency <= 1:
+            for link in item_links:
+                yield visit(link)
+            return
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            yield from executor.map(visit, item_links)
+
+
+class HttpFetcher:
+    """Keep-alive HTTP session downloading the documents, with the conditional requests of the incremental mode.
+
+    The ETag and Last-Modified validators of the documents are kept for the
+    next run, and only sent for the documents of the previous run.
+    """
+
+    def __init__(self, visits: PageVisits, output: ScrapeOutput, user_agent: str):
+        self.visits = visits
+        self.output = output
+        self.validators_path = output.cache_path("validators.json")
+        self.validators = {}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=visits.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["User-Agent"] = user_agent
+
+    def load_validators(self):
+        """Load the HTTP validators saved by the previous run."""
+        if os.path.isfile(self.validators_path):
+            with open(self.validators_path, encoding="utf-8") as file:
+                self.validators = json.load(file)
+
+    def save_validators(self):
+        """Save the HTTP validators of the documents for the next run."""
+        os.makedirs(os.path.dirname(self.validators_path), exist_ok=True)
+        with open(self.validators_path, "w", encoding="utf-8") as file:
+            json.dump(self.validators, file, indent=2)
+
+    def conditional_headers(self, link):
+        """Get the conditional request headers for a document seen in a previous run."""
+        if link not in self.output.existing_policies:
+            return {}
+        validator = self.validators.get(link, {})
+        headers = {}
+        if validator.get("etag"):
+            headers["If-None-Match"] = validator["etag"]
+        if validator.get("last_modified"):
+            headers["If-Modified-Since"] = validator["last_modified"]
+        return headers
+
+    def record_validators(self, link, response):
+        """Record the ETag and Last-Modified validators of an HTTP response, returning them."""
+        validator = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        current = {key: value for key, value in validator.items() if value}
+        if current:
+            self.validators[link] = current
+        return current
+
+    def is_unchanged(self, link):
+        """Check with a conditional HEAD request whether a known document is unchanged."""
+        if link not in self.output.existing_policies:
+            return False
+        previous = self.validators.get(link)
+        try:
+            with self.visits.host_limiter.slot(link):
+                response = self.session.head(
+                    link,
+                    headers=self.conditional_headers(link),
+                    timeout=30,
+                    allow_redirects=True,
+                )
+        except requests.RequestException:
+            return False
+        if response.status_code == 304:
+            return True
+        if not response.ok:
+            return False
+        current = self.record_validators(link, response)
+        # Some servers ignore conditional headers on HEAD, compare the validators instead
+        return bool(current) and current == previous
+
+    def download(self, link, log):
+        """Download a document, retrying the transient failures, a 304 response meaning it is unchanged."""
+
+        def get():
+            with self.visits.host_limiter.slot(link):
+                self.visits.readiness.pause()
+                response = self.session.get(
+                    link, headers=self.conditional_headers(link), timeout=30
+                )
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                response.raise_for_status()
+            return response
+
+        response = self.visits.retry(get, link, log)
+        if response.status_code != 304:
+            response.raise_for_status()
+            # The documents are UTF-8, requests would otherwise assume ISO-8859-1
+            if "charset" not in response.headers.get("Content-Type", ""):
+                response.encoding = "utf-8"
+            self.record_validators(link, response)
+        return response
+
+    def close(self):
+        """Close the HTTP session."""
+        self.session.close()
+
+
+class PolicyScraper:
+    """Scrape the medical policies of a payer site, category by category.
+
+    Subclasses describe the site with the class attributes below and implement
+    `parse_num_results`, `check_link` and `parse_document`.
+    """
+
+    NAME = None
+    URL = None
+    BASE_URL = None
+    OUTPUT_DIR = None
+    CATEGORIES = []
+    # Locators of the listing pages
+    POPUP_BUTTON = None
+    RESULTS_LABEL = None
+    ITEM_LINKS = None
+    NEXT_PAGE_LINK = (By.XPATH, "//a[contains(@aria-label, 'Go to Next Page')]")
+    # Script extracting a document in one WebDriver round-trip. It gets whether
+    # to include the page source and returns {details, heading, content, source}:
+    # the raw details (or null until they are loaded), whether the heading of
+    # the policy content was found, its HTML elements and the page source.
+    EXTRACT_DOCUMENT_SCRIPT = None
+    # Labels to strip from the raw details, and name of the policy content section
+    DETAIL_LABELS = {}
+    CONTENT_NAME = "Policy"
+    # User-agent of the browser and HTTP sessions (the default Firefox one in the
+    # browser when None), and whether to maximize the browser windows
+    USER_AGENT = None
+    MAXIMIZE_WINDOW = False
+
+    def __init__(
+        self,
+        headful: bool = False,
+        category: str = "surgery",
+        verbose: bool = False,
+        visits: PageVisits = None,
+        browser: BrowserManager = None,
+        resume: bool = True,
+        archive: bool = True,
+        output_dir: str = None,
+    ):
+        self.category = category
+        self.log = ScrapeLog(verbose)
+        self.visits = visits or PageVisits()
+        # The scraper only quits the sessions it started itself
+        self.owns_browser = browser is None
+        self.browser = browser or BrowserManager(
+            headful, self.visits.concurrency, self.USER_AGENT, self.MAXIMIZE_WINDOW
+        )
+        self.output = ScrapeOutput(output_dir or self.OUTPUT_DIR, category, resume, archive)
+        self.http = (
+            HttpFetcher(self.visits, self.output, self.USER_AGENT or USER_AGENT)
+            if self.visits.fetch == "http" or self.visits.incremental
+            else None
+        )
+
+    @property
+    def driver(self):
+        """The main browser session, only started when first needed."""
+        return self.browser.driver
+
+    def close(self):
+        """Release the browser sessions and the HTTP session of the scraper."""
+        if self.owns_browser:
+            self.browser.quit()
+        if self.http is not None:
+            self.http.close()
+
+    def close_popup(self):
+        """Close the popup modal if it exists."""
+        try:
+            continue_button = self.visits.readiness.wait(
+                self.driver, EC.element_to_be_clickable(self.POPUP_BUTTON)
+            )
+            continue_button.click()
+        except TimeoutException:
+            print("No popup found or popup already handled.")
+
+    def filter_results(self):
+        """Apply the filters of the category to the listing, if the site has any."""
+
+    def open_listing(self):
+        """Load the listing of the category and get it ready to be read."""
+        self.visits.readiness.load(self.driver, self.URL.format(category=self.category))
+        self.close_popup()
+        self.filter_results()
+
+    def get_results_label(self):
+        """Get the text of the pagination label, or None if it is not displayed yet."""
+        labels = self.driver.find_elements(*self.RESULTS_LABEL)
+        return labels[0].text if labels else None
+
+    def parse_num_results(self, result_msg):
+        """Get the number of results from the text of the results label."""
+        raise NotImplementedError
+
+    def get_num_results(self):
+        """Get the number of results displayed on the page."""
+        result_msg = self.visits.readiness.wait(
+            self.driver, EC.visibility_of_element_located(self.RESULTS_LABEL)
+        ).text
+        num_results = self.parse_num_results(result_msg)
+        print(f"Number of results: {num_results}")
+        return num_results
+
+    def check_link(self, link):
+        """Check that a listed link is a medical policy, returning its absolute URL.
+
+        Raises a ValueError when the listing is not filtered as expected.
+        """
+        raise NotImplementedError
+
+    def get_item_links(self):
+        """Get the link to each item on the page."""
+        items = self.driver.find_elements(*self.ITEM_LINKS)
+        return [self.check_link(item.get_attribute("href")) for item in items]
+
+    @classmethod
+    def parse_document(cls, html):
+        """Parse the details and the policy content of a static document."""
+        raise NotImplementedError
+
+    def _merge_with_existing(self, policy):
+        """Keep the existing record, and its criteria, when the document did not change."""
+        existing = self.output.unchanged_record(policy)
+        if existing is None:
+            return policy
+        self.log.count("unchanged")
+        return existing
+
+    def _failed_item_page(self, link):
+        """Count a page that could not be fetched, keeping its existing record if there is one."""
+        self.log.count("failures")
+        return self.output.existing_policies.get(link, {"url": link, "html_content": ""})
+
+    def fetch_item_page(self, link):
+        """Download a single item page over HTTP and parse its content."""
+        try:
+            response = self.http.download(link, self.log)
+        except requests.RequestException as exception:
+            print(f"Failed to fetch {link}: {exception}")
+            return self._failed_item_page(link)
+        if response.status_code == 304:
+            print(f"-> Unchanged: {link}")
+            self.log.count("unchanged")
+            return self.output.existing_policies[link]
+
+        self.output.archive_document(link, response.text)
+        policy = {"url": link, **self.parse_document(response.text)}
+        print(f"-> Fetched: {link}")
+        self.log.count("documents")
+        return self._merge_with_existing(policy)
+
+    def document_ready(self, result):
+        """Check whether a result of the extraction script shows a loaded document."""
+        return result["details"] is not None
+
+    def extract_document(self, driver=None, link=None):
+        """Extract the details and the policy content in a single script call.
+
+        When the link of the page is given, its source is archived in the same call.
+        """
+        driver = driver or self.driver
+        include_source = link is not None and self.output.archive is not None
+        result = {}
+
+        def loaded(driver):
+            result.update(
+                driver.execute_script(self.EXTRACT_DOCUMENT_SCRIPT, include_source)
+            )
+            return self.document_ready(result)
+
+        try:
+            self.visits.readiness.wait(driver, loaded)
+        except TimeoutException:
+            print("The document did not finish loading.")
+        details = {
+            key: value.replace(self.DETAIL_LABELS.get(key, ""), "").strip()
+            for key, value in (result.get("details") or {}).items()
+        }
+
+        if result.get("source"):
+            self.output.archive_document(link, result["source"])
+        if not result.get("heading"):
+            print(f"{self.CONTENT_NAME} not found or page format different.")
+            return details, ""
+        if not result["content"]:
+            print("An error occurred: No content was extracted.")
+            return details, ""
+        return details, "\n".join(result["content"])
+
+    def visit_item_page(self, driver, link):
+        """Load a single item page in the given driver and extract its content."""
+        readiness = self.visits.readiness
+
+        def load():
+            with self.visits.host_limiter.slot(link):
+                readiness.pause()
+                readiness.load(driver, link)
+
+        try:
+            self.visits.retry(load, link, self.log)
+        except WebDriverException as exception:
+            print(f"Failed to load {link}: {exception}")
+            return self._failed_item_page(link)
+
+        # Extract the document details and the policy content
+        details, content = self.extract_document(driver, link)
+        policy = {"url": link, **details, "html_content": content}
+
+        print(f"-> Visited: {link}")
+        self.log.count("documents")
+        return self._merge_with_existing(policy)
+
+    def _visit_item_page_in_pool(self, link):
+        """Visit a single item page with a session borrowed from the worker pool."""
+        with self.browser.pool.session() as driver:
+            return self.visit_item_page(driver, link)
+
+    def visit_item_pages(self, item_links):
+        """Visit each item page and process it as needed, yielding the policies in order."""
+        if self.visits.fetch == "http":
+            return self.visits.map(self.fetch_item_page, item_links)
+        if self.visits.incremental:
+            return self._visit_changed_item_pages(item_links)
+        return self._render_item_pages(item_links)
+
+    def _visit_changed_item_pages(self, item_links):
+        """Render only the item pages that are new or changed since the previous run."""
+        unchanged = list(self.visits.map(self.http.is_unchanged, item_links))
+        changed_links = [
+            link for link, is_unchanged in zip(item_links, unchanged) if not is_unchanged
+        ]
+        # The rendered policies come in the order of the changed links
+        rendered = self._render_item_pages(changed_links)
+        for link, is_unchanged in zip(item_links, unchanged):
+            if is_unchanged:
+                print(f"-> Unchanged: {link}")
+                self.log.count("unchanged")
+                yield self.output.existing_policies[link]
+            else:
+                policy = next(rendered, None)
+                # A page missing from the rendered ones is left to the next run
+                if policy is not None:
+                    yield policy
+
+    def _render_item_pages(self, item_links):
+        """Render each item page in the browser and extract its content."""
+        if self.visits.concurrency > 1:
+            yield from self.visits.map(self._visit_item_page_in_pool, item_links)
+            return
+
+        main_window = self.driver.current_window_handle  # Store the main window handle
+        for link in item_links:
+            self.driver.execute_script("window.open('');")  # Open a new tab
+            self.driver.switch_to.window(
+                self.driver.window_handles[1]
+            )  # Switch to the new tab
+            policy = self.visit_item_page(self.driver, link)
+            self.driver.close()  # Close the current tab
+            self.driver.switch_to.window(main_window)  # Switch back to the main window
+            yield policy
+
+    def navigate_next_page(self):
+        """Navigate to the next page."""
+        readiness = self.visits.readiness
+        previous_label = self.get_results_label()
+        previous_items = self.driver.find_elements(*self.ITEM_LINKS)
+        readiness.pause()
+        clicked = False
+        trial = 0
+        while not clicked:
+            try:
+                next_page_link = readiness.wait(
+                    self.driver, EC.element_to_be_clickable(self.NEXT_PAGE_LINK)
+                )
+                next_page_link.click()
+                clicked = True
+            except selenium.common.exceptions.ElementClickInterceptedException as exception:
+                trial += 1
+                if self.log.verbose:
+                    print(f"! Failed to click next page link. Trial {trial}.")
+                if trial >= MAX_CLICK_TRIALS:
+                    raise TimeoutException(
+                        "The next page link kept being intercepted."
+                    ) from exception
+                time.sleep(0.1 * trial)
+
+        # The page is loaded once the previous items are replaced
+        page_changed = [text_changed(self.RESULTS_LABEL, previous_label)]
+        if previous_items:
+            page_changed.append(EC.staleness_of(previous_items[0]))
+        readiness.wait(self.driver, EC.any_of(*page_changed))
+        readiness.wait(self.driver, EC.presence_of_element_located(self.ITEM_LINKS))
+        self.log.count("pages")
+
+    @staticmethod
+    def clean_html(html):
+        """Clean the HTML content."""
+        return html_cleaning.clean_html(html)
+
+    def _load_previous_run(self):
+        """Load the policies and HTTP validators saved by the previous run."""
+        self.output.load_previous_run()
+        if self.http is not None:
+            self.http.load_validators()
+        if self.log.verbose:
+            print(f"Loaded {len(self.output.existing_policies)} existing policies.")
+
+    def scrape(self):
+        """Scrape the site for the clinical guidelines of the category."""
+        log, checkpoint = self.log, self.output.checkpoint
+        if log.verbose:
+            print(f"Scraping {self.NAME} site for {self.category} guidelines.")
+        with log.phase("listing"):
+            if self.visits.incremental:
+                self._load_previous_run()
+            self.browser.reset()
+            self.open_listing()
+            num_results = self.get_num_results()
+
+        with log.phase("navigation"):
+            page = self._resume_from_checkpoint(num_results)
+        visited_links = set(checkpoint.completed)
+        with checkpoint:
+            while page is not None:
+                try:
+                    with log.phase("documents"):
+                        item_links = self.get_item_links()
+                        visited_links.update(item_links)
+                        # Each record is saved as soon as its page is visited
+                        pending_links = [
+                            link for link in item_links if link not in checkpoint.completed
+                        ]
+                        for policy in self.visit_item_pages(pending_links):
+                            checkpoint.append(policy)
+                        page += 1
+                        checkpoint.save(page, num_results)
+                    with log.phase("navigation"):
+                        self.navigate_next_page()
+                except ValueError as exception:
+                    print(exception)
+                    break
+                except TimeoutException:
+                    print("No more pages or next page button not found.")
+                    break
+        assert len(visited_links) == num_results, "Some items were not visited."
+
+        with log.phase("output"):
+            urls = self.output.save_policies(report_reused=self.visits.incremental)
+            if self.visits.incremental:
+                self.http.save_validators()
+            checkpoint.clear()
+            self.output.compact_archive(urls)
+        if log.verbose:
+            print(f"Scrape metrics: {json.dumps(log.metrics())}")
+
+    def rebuild_from_archive(self):
+        """Re-extract the archived documents of the category, without any browser.
+
+        The rebuild is limited to the URLs of the last listing, the ones of the
+        category file, and its policies that were not archived are kept as they
+        are. A category without any archived document is left untouched.
+        """
+        output = self.output
+        output.load_previous_run()
+        entries = output.archive.entries(self.category)
+        if not entries:
+            print(f"No archived {self.category} documents, the category is left as it is.")
+            return
+        urls = list(output.existing_policies) or list(entries)
+        archived_urls = [url for url in urls if url in entries]
+        if self.log.verbose:
+            print(
+                f"Re-extracting {len(archived_urls)} archived {self.category} documents, "
+                f"keeping {len(urls) - len(archived_urls)} policies."
+            )
+        with ProcessPoolExecutor() as executor:
+            rebuilt = dict(
+                zip(
+                    archived_urls,
+                    executor.map(
+                        extract_archived_document,
+                        [type(self)] * len(archived_urls),
+                        [output.archive.root] * len(archived_urls),
+                        archived_urls,
+                        [entries[url] for url in archived_urls],
+                        chunksize=8,
+                    ),
+                )
+            )
+        write_json_array(
+            output.output_path,
+            (
+                output.keep_existing_criteria(rebuilt[url])
+                if url in rebuilt
+                else output.existing_policies[url]
+                for url in urls
+            ),
+        )
+        output.compact_archive(urls)
+
+    def _resume_from_checkpoint(self, num_results):
+        """Go back to the results page where a previous run stopped, returning its index.
+
+        None is returned when the previous run stopped after the last results
+        page, so only the output is left to write.
+        """
+        checkpoint = self.output.checkpoint
+        if not self.output.resume:
+            checkpoint.clear()
+            return 0
+        state = checkpoint.load()
+        if state is None:
+            return 0
+        print(
+            f"Resuming from results page {state['page'] + 1}, "
+            f"{len(checkpoint.completed)} policies already saved."
+        )
+        if state["num_results"] not in (None, num_results) and self.log.verbose:
+            print(
+                f"! The number of results changed since the previous run "
+                f"({state['num_results']} -> {num_results})."
+            )
+        for _ in range(state["page"]):
+            try:
+                self.navigate_next_page()
+            except TimeoutException:
+                print("No more pages, the previous run listed every result.")
+                return None
+        return state["page"]
+
+
+def run_cli(scraper_class):
+    """Run a payer scraper from the command line."""
+    parser = argparse.ArgumentParser(
+        description=f"Scrape {scraper_class.NAME} site for clinical guidelines."
+    )
+    parser.add_argument(
+        "--cat",
+        type=str,
+        default="surgery",
+        help="Category to filter the guidelines.",
+        choices=["all"] + scraper_class.CATEGORIES,
+    )
+    parser.add_argument(
+        "--headful", action="store_true", help="Run browser in headful mode."
+    )
+    parser.add_argument("--verbose", action="store_true", help="Print verbose output.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of headless browser sessions visiting item pages concurrently.",
+    )
+    parser.add_argument(
+        "--max-per-host",
+        type=int,
+        default=4,
+        help="Maximum number of concurrent page loads against a single host.",
+    )
+    parser.add_argument(
+        "--fetch",
+        type=str,
+        default="browser",
+        choices=FETCH_MODES,
+        help="How to load the policy documents: render them in the browser, "
+        "or download the static HTML over HTTP (the browser only lists the links).",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only fetch new or changed documents, keeping the existing records "
+        "(and their criteria) for the others.",
+    )
+    parser.add_argument(
+        "--min-delay",
+        type=float,
+        default=0.0,
+        help="Minimum politeness delay, in seconds, before each page request.",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help="Number of retries of a page load or download failing transiently.",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Discard the checkpoint of an interrupted run instead of resuming it.",
+    )
+    parser.add_argument(
+        "--no-archive",
+        action="store_true",
+        help="Do not store the fetched documents in the local archive.",
+    )
+    parser.add_argument(
+        "--from-archive",
+        action="store_true",
+        help="Re-extract the policies from the archived documents, without any browser.",
+    )
+    args = parser.parse_args()
+
+    categories = scraper_class.CATEGORIES if args.cat == "all" else [args.cat]
+    # A single set of browser sessions is reused for every category
+    with BrowserManager(
+        headful=args.headful,
+        workers=min(args.workers, args.max_per_host),
+        user_agent=scraper_class.USER_AGENT,
+        maximize=scraper_class.MAXIMIZE_WINDOW,
+    ) as browser:
+        for cat in categories:
+            scraper = scraper_class(
+                headful=args.headful,
+                category=cat,
+                verbose=args.verbose,
+                visits=PageVisits(
+                    fetch=args.fetch,
+                    incremental=args.incremental,
+                    workers=args.workers,
+                    max_per_host=args.max_per_host,
+                    min_delay=args.min_delay,
+                    max_retries=args.max_retries,
+                ),
+                browser=browser,
+                resume=not args.restart,
+                archive=not args.no_archive or args.from_archive,
+            )
+            try:
+                if args.from_archive:
+                    scraper.rebuild_from_archive()
+                else:
+                    scraper.scrape()
+            finally:
+                scraper.close()
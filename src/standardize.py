@@ -2,131 +2,384 @@
 
 import os
 import argparse
+import asyncio
 import json
 import time
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_community.callbacks import get_openai_callback
-import openai
+from src.batch_extraction import BatchJob
+from src.criteria_stream import CriteriaStream
+from src.extraction_cache import DEFAULT_CACHE_PATH, DEFAULT_CACHE_SIZE, ExtractionCache
+from src.file_extraction import FileExtraction, aextract_folder, data_files, single_groups
+from src.local_model import DEFAULT_CONTEXT_SIZE, is_local_model
+from src.metrics import ExtractionMetrics
+from src.model_requests import ModelRequests
+from src.policy_packing import split_usage
+from src.policy_sections import merge_criteria, merge_usage, split_sections
+from src.rate_limit import DEFAULT_MAX_RETRIES, reported_errors
+from src.rule_extractor import extract_rules
 
-from src.instructions import INSTRUCTIONS
 
+class MedicalPolicyExtractor:
+    """Class to extract the different criteria logic schemas for medical policies."""
 
-def initialize_model(model_name: str):
-    """Function to initialize the model."""
-    if model_name in ["gpt-4o", "gpt-4", "gpt-3.5-turbo", "gpt-3.5"]:
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        llm = ChatOpenAI(
-            model=model_name,
-            temperature=0,
-            max_tokens=None,
-            openai_api_key=openai_api_key,
-        )
-    else:
-        raise ValueError(f"Invalid model name: {model_name}")
-    return llm
+    def __init__(
+        self,
+        model_name: str = "gpt-4o",
+        cache: ExtractionCache = None,
+        force: bool = False,
+        split_threshold: int = 0,
+        rules: bool = False,
+        cascade_model: str = None,
+        compact: bool = False,
+        **request_options,
+    ):
+        """Initialize the MedicalPolicyExtractor class.
 
+        The extractions are stored in the `cache`, if any, `force` re-extracts
+        the policies even when they are cached or already have criteria for the
+        model. Position statements longer than `split_threshold` characters are
+        extracted in sections (never if 0).
 
-class MedicalPolicyExtractor:
-    """Class to extract the different criteria logic schemas for medical policies."""
+        With `rules`, the simple position statements are extracted by rules,
+        without the model.
+
+        With a `cascade_model`, each position statement is sent to it first, and
+        only escalated to the model when its criteria fail the validation. The
+        criteria are then recorded for the cascade, e.g. gpt-3.5-turbo+gpt-4o.
 
-    def __init__(self, model_name: str = "gpt-4o"):
-        """Initialize the MedicalPolicyExtractor class."""
+        With `compact`, the model answers in the compact format of
+        `src.compact_schema`, expanded back to the full format.
+
+        The `request_options` (rate limit, retries and local model options) are
+        the ones of `ModelRequests`.
+        """
         print(f"Initializing the data extractor with the model: {model_name}")
         load_dotenv()
-        self.model_name = model_name
-        self.llm = initialize_model(model_name)
-        self.instructions = INSTRUCTIONS
-        self.prompt = ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    "You are a helpful assistant that follows the following instructions {instructions}.",
-                ),
-                ("human", "{position_statement}"),
-            ]
+        self.requests = ModelRequests(model_name, cascade_model, compact, **request_options)
+        self.cache = cache
+        self.force = force
+        self.split_threshold = split_threshold
+        self.rules = rules
+        self.metrics = ExtractionMetrics()
+        # Retries of the failed extractions, by position statement, until they are recorded
+        self.failed_retries = {}
+
+    @property
+    def model_name(self):
+        """Name under which the criteria are recorded, the one of the cascade if any."""
+        return self.requests.chains.model_name
+
+    def cached_response(self, position_statement, prompt_hash=None):
+        """Function to get the cached response of a position statement, if any."""
+        if self.cache is None or self.force:
+            return None
+        response = self.cache.get(
+            self.model_name, prompt_hash or self.requests.format.prompt_hash, position_statement
         )
-        self.parser = JsonOutputParser()
-        self.chain = self.prompt | self.llm | self.parser
+        if response is not None:
+            response["usage"]["cached"] = True
+        return response
+
+    def cache_response(self, position_statement, response, prompt_hash=None):
+        """Function to store the response of a position statement in the cache."""
+        if self.cache is not None:
+            self.cache.put(
+                self.model_name,
+                prompt_hash or self.requests.format.prompt_hash,
+                position_statement,
+                response,
+            )
 
     def extract_policy(self, position_statement):
         """Function to extract the policy from a position statement."""
-        try:
-            start_time = time.time()
-            with get_openai_callback() as cb:
-                response = self.chain.invoke(
-                    {
-                        "instructions": self.instructions,
-                        "position_statement": position_statement,
-                    }
-                )
-                usage = {
-                    "total_tokens": cb.total_tokens,
-                    "prompt_tokens": cb.prompt_tokens,
-                    "completion_tokens": cb.completion_tokens,
-                    "total_cost": cb.total_cost,
-                }
-            end_time = time.time()
-            processing_time = end_time - start_time
-            usage["processing_time"] = processing_time
-
-            response = {
-                "criteria": response,
-                "usage": usage,
-            }
+        return self.requests.run(self.aextract_policy(position_statement))
+
+    async def aextract_policy(self, position_statement, limiter=None):
+        """Function to extract the policy from a position statement, asynchronously.
+
+        The request waits for its turn in the `limiter` shared by the run, if
+        any. The response is None if the extraction failed.
+        """
+        cached = self.cached_response(position_statement)
+        if cached is not None:
+            return cached
+        with reported_errors() as failure:
+            response = await self.requests.arequest_policy(
+                position_statement, limiter or self.requests.limiter
+            )
+            self.cache_response(position_statement, response)
             return response
-        except openai.AuthenticationError as exc:
-            print(f"OpenAI authentication error: {exc}")
+        self.failed_retries[position_statement] = failure["retries"]
+        return None
+
+    def stream_policy(self, position_statement, limiter=None):
+        """Function to stream the criteria of a position statement, as they are parsed.
+
+        Iterate over the returned stream with `for`, or `async for` (waiting for
+        its turn in the `limiter` shared by the run, if any), then get the
+        response from its `response` attribute.
+        """
+        return CriteriaStream(self, position_statement, limiter)
+
+    def rule_response(self, position_statement):
+        """Function to extract a simple position statement by rules, None if it needs the model."""
+        if not self.rules:
             return None
-        except openai.APIError as exc:
-            print(f"OpenAI API error: {exc}")
+        start_time = time.time()
+        criteria = extract_rules(position_statement)
+        if criteria is None:
             return None
-        except ValueError as exc:
-            print(f"Value error: {exc}")
+        usage = {
+            "total_tokens": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_cost": 0.0,
+            "processing_time": time.time() - start_time,
+            "retries": 0,
+            "rule_based": True,
+        }
+        return {"criteria": criteria, "usage": usage}
+
+    def statement_sections(self, position_statement):
+        """Function to split a position statement into the sections to extract."""
+        if not self.split_threshold:
+            return [position_statement]
+        return split_sections(position_statement, self.split_threshold)
+
+    async def aextract_sections(self, sections, limiter=None):
+        """Function to extract the sections of a position statement concurrently, merging them."""
+        start_time = time.time()
+        responses = await asyncio.gather(
+            *(self.aextract_policy(section, limiter) for section in sections)
+        )
+        if any(response is None for response in responses):
             return None
+        return {
+            "criteria": merge_criteria([response["criteria"] for response in responses]),
+            "usage": merge_usage(
+                [response["usage"] for response in responses], time.time() - start_time
+            ),
+        }
+
+    def extract_statement(self, position_statement):
+        """Function to extract a position statement, by rules if it is simple, in sections if it is long."""
+        return self.requests.run(self.aextract_statement(position_statement))
+
+    async def aextract_statement(self, position_statement, limiter=None):
+        """Function to extract a position statement, asynchronously."""
+        response = self.rule_response(position_statement)
+        if response is not None:
+            return response
+        sections = self.statement_sections(position_statement)
+        if len(sections) == 1:
+            return await self.aextract_policy(position_statement, limiter)
+        response = await self.aextract_sections(sections, limiter)
+        if response is None:
+            self.failed_retries[position_statement] = sum(
+                self.failed_retries.pop(section, 0) for section in sections
+            )
+        return response
+
+    def unpack_response(self, policies, keys, result, cb, start_time, retries=0):
+        """Function to split the criteria and the usage of a packed extraction per policy.
+
+        The response of a policy missing from the answer is None, as well as
+        the one of a policy whose compact criteria cannot be expanded, or whose
+        criteria fail the validation of a cascade.
+        """
+        packed = self.requests.build_response(result, cb, start_time, retries)
+        if not isinstance(result, dict):
+            print("Value error: the packed extraction is not a JSON object")
+            result = {}
+        found = [
+            index for index, key in enumerate(keys) if isinstance(result.get(key), list)
+        ]
+        responses = [None] * len(policies)
+        if not found:
+            return responses
+        usages = split_usage(
+            packed["usage"],
+            [policies[index]["content"] for index in found],
+            [result[keys[index]] for index in found],
+            self.model_name,
+        )
+        for index, usage in zip(found, usages):
+            responses[index] = self.requests.packed_response(
+                policies[index]["content"], result[keys[index]], usage
+            )
+            if responses[index] is not None:
+                self.cache_response(
+                    policies[index]["content"],
+                    responses[index],
+                    self.requests.format.packed_prompt_hash,
+                )
+        return responses
+
+    async def aextract_packed(self, policies, limiter=None):
+        """Function to extract several policies in one request, returning the responses in order.
 
-    def extract_policy_from_file(self, file_path: str, verbose: bool = False):
-        """Function to extract the policy from a JSON file."""
-        # Read the position statement from the json file
-        with open(file_path, encoding="utf-8") as file:
-            policies = json.load(file)
+        Cached policies are not sent again, and a policy missing from the answer
+        is extracted alone. With a cascade, the request is sent to the cascade
+        model, and the policies whose criteria fail the validation are
+        extracted alone, through the cascade.
+        """
+        responses = [
+            self.cached_response(policy["content"], self.requests.format.packed_prompt_hash)
+            for policy in policies
+        ]
+        pending = [index for index, response in enumerate(responses) if response is None]
+        if len(pending) == 1:
+            responses[pending[0]] = await self.aextract_policy(
+                policies[pending[0]]["content"], limiter
+            )
+        elif pending:
+            pending_policies = [policies[index] for index in pending]
+            keys, chain_input = self.requests.format.packed_chain_input(pending_policies)
+            with reported_errors() as failure:
+                unpacked = self.unpack_response(
+                    pending_policies,
+                    keys,
+                    *await self.requests.ainvoke_chain(
+                        chain_input,
+                        limiter or self.requests.limiter,
+                        self.requests.chains.cascade_chain,
+                    ),
+                )
+                for index, response in zip(pending, unpacked):
+                    responses[index] = response or await self.aextract_policy(
+                        policies[index]["content"], limiter
+                    )
+            if failure["retries"]:
+                # The retries of the packed request are counted once, with its first policy
+                self.failed_retries[pending_policies[0]["content"]] = failure["retries"]
+        return responses
 
+    def extract_group(self, policies, verbose: bool = False):
+        """Function to extract a group of policies, packed in one request if several."""
+        return self.requests.run(self.aextract_group(policies, verbose))
+
+    async def aextract_group(self, policies, verbose: bool = False, limiter=None):
+        """Function to extract a group of policies, packed in one request if several, asynchronously."""
         if verbose:
-            print(f"Extracting {len(policies)} policies from {file_path}")
+            for policy in policies:
+                print(f"-> Extracting policy for {policy['subject']}")
+        if len(policies) == 1:
+            return [await self.aextract_statement(policies[0]["content"], limiter)]
+        return await self.aextract_packed(policies, limiter)
 
-        # Extract the policy for each medical act
-        for policy in policies:
+    async def aextract_policies(
+        self,
+        policies,
+        concurrency: int,
+        verbose: bool = False,
+        groups=None,
+        on_response=None,
+        limiter=None,
+    ):
+        """Function to extract several policies concurrently, returning the responses in order.
+
+        `groups` lists the indices of the policies to pack in each request, by
+        default one request per policy. `on_response` is called with each policy
+        and its response as soon as it is extracted. The requests share the
+        `limiter` of the run, by default one of up to `concurrency` requests in
+        flight.
+        """
+        limiter = limiter or self.requests.run_limiter(concurrency)
+
+        async def extract(group):
+            group_policies = [policies[index] for index in group]
+            responses = await self.aextract_group(group_policies, verbose, limiter)
+            if on_response is not None:
+                for policy, response in zip(group_policies, responses):
+                    on_response(policy, response)
+            return responses
+
+        results = await asyncio.gather(
+            *(extract(group) for group in groups or single_groups(policies))
+        )
+        return [response for responses in results for response in responses]
+
+    def extract_policy_from_file(
+        self,
+        file_path: str,
+        verbose: bool = False,
+        concurrency: int = 1,
+        pack_budget: int = 0,
+    ):
+        """Function to extract the policy from a JSON file.
+
+        With a concurrency above 1, up to `concurrency` requests are sent at once.
+        With a packing budget, consecutive short position statements are packed
+        in one request, up to `pack_budget` statement tokens.
+
+        Policies that already have criteria for the model are skipped, unless
+        forced. Each extraction is logged as soon as it is done, so an
+        interrupted run resumes from the log instead of extracting again.
+        """
+        extraction = FileExtraction(self, file_path, verbose, pack_budget)
+        if concurrency > 1:
+            limiter = self.requests.run_limiter(concurrency)
+            self.requests.run(extraction.aextract(limiter))
+        else:
+            extraction.extract()
+
+    def extract_policy_from_folder(
+        self,
+        folder_path: str,
+        verbose: bool = False,
+        concurrency: int = 1,
+        pack_budget: int = 0,
+    ):
+        """Function to extract the policy from a folder containing multiple JSON files.
+
+        With a concurrency above 1, the files are extracted concurrently, with
+        up to `concurrency` requests in flight across all of them.
+        """
+        if concurrency > 1:
+            limiter = self.requests.run_limiter(concurrency)
+            self.requests.run(aextract_folder(self, folder_path, limiter, verbose, pack_budget))
             if verbose:
-                print(f"-> Extracting policy for {policy['subject']}")
-            position_statement = policy["content"]
-            response = self.extract_policy(position_statement)
-            criteria_entry = {
-                "model": self.model_name,
-                "criteria": response["criteria"],
-                "usage": response["usage"],
-            }
-            policy.setdefault("criteria", []).append(criteria_entry)
-
-        # Save the policies to a JSON file
-        with open(file_path, "w", encoding="utf-8") as file:
-            json.dump(policies, file, indent=2)
-
-    def extract_policy_from_folder(self, folder_path: str, verbose: bool = False):
-        """Function to extract the policy from a folder containing multiple JSON files."""
-        # Get all the json files in the folder
-        files = [
-            f
-            for f in os.listdir(folder_path)
-            if os.path.isfile(os.path.join(folder_path, f)) and f.endswith(".json")
-        ]
+                print(
+                    f"Up to {limiter.peak_in_flight} requests in flight, "
+                    f"{limiter.waited:.1f}s of waits for the rate limits, "
+                    f"{limiter.throttles} rate-limit errors"
+                )
+            return
 
         # Extract the policy for each file
-        for file in files:
-            file_path = os.path.join(folder_path, file)
-            self.extract_policy_from_file(file_path, verbose)
+        for file_path in data_files(folder_path):
+            self.extract_policy_from_file(file_path, verbose, concurrency, pack_budget)
+
+
+def check_arguments(parser, args):
+    """Function to reject the options that do not apply together."""
+    if not args.batch:
+        return
+    if is_local_model(args.model):
+        parser.error("--batch needs an OpenAI model")
+    if args.cascade:
+        parser.error("--batch does not support --cascade")
+    if args.compact:
+        parser.error("--batch does not support --compact")
+    if args.rules:
+        parser.error("--batch does not support --rules")
+    if args.pack_budget:
+        parser.error("--batch does not support --pack-budget")
+    if args.split_threshold:
+        parser.error("--batch does not support --split-threshold")
+
+
+def extract_string(extractor, position_statement: str, stream: bool = False):
+    """Function to print the criteria of a position statement, each one as soon as it is parsed if streamed."""
+    if not stream:
+        print(extractor.extract_statement(position_statement))
+        return
+    criteria_stream = extractor.stream_policy(position_statement)
+    for criterion in criteria_stream:
+        print(json.dumps(criterion, indent=2))
+    if criteria_stream.response is not None:
+        print(criteria_stream.response["usage"])
 
 
 def main():
@@ -139,7 +392,8 @@ def main():
         "--model",
         type=str,
         default="gpt-4o",
-        help="The model to use for the extraction.",
+        help="The model to use for the extraction, or local:<path> for a GGUF model "
+        "run by llama.cpp on the CPU.",
     )
 
     parser.add_argument(
@@ -161,21 +415,185 @@ def main():
         help="Print verbose output.",
     )
 
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="The maximum number of extraction requests in flight at once.",
+    )
+
+    parser.add_argument(
+        "--tokens-per-minute",
+        type=int,
+        default=0,
+        help="The maximum number of tokens sent per minute "
+        "(0 disables the limit).",
+    )
+
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help="The maximum number of retries of a failed request, on rate limits, "
+        "server and connection errors.",
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="The number of threads decoding a local model (0 for all the cores).",
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=DEFAULT_CONTEXT_SIZE,
+        help="The context, in tokens, of each request in flight on a local model.",
+    )
+
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=DEFAULT_CACHE_PATH,
+        help="The SQLite file caching the extractions, 'none' to disable the cache.",
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE // 2**20,
+        help="The maximum size of the cache, in MB.",
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Extract the policies again even when they already have criteria "
+        "for the model or their extraction is cached.",
+    )
+
+    parser.add_argument(
+        "--rules",
+        action="store_true",
+        help="Extract the simple position statements by rules, without the model.",
+    )
+
+    parser.add_argument(
+        "--cascade",
+        type=str,
+        help="A cheaper model to send each position statement to first, escalating "
+        "to --model the criteria failing the validation.",
+    )
+
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Have the model answer in a compact format, with short keys, necessity "
+        "codes and spans of the position statement, expanded back to the full format.",
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print each criteria object of --string as soon as it is parsed from "
+        "the streamed answer.",
+    )
+
+    parser.add_argument(
+        "--pack-budget",
+        type=int,
+        default=0,
+        help="Pack consecutive short position statements in one request, up to this "
+        "number of statement tokens (0 disables the packing).",
+    )
+
+    parser.add_argument(
+        "--split-threshold",
+        type=int,
+        default=0,
+        help="Extract the position statements longer than this number of characters "
+        "in sections, cut at their necessity headings (0 disables the split).",
+    )
+
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        help="Write the metrics of the run to this JSON file, and in the Prometheus "
+        "text format next to it (.prom).",
+    )
+
+    parser.add_argument(
+        "--batch",
+        type=str,
+        choices=["submit", "status", "collect", "run"],
+        help="Extract the policies of --data with the Batch API: submit the job, "
+        "check its status, collect its results, or run all three.",
+    )
+
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=30.0,
+        help="The interval, in seconds, between two status checks of a batch run.",
+    )
+
     args = parser.parse_args()
+    check_arguments(parser, args)
+
+    extractor = MedicalPolicyExtractor(
+        model_name=args.model,
+        cache=None if args.cache == "none" else ExtractionCache(args.cache, args.cache_size * 2**20),
+        force=args.force,
+        split_threshold=args.split_threshold,
+        tokens_per_minute=args.tokens_per_minute,
+        max_retries=args.max_retries,
+        # Each request in flight has its own slot on a local model
+        parallel=args.concurrency,
+        threads=args.threads,
+        context_size=args.context_size,
+        rules=args.rules,
+        cascade_model=args.cascade,
+        compact=args.compact,
+    )
 
-    extractor = MedicalPolicyExtractor(model_name=args.model)
+    if args.batch:
+        if not args.data or not os.path.exists(args.data):
+            print("The specified data path is invalid.")
+            return
+        job = BatchJob(extractor, args.data)
+        if args.batch == "submit":
+            job.submit()
+        elif args.batch == "status":
+            job.status()
+        elif args.batch == "collect":
+            job.collect()
+        else:
+            job.run(args.poll_interval)
+        return
 
     if args.data:
         if os.path.isfile(args.data):
-            extractor.extract_policy_from_file(args.data, verbose=args.verbose)
+            extractor.extract_policy_from_file(
+                args.data,
+                verbose=args.verbose,
+                concurrency=args.concurrency,
+                pack_budget=args.pack_budget,
+            )
         elif os.path.isdir(args.data):
-            extractor.extract_policy_from_folder(args.data, verbose=args.verbose)
+            extractor.extract_policy_from_folder(
+                args.data,
+                verbose=args.verbose,
+                concurrency=args.concurrency,
+                pack_budget=args.pack_budget,
+            )
         else:
             print("The specified data path is invalid.")
+        if args.metrics:
+            extractor.metrics.write(args.metrics)
         return
 
-    output = extractor.extract_policy(args.string)
-    print(output)
+    extract_string(extractor, args.string, args.stream)
 
 
 if __name__ == "__main__":